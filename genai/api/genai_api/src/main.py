@@ -14,14 +14,18 @@
 
 import os, sys
 import logging
-from fastapi import FastAPI
-from pydantic import BaseModel
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import FastAPI, Request, Query
+from pydantic import BaseModel, Field
+from fastapi.responses import Response, StreamingResponse, JSONResponse
 import io
 import json
+import time
 import requests
-from typing import List
+from typing import List, Literal
+from concurrent.futures import ThreadPoolExecutor
 from vertexai.language_models import ChatMessage
+from utils.traffic_capture import traffic_capture_from_env
+from utils.job_store import Job_Store, Job_Store_Full, Callback_Refused, check_callback_url, JOB_SUCCEEDED
 
 logging.basicConfig(
     level=logging.DEBUG,
@@ -52,6 +56,12 @@ tags_metadata = [
         "description": "The Image endpoint routes to a service that can be used to generate 2D images \
           based on a text prompt.",
     },
+    {
+        "name": "image_jobs",
+        "description": "The Image Jobs endpoints submit an image generation as an asynchronous job and \
+          return immediately with a job id. Poll the job, or pass a callback_url, and then download the \
+          image by id while the job is retained.",
+    },
     {
         "name": "npc_chat",
         "description": "The NPC Chat endpoint routes to a service that demonstrates using RAG to \
@@ -89,10 +99,75 @@ GENAI_CODE_ENDPOINT      = os.environ['GENAI_CODE_ENDPOINT']
 GENAI_IMAGE_ENDPOINT     = os.environ['GENAI_IMAGE_ENDPOINT']
 GENAI_NPC_CHAT_ENDPOINT  = os.environ['GENAI_NPC_CHAT_ENDPOINT']
 
+GENAI_IMAGE_JOB_WORKERS  = int(os.environ.get('GENAI_IMAGE_JOB_WORKERS', '8'))
+GENAI_IMAGE_JOB_MAX      = int(os.environ.get('GENAI_IMAGE_JOB_MAX', '1000'))
+GENAI_IMAGE_JOB_TTL      = int(os.environ.get('GENAI_IMAGE_JOB_TTL', '600'))
+GENAI_IMAGE_JOB_TIMEOUT  = float(os.environ.get('GENAI_IMAGE_JOB_TIMEOUT', '300'))
+# Hosts image job callbacks may be sent to, such as "hooks.example.com,*.example.org". Empty turns callbacks off.
+GENAI_IMAGE_CALLBACK_HOSTS = [host.strip() for host in os.environ.get('GENAI_IMAGE_CALLBACK_HOSTS', '').split(',') if host.strip()]
+
 
 headers = {"Content-Type": "application/json"}
 
 
+# Optional production traffic capture, enabled by setting GENAI_CAPTURE_PATH.
+# See replay_traffic.py for replaying the captured requests.
+traffic_capture = traffic_capture_from_env()
+
+
+@app.middleware("http")
+async def capture_traffic(request: Request, call_next):
+    if traffic_capture is not None and request.method == 'POST' and request.url.path.startswith('/genai') \
+            and traffic_capture.should_capture():
+        arrival_ts = time.time()
+        body = await request.body()
+        try:
+            payload = json.loads(body) if body else None
+        except ValueError:
+            payload = None
+        traffic_capture.record(arrival_ts, request.method, request.url.path, payload)
+    return await call_next(request)
+
+
+def upstream_json(response):
+    '''
+    Relays a backend JSON response with its status code, and Retry-After for
+    429s and 503s. A body that is not JSON, such as a proxy's HTML error page,
+    keeps the backend's error status; a success without JSON is a 502.
+    '''
+    retry_after = response.headers.get('retry-after') if response.status_code >= 400 else None
+    try:
+        status_code, content = response.status_code, json.loads(response.content)
+    except ValueError:
+        status_code = response.status_code if response.status_code >= 400 else 502
+        content = {'status': 'error', 'error': f'The backend returned a {response.status_code} response that is not JSON.'}
+    return JSONResponse(
+        status_code=status_code,
+        content=content,
+        headers={'Retry-After': retry_after} if retry_after else None,
+    )
+
+
+def proxy_sse(url, request_payload):
+    '''
+    Forwards a streaming request and relays the server-sent events as they
+    arrive, instead of waiting for the whole response.
+    '''
+    response = requests.post(url, headers=headers, json=request_payload, stream=True)
+    if response.status_code != 200:
+        return Response(content=response.content, status_code=response.status_code, media_type=response.headers.get('content-type'))
+    return StreamingResponse(relay(response), media_type='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def relay(response):
+    '''Yields a streamed backend response's body as it arrives.'''
+    # Closing the upstream connection when the caller goes away lets the
+    # backend abandon the generation.
+    with response:
+        for chunk in response.iter_content(chunk_size=None):
+            yield chunk
+
+
 class Payload_Vertex_Gemini(BaseModel):
     prompt: str
     max_output_tokens: int | None = 1024
@@ -101,6 +176,14 @@ class Payload_Vertex_Gemini(BaseModel):
     top_k: int | None = 40
     stop_sequences: list | None = None
     safety_settings: dict | None = None
+    # Earlier turns, oldest first: [{"role": "user" | "model", "text": "..."}]
+    message_history: List[dict] | None = []
+    # Images or documents sent ahead of the prompt: {"data": base64, "mime_type": ...}, {"hash": ...} or {"text": ...}
+    parts: List[dict] | None = []
+    # 'reject' or 'truncate' requests that are over the model's token limits, before generating
+    preflight: str | None = 'off'
+    # Model name or version, such as "gemini-1.0-pro-002". Defaults to the service's default model.
+    model: str | None = None
 
     model_config = {
         "json_schema_extra": {
@@ -117,15 +200,16 @@ class Payload_Vertex_Gemini(BaseModel):
     }
 
 
-
 class Payload_Chat(BaseModel):
     prompt: str
+    conversation_id: str | None = None
     context: str | None = ''
     message_history: List[ChatMessage] | None = []
     max_output_tokens: int | None = 1024
     temperature: float | None = 0.2
     top_p: float | None = 0.8
     top_k: int | None = 40
+    model: str | None = None
 
     model_config = {
         "json_schema_extra": {
@@ -149,6 +233,9 @@ class Payload_Text(BaseModel):
     temperature: float | None = 0.2
     top_p: float | None = 0.8
     top_k: int | None = 40
+    # 'reject' or 'truncate' requests that are over the model's token limits, before generating
+    preflight: str | None = 'off'
+    model: str | None = None
 
     model_config = {
         "json_schema_extra": {
@@ -165,12 +252,51 @@ class Payload_Text(BaseModel):
     }
 
 
+class Payload_Text_Batch(BaseModel):
+    # Each item has a prompt and optionally its own max_output_tokens, temperature, top_p or top_k
+    items: List[dict]
+    max_output_tokens: int | None = 1024
+    temperature: float | None = 0.2
+    top_p: float | None = 0.8
+    top_k: int | None = 40
+    preflight: str | None = 'off'
+    max_concurrency: int | None = None
+    model: str | None = None
+
+    model_config = {
+        "json_schema_extra": {
+            "examples": [
+                {
+                    "items": [
+                        {"prompt": "Describe a sword found in the final level."},
+                        {"prompt": "Describe a shield found in the final level.", "temperature": 0.8},
+                    ],
+                    "max_output_tokens": 256,
+                }
+            ]
+        }
+    }
+
+
+class Payload_Count_Tokens(BaseModel):
+    prompt: str
+    message_history: List[dict] | None = []
+    parts: List[dict] | None = []
+    model: str | None = None
+
+
+class Payload_Part(BaseModel):
+    data: str
+    mime_type: str
+
+
 class Payload_Code(BaseModel):
     prompt: str
     max_output_tokens: int | None = 1024
     temperature: float | None = 0.2
     top_p: float | None = 0.8
     top_k: int | None = 40
+    model: str | None = None
 
     model_config = {
         "json_schema_extra": {
@@ -187,10 +313,63 @@ class Payload_Code(BaseModel):
     }
 
 
+class Payload_Code_Chat(BaseModel):
+    prompt: str
+    conversation_id: str | None = None
+    context: str | None = ''
+    message_history: List[ChatMessage] | None = []
+    max_output_tokens: int | None = 1024
+    temperature: float | None = 0.2
+    model: str | None = None
+
+    model_config = {
+        "json_schema_extra": {
+            "examples": [
+                {
+                    "prompt": "Can you write a python function that sums two floats?",
+                    "conversation_id": "my-modding-session",
+                    "max_output_tokens": 1024,
+                    "temperature": 0.2,
+                }
+            ]
+        }
+    }
+
+
+class Payload_Code_Complete(BaseModel):
+    session_id: str
+    prefix: str
+    suffix: str | None = ''
+    seq: int | None = None
+    max_output_tokens: int | None = 64
+    temperature: float | None = 0.2
+    model: str | None = None
+
+    model_config = {
+        "json_schema_extra": {
+            "examples": [
+                {
+                    "session_id": "my-editor-tab",
+                    "prefix": "def sum_floats(a: float, b: float) -> float:\n    ",
+                    "suffix": "",
+                    "max_output_tokens": 64,
+                }
+            ]
+        }
+    }
+
+
 class Payload_Image(BaseModel):
     prompt: str
     number_of_images: int | None = 1
     seed: int | None = None
+    model: str | None = None
+    # png returns the first image. multipart (multipart/mixed), zip or json (a manifest of data: URLs) return them all.
+    response_format: Literal['png', 'multipart', 'zip', 'json'] | None = 'png'
+    # The image encoding. quality applies to webp and jpeg; max_dim shrinks images to fit in max_dim x max_dim.
+    format: Literal['png', 'webp', 'jpeg'] | None = 'png'
+    quality: int | None = Field(None, ge=1, le=100)
+    max_dim: int | None = Field(None, ge=16, le=4096)
 
     model_config = {
         "json_schema_extra": {
@@ -205,6 +384,25 @@ class Payload_Image(BaseModel):
     }
 
 
+class Payload_Image_Job(Payload_Image):
+    callback_url: str | None = None
+    # A job's result is a single image
+    response_format: Literal['png'] | None = 'png'
+
+    model_config = {
+        "json_schema_extra": {
+            "examples": [
+                {
+                    "prompt": "cartoon image of Mario and the Princess with the castle in the background",
+                    "number_of_images": 1,
+                    "seed": 12345,
+                    "callback_url": None,
+                }
+            ]
+        }
+    }
+
+
 class Payload_NPC_Chat(BaseModel):
     message: str
     from_id: int
@@ -246,10 +444,14 @@ def genai_gemini(payload: Payload_Vertex_Gemini):
             'top_k': payload.top_k,
             'stop_sequences': payload.stop_sequences,
             'safety_settings': payload.safety_settings,
+            'message_history': payload.message_history,
+            'parts': payload.parts,
+            'preflight': payload.preflight,
+            'model': payload.model,
         }
         response = requests.post(f'{GENAI_GEMINI_ENDPOINT}', headers=headers, json=request_payload)
         logging.debug(f'request_payload: {request_payload}')
-        return json.loads(response.content)
+        return upstream_json(response)
     except Exception as e:
         logging.exception(f'At /genai. {e}')
         return JSONResponse(
@@ -258,6 +460,78 @@ def genai_gemini(payload: Payload_Vertex_Gemini):
         )
 
 
+@app.post("/genai/stream", tags=["gemini-pro"])
+def genai_gemini_stream(payload: Payload_Vertex_Gemini):
+    '''
+    Google GenAI Gemini Multimodal model, streamed as server-sent events
+    '''
+    try:
+        request_payload = {
+            'prompt': payload.prompt,
+            'max_output_tokens': payload.max_output_tokens,
+            'temperature': payload.temperature,
+            'top_p': payload.top_p,
+            'top_k': payload.top_k,
+            'stop_sequences': payload.stop_sequences,
+            'safety_settings': payload.safety_settings,
+            'message_history': payload.message_history,
+            'parts': payload.parts,
+            'preflight': payload.preflight,
+            'model': payload.model,
+        }
+        logging.debug(f'request_payload: {request_payload}')
+        return proxy_sse(f'{GENAI_GEMINI_ENDPOINT}/stream', request_payload)
+    except Exception as e:
+        logging.exception(f'At /genai/stream. {e}')
+        return JSONResponse(
+            status_code=400,
+            content={'status': 'exception calling google genai gemini endpoint'},
+        )
+
+
+@app.post("/genai/count_tokens", tags=["gemini-pro"])
+def genai_gemini_count_tokens(payload: Payload_Count_Tokens):
+    try:
+        response = requests.post(f'{GENAI_GEMINI_ENDPOINT}/count_tokens', headers=headers, json=payload.model_dump())
+        return upstream_json(response)
+    except Exception as e:
+        logging.exception(f'At /genai/count_tokens. {e}')
+        return JSONResponse(
+            status_code=400,
+            content={'status': 'exception calling google genai gemini endpoint'},
+        )
+
+
+@app.post("/genai/parts", tags=["gemini-pro"])
+def genai_gemini_upload_part(payload: Payload_Part):
+    '''
+    Uploads an image or document once. Later Gemini requests reference it as
+    {"hash": ...}, the sha256 of its bytes, instead of sending it again.
+    '''
+    try:
+        response = requests.post(f'{GENAI_GEMINI_ENDPOINT}/parts', headers=headers, json=payload.model_dump())
+        return upstream_json(response)
+    except Exception as e:
+        logging.exception(f'At /genai/parts. {e}')
+        return JSONResponse(
+            status_code=400,
+            content={'status': 'exception calling google genai gemini endpoint'},
+        )
+
+
+@app.get("/genai/parts/{part_hash}", tags=["gemini-pro"])
+def genai_gemini_get_part(part_hash: str):
+    try:
+        response = requests.get(f'{GENAI_GEMINI_ENDPOINT}/parts/{part_hash}')
+        return upstream_json(response)
+    except Exception as e:
+        logging.exception(f'At /genai/parts/{part_hash}. {e}')
+        return JSONResponse(
+            status_code=400,
+            content={'status': 'exception calling google genai gemini endpoint'},
+        )
+
+
 @app.post("/genai/text", tags=["text"])
 def genai_text(payload: Payload_Text):
     try:
@@ -267,10 +541,12 @@ def genai_text(payload: Payload_Text):
             'temperature': payload.temperature,
             'top_p': payload.top_p,
             'top_k': payload.top_k,
+            'preflight': payload.preflight,
+            'model': payload.model,
         }
         response = requests.post(f'{GENAI_TEXT_ENDPOINT}', headers=headers, json=request_payload)
         logging.debug(f'request_payload: {request_payload}')
-        return json.loads(response.content)
+        return upstream_json(response)
     except Exception as e:
         logging.exception(f'At /genai/text. {e}')
         return JSONResponse(
@@ -279,21 +555,77 @@ def genai_text(payload: Payload_Text):
         )
 
 
+@app.post("/genai/text/stream", tags=["text"])
+def genai_text_stream(payload: Payload_Text):
+    try:
+        request_payload = {
+            'prompt': payload.prompt,
+            'max_output_tokens': payload.max_output_tokens,
+            'temperature': payload.temperature,
+            'top_p': payload.top_p,
+            'top_k': payload.top_k,
+            'preflight': payload.preflight,
+            'model': payload.model,
+        }
+        logging.debug(f'request_payload: {request_payload}')
+        return proxy_sse(f'{GENAI_TEXT_ENDPOINT}/stream', request_payload)
+    except Exception as e:
+        logging.exception(f'At /genai/text/stream. {e}')
+        return JSONResponse(
+            status_code=400,
+            content={'status': 'exception calling endpoint'},
+        )
+
+
+@app.post("/genai/text/count_tokens", tags=["text"])
+def genai_text_count_tokens(payload: Payload_Count_Tokens):
+    try:
+        response = requests.post(f'{GENAI_TEXT_ENDPOINT}/count_tokens', headers=headers, json={'prompt': payload.prompt, 'model': payload.model})
+        return upstream_json(response)
+    except Exception as e:
+        logging.exception(f'At /genai/text/count_tokens. {e}')
+        return JSONResponse(
+            status_code=400,
+            content={'status': 'exception calling endpoint'},
+        )
+
+
+@app.post("/genai/text/batch", tags=["text"])
+def genai_text_batch(payload: Payload_Text_Batch):
+    '''
+    Runs many prompts in one call. Results are returned in order, with an
+    {"error": ...} entry for any item that failed.
+    '''
+    try:
+        request_payload = payload.model_dump(exclude_none=True)
+        logging.debug(f'batch of {len(payload.items)} items')
+        response = requests.post(f'{GENAI_TEXT_ENDPOINT}/batch', headers=headers, json=request_payload)
+        return upstream_json(response)
+    except Exception as e:
+        logging.exception(f'At /genai/text/batch. {e}')
+        return JSONResponse(
+            status_code=400,
+            content={'status': 'exception calling endpoint'},
+        )
+
+
 @app.post("/genai/chat", tags=["chat"])
 def genai_chat(payload: Payload_Chat):
     try:
         request_payload = {
             'prompt': payload.prompt,
+            'conversation_id': payload.conversation_id,
             'context': payload.context,
-            'message_history': payload.message_history,
+            'message_history': payload.model_dump()['message_history'],
             'max_output_tokens': payload.max_output_tokens,
             'temperature': payload.temperature,
             'top_p': payload.top_p,
             'top_k': payload.top_k,
+            'model': payload.model,
         }
         logging.debug(f'request_payload: {request_payload}')
         response = requests.post(f'{GENAI_CHAT_ENDPOINT}', headers=headers, json=request_payload)
-        return json.loads(response.content)
+        return upstream_json(response)
     except Exception as e:
         logging.exception(f'At /genai/chat. {e}')
         return JSONResponse(
@@ -302,6 +634,30 @@ def genai_chat(payload: Payload_Chat):
         )
 
 
+@app.post("/genai/chat/stream", tags=["chat"])
+def genai_chat_stream(payload: Payload_Chat):
+    try:
+        request_payload = {
+            'prompt': payload.prompt,
+            'conversation_id': payload.conversation_id,
+            'context': payload.context,
+            'message_history': payload.model_dump()['message_history'],
+            'max_output_tokens': payload.max_output_tokens,
+            'temperature': payload.temperature,
+            'top_p': payload.top_p,
+            'top_k': payload.top_k,
+            'model': payload.model,
+        }
+        logging.debug(f'request_payload: {request_payload}')
+        return proxy_sse(f'{GENAI_CHAT_ENDPOINT}/stream', request_payload)
+    except Exception as e:
+        logging.exception(f'At /genai/chat/stream. {e}')
+        return JSONResponse(
+            status_code=400,
+            content={'status': 'exception calling endpoint'},
+        )
+
+
 @app.post("/genai/code", tags=["code"])
 def genai_code(payload: Payload_Code):
     try:
@@ -311,10 +667,11 @@ def genai_code(payload: Payload_Code):
             'temperature': payload.temperature,
             'top_p': payload.top_p,
             'top_k': payload.top_k,
+            'model': payload.model,
         }
         logging.debug(f'request_payload: {request_payload}')
         response = requests.post(f'{GENAI_CODE_ENDPOINT}', headers=headers, json=request_payload)
-        return json.loads(response.content)
+        return upstream_json(response)
     except Exception as e:
         logging.exception(f'At /vertex_llm_code. {e}')
         return JSONResponse(
@@ -323,6 +680,95 @@ def genai_code(payload: Payload_Code):
         )
 
 
+@app.post("/genai/code/stream", tags=["code"])
+def genai_code_stream(payload: Payload_Code):
+    try:
+        request_payload = {
+            'prompt': payload.prompt,
+            'max_output_tokens': payload.max_output_tokens,
+            'temperature': payload.temperature,
+            'top_p': payload.top_p,
+            'top_k': payload.top_k,
+            'model': payload.model,
+        }
+        logging.debug(f'request_payload: {request_payload}')
+        return proxy_sse(f'{GENAI_CODE_ENDPOINT}/stream', request_payload)
+    except Exception as e:
+        logging.exception(f'At /genai/code/stream. {e}')
+        return JSONResponse(
+            status_code=400,
+            content={'status': 'exception calling endpoint.'},
+        )
+
+
+@app.post("/genai/code/complete", tags=["code"])
+def genai_code_complete(payload: Payload_Code_Complete):
+    try:
+        request_payload = {
+            'session_id': payload.session_id,
+            'prefix': payload.prefix,
+            'suffix': payload.suffix,
+            'seq': payload.seq,
+            'max_output_tokens': payload.max_output_tokens,
+            'temperature': payload.temperature,
+            'model': payload.model,
+        }
+        logging.debug(f'request_payload: {request_payload}')
+        response = requests.post(f'{GENAI_CODE_ENDPOINT}/complete', headers=headers, json=request_payload)
+        return upstream_json(response)
+    except Exception as e:
+        logging.exception(f'At /genai/code/complete. {e}')
+        return JSONResponse(
+            status_code=400,
+            content={'status': 'exception calling endpoint.'},
+        )
+
+
+@app.post("/genai/code/chat", tags=["code"])
+def genai_code_chat(payload: Payload_Code_Chat):
+    try:
+        request_payload = {
+            'prompt': payload.prompt,
+            'conversation_id': payload.conversation_id,
+            'context': payload.context,
+            'message_history': payload.model_dump()['message_history'],
+            'max_output_tokens': payload.max_output_tokens,
+            'temperature': payload.temperature,
+            'model': payload.model,
+        }
+        logging.debug(f'request_payload: {request_payload}')
+        response = requests.post(f'{GENAI_CODE_ENDPOINT}/chat', headers=headers, json=request_payload)
+        return upstream_json(response)
+    except Exception as e:
+        logging.exception(f'At /genai/code/chat. {e}')
+        return JSONResponse(
+            status_code=400,
+            content={'status': 'exception calling endpoint.'},
+        )
+
+
+@app.post("/genai/code/chat/stream", tags=["code"])
+def genai_code_chat_stream(payload: Payload_Code_Chat):
+    try:
+        request_payload = {
+            'prompt': payload.prompt,
+            'conversation_id': payload.conversation_id,
+            'context': payload.context,
+            'message_history': payload.model_dump()['message_history'],
+            'max_output_tokens': payload.max_output_tokens,
+            'temperature': payload.temperature,
+            'model': payload.model,
+        }
+        logging.debug(f'request_payload: {request_payload}')
+        return proxy_sse(f'{GENAI_CODE_ENDPOINT}/chat/stream', request_payload)
+    except Exception as e:
+        logging.exception(f'At /genai/code/chat/stream. {e}')
+        return JSONResponse(
+            status_code=400,
+            content={'status': 'exception calling endpoint.'},
+        )
+
+
 @app.post("/genai/image", tags=["image"])
 def genai_image(payload: Payload_Image):
     try:
@@ -330,11 +776,15 @@ def genai_image(payload: Payload_Image):
             'prompt': payload.prompt,
             'number_of_images': payload.number_of_images,
             'seed': payload.seed,
+            'model': payload.model,
+            'response_format': payload.response_format,
+            'format': payload.format,
+            'quality': payload.quality,
+            'max_dim': payload.max_dim,
         }
         logging.debug(f'request_payload: {request_payload}')
-        images = requests.post(f'{GENAI_IMAGE_ENDPOINT}', headers=headers, json=request_payload)
-        # Return the first image of the list
-        return StreamingResponse(io.BytesIO(images.content), media_type="image/png")
+        images = requests.post(f'{GENAI_IMAGE_ENDPOINT}', headers=headers, json=request_payload, stream=True)
+        return relay_image(images)
     except Exception as e:
         logging.exception(f'At /genai/image. {e}')
         return JSONResponse(
@@ -343,6 +793,140 @@ def genai_image(payload: Payload_Image):
         )
 
 
+@app.get("/genai/image", tags=["image"])
+def genai_image_get(
+        request: Request,
+        prompt: str,
+        number_of_images: int = 1,
+        seed: int = None,
+        model: str = None,
+        response_format: Literal['png', 'multipart', 'zip', 'json'] = 'png',
+        format: Literal['png', 'webp', 'jpeg'] = 'png',
+        quality: int = Query(None, ge=1, le=100),
+        max_dim: int = Query(None, ge=16, le=4096),
+    ):
+    '''
+    The GET form of /genai/image, for browsers and CDNs. Seeded images come
+    with an ETag and a long Cache-Control, and a revalidation with
+    If-None-Match is answered 304 without generating the image again.
+    '''
+    try:
+        params = {
+            'prompt': prompt,
+            'number_of_images': number_of_images,
+            'seed': seed,
+            'model': model,
+            'response_format': response_format,
+            'format': format,
+            'quality': quality,
+            'max_dim': max_dim,
+        }
+        if_none_match = request.headers.get('if-none-match')
+        images = requests.get(
+            f'{GENAI_IMAGE_ENDPOINT}',
+            params={name: value for name, value in params.items() if value is not None},
+            headers={'If-None-Match': if_none_match} if if_none_match else None,
+            stream=True,
+        )
+        return relay_image(images)
+    except Exception as e:
+        logging.exception(f'At GET /genai/image. {e}')
+        return JSONResponse(
+            status_code=400,
+            content={'status': 'exception calling endpoint'},
+        )
+
+
+# Headers of an image response that are passed on to the caller, so browsers and CDNs can cache it
+RELAYED_IMAGE_HEADERS = ('content-disposition', 'etag', 'cache-control')
+
+
+def relay_image(images):
+    '''Relays an image service response as it arrives, in whichever format the image service returned.'''
+    relayed_headers = {name: images.headers[name] for name in RELAYED_IMAGE_HEADERS if images.headers.get(name)}
+    if images.status_code == 304:
+        images.close()
+        return Response(status_code=304, headers=relayed_headers)
+    if images.status_code != 200:
+        return upstream_json(images)
+    return StreamingResponse(relay(images), media_type=images.headers.get('content-type', 'image/png'), headers=relayed_headers)
+
+
+# Image jobs are held in memory, so they are only visible on the replica that accepted them.
+image_jobs = Job_Store(max_jobs=GENAI_IMAGE_JOB_MAX, ttl_seconds=GENAI_IMAGE_JOB_TTL)
+image_job_executor = ThreadPoolExecutor(max_workers=GENAI_IMAGE_JOB_WORKERS, thread_name_prefix='image-job')
+
+
+def run_image_job(job, request_payload, image_url):
+    image_jobs.mark_running(job)
+    try:
+        images = requests.post(f'{GENAI_IMAGE_ENDPOINT}', headers=headers, json=request_payload, timeout=(10, GENAI_IMAGE_JOB_TIMEOUT))
+        images.raise_for_status()
+        media_type = images.headers.get('content-type', '')
+        if not media_type.startswith('image/'):
+            raise ValueError(f'image endpoint returned {media_type or "no content type"} instead of an image')
+        image_jobs.complete(job, images.content, media_type)
+    except Exception as e:
+        logging.exception(f'At image job {job.job_id}. {e}')
+        image_jobs.fail(job, str(e))
+
+    if job.callback_url:
+        try:
+            # Checked again, since the host's DNS may have changed since the job was submitted
+            check_callback_url(job.callback_url, GENAI_IMAGE_CALLBACK_HOSTS)
+            requests.post(job.callback_url, headers=headers, json={**job.to_dict(), 'image_url': image_url}, timeout=10, allow_redirects=False)
+        except Exception as e:
+            logging.warning(f'Callback for image job {job.job_id} to {job.callback_url} failed. {e}')
+
+
+@app.post("/genai/image/jobs", tags=["image_jobs"], status_code=202)
+def genai_image_job_submit(payload: Payload_Image_Job, request: Request):
+    request_payload = {
+        'prompt': payload.prompt,
+        'number_of_images': payload.number_of_images,
+        'seed': payload.seed,
+        'model': payload.model,
+        'format': payload.format,
+        'quality': payload.quality,
+        'max_dim': payload.max_dim,
+    }
+    logging.debug(f'request_payload: {request_payload}')
+    if payload.callback_url:
+        try:
+            check_callback_url(payload.callback_url, GENAI_IMAGE_CALLBACK_HOSTS)
+        except Callback_Refused as e:
+            return JSONResponse(status_code=400, content={'status': str(e)})
+    try:
+        job = image_jobs.create(callback_url=payload.callback_url)
+    except Job_Store_Full as e:
+        return JSONResponse(
+            status_code=503,
+            content={'status': f'image job queue is full. {e}'},
+            headers={'Retry-After': '5'},
+        )
+    image_url = str(request.url_for('genai_image_job_result', job_id=job.job_id))
+    image_job_executor.submit(run_image_job, job, request_payload, image_url)
+    return {**job.to_dict(), 'image_url': image_url}
+
+
+@app.get("/genai/image/jobs/{job_id}", tags=["image_jobs"])
+def genai_image_job_status(job_id: str, request: Request):
+    job = image_jobs.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={'status': f'unknown or expired job {job_id}'})
+    return {**job.to_dict(), 'image_url': str(request.url_for('genai_image_job_result', job_id=job_id))}
+
+
+@app.get("/genai/image/jobs/{job_id}/image", tags=["image_jobs"])
+def genai_image_job_result(job_id: str):
+    job = image_jobs.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={'status': f'unknown or expired job {job_id}'})
+    if job.status != JOB_SUCCEEDED:
+        return JSONResponse(status_code=409, content=job.to_dict())
+    return Response(content=job.result, media_type=job.media_type)
+
+
 @app.post("/genai/npc_chat", tags=["npc_chat"])
 def genai_npc_chat(payload: Payload_NPC_Chat):
     try:
@@ -0,0 +1,132 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Replays traffic captured by the GenAI API (GENAI_CAPTURE_PATH) against a target
+endpoint, preserving the captured inter-arrival times scaled by --speed, and
+reports latency percentiles and throughput.
+
+    python replay_traffic.py --target http://localhost:7777 --speed 4 capture.jsonl capture.jsonl.1
+'''
+
+import sys
+import json
+import math
+import time
+import logging
+import argparse
+import requests
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+
+
+def load_records(paths, limit=None):
+    records = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    records.append(json.loads(line))
+    records.sort(key=lambda r: r['ts'])
+    return records[:limit] if limit else records
+
+
+def percentile(sorted_values, pct):
+    '''Nearest-rank percentile of an already sorted list.'''
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def send(session, target, record, scheduled, timeout):
+    try:
+        resp = session.request(
+            record.get('method', 'POST'),
+            url=target.rstrip('/') + record['route'],
+            json=record['payload'],
+            timeout=timeout,
+        )
+        status = resp.status_code
+    except requests.RequestException as e:
+        logging.debug(f'Request to {record["route"]} failed. {e}')
+        status = None
+    # Latency is measured from the scheduled send time, so client-side queueing
+    # when --concurrency is saturated shows up instead of being hidden.
+    return status, time.perf_counter() - scheduled
+
+
+def replay(records, target, speed=1.0, concurrency=64, timeout=120):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    first_ts = records[0]['ts'] if records else 0
+    start = time.perf_counter()
+    futures = []
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for record in records:
+            offset = (record['ts'] - first_ts) / speed if speed > 0 else 0
+            scheduled = start + offset
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(pool.submit(send, session, target, record, scheduled, timeout))
+        results = [f.result() for f in futures]
+    elapsed = time.perf_counter() - start
+    return results, elapsed
+
+
+def summarize(results, elapsed):
+    latencies = sorted(latency for _, latency in results)
+    statuses = Counter(str(status) for status, _ in results)
+    ok = sum(count for status, count in statuses.items() if status.startswith('2'))
+    return {
+        'requests': len(results),
+        'ok': ok,
+        'errors': len(results) - ok,
+        'status_codes': dict(statuses),
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(results) / elapsed, 3) if elapsed > 0 else 0.0,
+        'goodput_rps': round(ok / elapsed, 3) if elapsed > 0 else 0.0,
+        'latency_s': {
+            'p50': round(percentile(latencies, 50), 4),
+            'p90': round(percentile(latencies, 90), 4),
+            'p95': round(percentile(latencies, 95), 4),
+            'p99': round(percentile(latencies, 99), 4),
+            'max': round(latencies[-1], 4) if latencies else 0.0,
+        },
+    }
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Replay captured GenAI API traffic against a target endpoint.")
+    parser.add_argument("captures", nargs="+", help="Capture JSONL files, including rotated files such as capture.jsonl.1")
+    parser.add_argument("--target", required=True, help="Base URL of the target, such as http://localhost:7777")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed multiplier. 1 is real time, 4 is 4x faster, 0 sends as fast as possible")
+    parser.add_argument("--concurrency", type=int, default=64, help="Maximum number of requests in flight")
+    parser.add_argument("--timeout", type=float, default=120, help="Per-request timeout in seconds")
+    parser.add_argument("--limit", type=int, default=None, help="Only replay the first N captured requests")
+    args = parser.parse_args()
+
+    records = load_records(args.captures, limit=args.limit)
+    logging.info(f'Replaying {len(records)} requests against {args.target} at {args.speed}x')
+
+    results, elapsed = replay(records, args.target, speed=args.speed, concurrency=args.concurrency, timeout=args.timeout)
+    logging.info(json.dumps(summarize(results, elapsed), indent=2))
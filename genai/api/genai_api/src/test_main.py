@@ -122,6 +122,53 @@ def test_genai_code(mock_post):
     mock_post.assert_called_once()
 
 
+@mock.patch('requests.post')
+def test_genai_text_upstream_not_json(mock_post):
+
+    # A proxy in front of the backend answers with an HTML error page
+    mock_response = mock.Mock()
+    mock_response.status_code = 503
+    mock_response.content = b'<html><body>503 Service Temporarily Unavailable</body></html>'
+    mock_response.headers = {'content-type': 'text/html', 'retry-after': '5'}
+    mock_post.return_value = mock_response
+
+    response = client.post("/genai/text", json={"prompt": "test prompt"})
+
+    assert response.status_code == 503
+    assert response.headers['retry-after'] == '5'
+    assert response.json()['status'] == 'error' and '503' in response.json()['error']
+
+    # A success without JSON is the backend's fault, not the caller's
+    mock_response.status_code = 200
+    mock_response.content = b'OK'
+    mock_response.headers = {'content-type': 'text/plain'}
+    assert client.post("/genai/text", json={"prompt": "test prompt"}).status_code == 502
+
+
+@mock.patch('requests.post')
+def test_genai_text_stream(mock_post):
+
+    # The backend streams server-sent events, relayed to the caller chunk by chunk
+    events = [b'data: {"text": "Hello"}\n\n', b'data: {"text": " world"}\n\n', b'data: [DONE]\n\n']
+    mock_response = mock.MagicMock()
+    mock_response.status_code = 200
+    mock_response.iter_content.return_value = iter(events)
+    mock_post.return_value = mock_response
+
+    payload = {
+        "prompt": "test prompt",
+        "max_output_tokens": 1024,
+    }
+
+    response = client.post("/genai/text/stream", json=payload)
+
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/event-stream')
+    assert response.content == b''.join(events)
+    assert mock_post.call_args.args[0].endswith('/stream')
+    assert mock_post.call_args.kwargs['stream'] is True
+
+
 @mock.patch('requests.post')
 def test_genai_image(mock_post):
 
@@ -129,10 +176,11 @@ def test_genai_image(mock_post):
     expected_response = {'mocked_key': 'mocked_value'}
     mock_response_content = json.dumps(expected_response).encode()
 
-    # Create a mock response object with the necessary attributes
-    mock_response = mock.Mock()
+    # Create a mock response object with the necessary attributes. The image is relayed as it streams in.
+    mock_response = mock.MagicMock()
     mock_response.status_code = 200
-    mock_response.content = mock_response_content
+    mock_response.headers = {'content-type': 'image/png'}
+    mock_response.iter_content.return_value = iter([mock_response_content])
 
     # Set the mock object to the patched function
     mock_post.return_value = mock_response
@@ -153,3 +201,211 @@ def test_genai_image(mock_post):
     mock_post.assert_called_once()
 
 
+@mock.patch('requests.post')
+def test_genai_image_all_images(mock_post):
+
+    # Every image of the generation, in the format the image service chose, passed through unchanged
+    parts = [b'PK\x03\x04 first image', b'PK\x03\x04 second image', b'PK\x05\x06']
+    mock_response = mock.MagicMock()
+    mock_response.status_code = 200
+    mock_response.headers = {'content-type': 'application/zip', 'content-disposition': 'attachment; filename="images.zip"'}
+    mock_response.iter_content.return_value = iter(parts)
+    mock_post.return_value = mock_response
+
+    response = client.post("/genai/image", json={"prompt": "test prompt", "number_of_images": 2, "response_format": "zip"})
+
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/zip'
+    assert response.headers['content-disposition'] == 'attachment; filename="images.zip"'
+    assert response.content == b''.join(parts)
+    assert mock_post.call_args.kwargs['json']['response_format'] == 'zip'
+    assert mock_post.call_args.kwargs['stream'] is True
+
+
+
+@mock.patch('requests.post')
+def test_genai_traffic_capture(mock_post, tmp_path):
+    import main
+    from utils.traffic_capture import Traffic_Capture
+
+    # Create a mock response object with the necessary attributes
+    mock_response = mock.Mock()
+    mock_response.status_code = 200
+    mock_response.content = json.dumps({'mocked_key': 'mocked_value'}).encode()
+    mock_post.return_value = mock_response
+
+    # Capture every request, with redaction, into a temporary file
+    capture_path = tmp_path / 'capture.jsonl'
+    capture = Traffic_Capture(str(capture_path), sample_rate=1.0, redact_payloads=True)
+
+    payload = {
+        "prompt": "a secret prompt",
+        "max_output_tokens": 1024,
+    }
+
+    with mock.patch.object(main, 'traffic_capture', capture):
+        response = client.post("/genai/text", json=payload)
+        client.get("/genai_health")
+    capture.close()
+
+    # Assertions
+    assert response.status_code == 200
+    records = [json.loads(line) for line in capture_path.read_text().splitlines()]
+    assert len(records) == 1
+    assert records[0]['route'] == '/genai/text'
+    assert records[0]['payload']['max_output_tokens'] == 1024
+    assert records[0]['payload']['prompt'] != payload['prompt']
+    assert len(records[0]['payload']['prompt']) == len(payload['prompt'])
+
+
+@mock.patch('requests.post')
+def test_genai_traffic_capture_redacts_gemini_parts(mock_post, tmp_path):
+    import main
+    import base64
+    from utils.traffic_capture import Traffic_Capture
+
+    mock_response = mock.Mock()
+    mock_response.status_code = 200
+    mock_response.content = json.dumps('a reply').encode()
+    mock_post.return_value = mock_response
+
+    capture_path = tmp_path / 'capture.jsonl'
+    capture = Traffic_Capture(str(capture_path), sample_rate=1.0, redact_payloads=True)
+
+    image = base64.b64encode(b'private photo bytes').decode()
+    payload = {
+        "prompt": "who is in this photo",
+        "message_history": [{"role": "user", "text": "my address is 1 Main St"}, {"role": "model", "text": "noted"}],
+        "parts": [{"data": image, "mime_type": "image/png"}, {"text": "my phone number"}],
+        "stop_sequences": ["secret stop"],
+        "temperature": 0.3,
+        "model": "gemini-pro",
+    }
+
+    with mock.patch.object(main, 'traffic_capture', capture):
+        response = client.post("/genai", json=payload)
+    capture.close()
+
+    assert response.status_code == 200
+    captured = capture_path.read_text()
+    for user_content in ('who is in this photo', '1 Main St', 'noted', image, 'phone', 'secret stop'):
+        assert user_content not in captured
+    record = json.loads(captured)['payload']
+    # Settings are kept, and redacted text and data keep their sizes
+    assert record['temperature'] == 0.3 and record['model'] == 'gemini-pro'
+    assert record['message_history'][0]['role'] == 'user'
+    assert record['parts'][0]['mime_type'] == 'image/png'
+    assert len(base64.b64decode(record['parts'][0]['data'])) == len(b'private photo bytes')
+    assert len(record['message_history'][0]['text']) == len(payload['message_history'][0]['text'])
+
+
+@mock.patch('requests.post')
+def test_genai_traffic_capture_redacts_code_completion(mock_post, tmp_path):
+    import main
+    from utils.traffic_capture import Traffic_Capture
+
+    mock_response = mock.Mock()
+    mock_response.status_code = 200
+    mock_response.content = json.dumps({'text': 'return a + b', 'seq': 3}).encode()
+    mock_post.return_value = mock_response
+
+    capture_path = tmp_path / 'capture.jsonl'
+    capture = Traffic_Capture(str(capture_path), sample_rate=1.0, redact_payloads=True)
+
+    payload = {
+        "session_id": "editor-1",
+        "prefix": "API_KEY = 'sk-private'\ndef add(a, b):\n    ",
+        "suffix": "\n\nprint(add(1, 2))",
+        "seq": 3,
+    }
+
+    with mock.patch.object(main, 'traffic_capture', capture):
+        response = client.post("/genai/code/complete", json=payload)
+    capture.close()
+
+    assert response.status_code == 200
+    captured = capture_path.read_text()
+    assert 'sk-private' not in captured and 'def add' not in captured and 'print' not in captured
+    record = json.loads(captured)['payload']
+    assert record['session_id'] == 'editor-1' and record['seq'] == 3
+    assert len(record['prefix']) == len(payload['prefix']) and len(record['suffix']) == len(payload['suffix'])
+
+
+@mock.patch('requests.post')
+def test_genai_image_job(mock_post):
+    import time
+
+    # Create a mock image response
+    mock_response = mock.Mock()
+    mock_response.status_code = 200
+    mock_response.content = b'mocked png bytes'
+    mock_response.headers = {'content-type': 'image/png'}
+    mock_post.return_value = mock_response
+
+    # Payload for the POST request
+    payload = {
+        "prompt": "test prompt",
+        "number_of_images": 1,
+        "seed": 12345,
+    }
+
+    # Submit the job and wait for the worker to finish it
+    response = client.post("/genai/image/jobs", json=payload)
+    assert response.status_code == 202
+    job_id = response.json()['job_id']
+    for _ in range(100):
+        if client.get(f"/genai/image/jobs/{job_id}").json()['status'] == 'succeeded':
+            break
+        time.sleep(0.01)
+
+    # Assertions
+    response = client.get(f"/genai/image/jobs/{job_id}/image")
+    assert response.status_code == 200
+    assert response.content == b'mocked png bytes'
+    assert client.get("/genai/image/jobs/unknown").status_code == 404
+    mock_post.assert_called_once()
+
+
+def test_genai_image_job_callback_url_is_checked():
+    from utils.job_store import check_callback_url, Callback_Refused
+
+    payload = {"prompt": "test prompt", "callback_url": "http://metadata.google.internal/computeMetadata/v1/"}
+    response = client.post("/genai/image/jobs", json=payload)
+    assert response.status_code == 400
+
+    def getaddrinfo(address):
+        return mock.patch('socket.getaddrinfo', return_value=[(2, 1, 6, '', (address, 443))])
+
+    for url, address in (
+        ('https://hooks.example.com/done', '169.254.169.254'),  # The metadata server
+        ('https://hooks.example.com/done', '10.0.0.7'),         # A cluster address
+        ('https://other.example.org/done', '93.184.216.34'),    # Not an allowed host
+        ('http://hooks.example.com/done', '93.184.216.34'),     # Not https
+    ):
+        with getaddrinfo(address):
+            try:
+                check_callback_url(url, ['hooks.example.com'])
+                assert False, f'{url} at {address} was allowed'
+            except Callback_Refused:
+                pass
+    with getaddrinfo('93.184.216.34'):
+        check_callback_url('https://a.hooks.example.com/done', ['*.hooks.example.com'])
+
+
+@mock.patch('requests.get')
+def test_genai_image_get_revalidation(mock_get):
+
+    # A revalidation is forwarded, and the image service's 304 and validators are passed back
+    etag = '"0123abcd"'
+    mock_response = mock.MagicMock()
+    mock_response.status_code = 304
+    mock_response.headers = {'etag': etag, 'cache-control': 'public, max-age=31536000, immutable'}
+    mock_get.return_value = mock_response
+
+    response = client.get("/genai/image", params={"prompt": "test prompt", "seed": 7}, headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.headers['etag'] == etag
+    assert response.headers['cache-control'] == 'public, max-age=31536000, immutable'
+    assert mock_get.call_args.kwargs['headers'] == {'If-None-Match': etag}
+    assert mock_get.call_args.kwargs['params'] == {'prompt': 'test prompt', 'number_of_images': 1, 'seed': 7, 'response_format': 'png', 'format': 'png'}
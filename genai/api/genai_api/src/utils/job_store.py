@@ -0,0 +1,152 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import uuid
+import socket
+import threading
+import ipaddress
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+
+
+class Job_Store_Full(Exception):
+    pass
+
+
+class Callback_Refused(ValueError):
+    pass
+
+
+def host_allowed(host, allowed_hosts):
+    '''Whether host is one of allowed_hosts, where "*.example.com" allows the subdomains of example.com.'''
+    host = host.lower().rstrip('.')
+    for allowed in allowed_hosts:
+        allowed = allowed.lower()
+        if host == allowed or (allowed.startswith('*.') and host.endswith(allowed[1:])):
+            return True
+    return False
+
+
+def check_callback_url(url, allowed_hosts):
+    '''
+    Raises Callback_Refused unless url may receive job callbacks: an https URL
+    whose host is in allowed_hosts and resolves only to public addresses. This
+    keeps callers from pointing the gateway at the metadata server or at
+    services inside the cluster. With no allowed_hosts, callbacks are off.
+    '''
+    parts = urlsplit(url)
+    if parts.scheme != 'https' or not parts.hostname:
+        raise Callback_Refused('callback_url must be an https URL')
+    if not host_allowed(parts.hostname, allowed_hosts):
+        raise Callback_Refused(f'callback_url host {parts.hostname!r} is not allowed. Allowed hosts: {sorted(allowed_hosts)}')
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(parts.hostname, parts.port or 443, proto=socket.IPPROTO_TCP)}
+    except OSError as e:
+        raise Callback_Refused(f'callback_url host {parts.hostname!r} does not resolve. {e}')
+    for address in addresses:
+        if not ipaddress.ip_address(address.split('%')[0]).is_global:
+            raise Callback_Refused(f'callback_url host {parts.hostname!r} resolves to the non-public address {address}')
+
+
+class Job:
+
+    def __init__(self, job_id, callback_url=None):
+        self.job_id = job_id
+        self.callback_url = callback_url
+        self.status = JOB_PENDING
+        self.created = time.time()
+        self.completed = None
+        self.result = None
+        self.media_type = None
+        self.error = None
+
+    @property
+    def done(self):
+        return self.status in (JOB_SUCCEEDED, JOB_FAILED)
+
+    def to_dict(self):
+        return {
+            'job_id': self.job_id,
+            'status': self.status,
+            'created': self.created,
+            'completed': self.completed,
+            'error': self.error,
+        }
+
+
+class Job_Store:
+    '''
+    Bounded, thread-safe in-memory store for asynchronous jobs.
+
+    Finished jobs are kept for ttl_seconds after completion. When the store is
+    at max_jobs, the oldest finished job is evicted to make room; if every job
+    is still pending or running, new submissions are rejected with Job_Store_Full.
+    '''
+
+    def __init__(self, max_jobs=1000, ttl_seconds=600):
+        self.max_jobs = max_jobs
+        self.ttl_seconds = ttl_seconds
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, callback_url=None):
+        with self._lock:
+            self._purge_expired()
+            if len(self._jobs) >= self.max_jobs:
+                oldest_done = next((job_id for job_id, job in self._jobs.items() if job.done), None)
+                if oldest_done is None:
+                    raise Job_Store_Full(f'{self.max_jobs} jobs are already pending or running')
+                del self._jobs[oldest_done]
+            job = Job(uuid.uuid4().hex, callback_url=callback_url)
+            self._jobs[job.job_id] = job
+            return job
+
+    def get(self, job_id):
+        with self._lock:
+            self._purge_expired()
+            return self._jobs.get(job_id)
+
+    def mark_running(self, job):
+        with self._lock:
+            job.status = JOB_RUNNING
+
+    def complete(self, job, result, media_type):
+        with self._lock:
+            job.result = result
+            job.media_type = media_type
+            job.status = JOB_SUCCEEDED
+            job.completed = time.time()
+
+    def fail(self, job, error):
+        with self._lock:
+            job.error = error
+            job.status = JOB_FAILED
+            job.completed = time.time()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._jobs)
+
+    def _purge_expired(self):
+        cutoff = time.time() - self.ttl_seconds
+        expired = [job_id for job_id, job in self._jobs.items() if job.done and job.completed < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
@@ -0,0 +1,114 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import random
+import logging
+from logging.handlers import RotatingFileHandler
+
+
+# When redaction is enabled, every string in a payload is replaced, except the
+# values of these fields, which are settings rather than user content. Listing
+# what is kept, instead of what is replaced, means a new free-text field is
+# redacted without a change here. Numbers and booleans are always kept.
+KEPT_FIELDS = (
+    'model', 'preflight', 'response_format', 'format', 'mime_type', 'scheduler', 'preset',
+    'author', 'role', 'conversation_id', 'session_id', 'safety_settings',
+)
+REDACTION_FILLER = 'lorem ipsum dolor sit amet '
+
+
+def redact(value):
+    '''
+    Recursively replace strings with filler of the same length, so replayed
+    traffic has the same prompt-size mix. Base64 data becomes zero bytes of
+    the same size, so it still decodes.
+    '''
+    if isinstance(value, dict):
+        return {k: v if k in KEPT_FIELDS else _data_filler(v) if k == 'data' and isinstance(v, str) else redact(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [redact(v) for v in value]
+    if isinstance(value, str):
+        return _filler(value)
+    return value
+
+
+def _filler(text):
+    repeats = len(text) // len(REDACTION_FILLER) + 1
+    return (REDACTION_FILLER * repeats)[:len(text)]
+
+
+def _data_filler(data):
+    unpadded = data.rstrip('=')
+    return 'A' * len(unpadded) + data[len(unpadded):]
+
+
+class Traffic_Capture:
+    '''
+    Writes a sample of incoming requests, with their arrival timestamps, to a
+    size-rotated JSONL file. The output can be replayed with replay_traffic.py.
+    '''
+
+    def __init__(self, path, sample_rate=1.0, redact_payloads=False, max_bytes=100 * 1024 * 1024, backup_count=5):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.redact_payloads = redact_payloads
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+
+        # A dedicated, non-propagating logger gives us thread-safe writes and rotation for free.
+        self.logger = logging.getLogger(f'traffic-capture.{path}')
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.logger.handlers = [handler]
+
+    def should_capture(self):
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def record(self, arrival_ts, method, route, payload):
+        if self.redact_payloads:
+            payload = redact(payload)
+        record = {
+            'ts': arrival_ts,
+            'method': method,
+            'route': route,
+            'payload': payload,
+        }
+        self.logger.info(json.dumps(record, separators=(',', ':')))
+
+    def close(self):
+        for handler in self.logger.handlers:
+            handler.close()
+        self.logger.handlers = []
+
+
+def traffic_capture_from_env():
+    '''Returns a Traffic_Capture when GENAI_CAPTURE_PATH is set, otherwise None.'''
+    path = os.environ.get('GENAI_CAPTURE_PATH', '')
+    if not path:
+        return None
+
+    return Traffic_Capture(
+        path=path,
+        sample_rate=float(os.environ.get('GENAI_CAPTURE_SAMPLE_RATE', '1.0')),
+        redact_payloads=os.environ.get('GENAI_CAPTURE_REDACT', 'false').lower() in ('1', 'true', 'yes'),
+        max_bytes=int(os.environ.get('GENAI_CAPTURE_MAX_BYTES', str(100 * 1024 * 1024))),
+        backup_count=int(os.environ.get('GENAI_CAPTURE_BACKUP_COUNT', '5')),
+    )
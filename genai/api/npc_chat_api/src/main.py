@@ -14,10 +14,10 @@
 
 from fastapi import FastAPI
 from pydantic import BaseModel
+from utils.gcp_metadata import get_gcp_metadata
 
 import logging
 import npc
-import requests
 import sys
 import traceback
 
@@ -36,28 +36,8 @@ app = FastAPI(
 )
 
 
-def get_gcp_metadata():
-    metadata_server = "http://metadata.google.internal"
-    headers = {"Metadata-Flavor": "Google"}
-
-    # Get Project ID
-    project_id_url = f"{metadata_server}/computeMetadata/v1/project/project-id"
-    project_id_response = requests.get(project_id_url, headers=headers)
-    project_id = project_id_response.text if project_id_response.status_code == 200 else "Unavailable"
-
-    # Get GCP Zone
-    zone_url = f"{metadata_server}/computeMetadata/v1/instance/zone"
-    zone_response = requests.get(zone_url, headers=headers)
-    zone = zone_response.text.split('/')[-1] if zone_response.status_code == 200 else "Unavailable"
-
-    # Extract GCP Region
-    region = '-'.join(zone.split('-')[:-1])
-
-    return project_id, region
-
-
 def get_config():
-    project, region = get_gcp_metadata()
+    project, region, _ = get_gcp_metadata()
     cfg = npc.data_from_file(npc.CONFIG_PATH)
     cfg['global']['project'] = project
     cfg['global']['location'] = "us-central1" # TODO: us-central1 allows batches of 250, other regions only 5?
@@ -13,13 +13,18 @@
 # limitations under the License.
 
 from fastapi import FastAPI
+from contextlib import asynccontextmanager
 from pydantic import BaseModel
+from fastapi.responses import JSONResponse
 from utils.model_util import Google_Cloud_GenAI
+from utils.model_pool import model_pool_from_env
+from utils.gcp_metadata import get_gcp_metadata
+from utils.retry import Vertex_Error, error_response
+from utils.session_store import session_store_from_env, send_in_conversation, stream_in_conversation
+from utils.sse import sse_text_events, sse_response
 import sys
 import logging
-import requests
 from typing import List
-from vertexai.language_models import ChatMessage
 
 logging.basicConfig(
     level=logging.DEBUG,
@@ -28,50 +33,56 @@ logging.basicConfig(
     stream=sys.stdout,
 )
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Import the Vertex SDK and load the model in the background, so uvicorn
+    # binds its port immediately. Requests are gated on /genai_ready.
+    model_vertex_llm_chat.start_loading()
+    yield
+
+
 app = FastAPI(
+    lifespan=lifespan,
     redoc_url=None,
     title="API for Vertex AI Chat LLM",
     description="Contains business logic, data processing steps, and uses the GCP SDK to call the Google Cloud Vertex chat-bison LLM model.",
     version="0.0.1",
 )
 
-def get_gcp_metadata():
-    metadata_server = "http://metadata.google.internal"
-    headers = {"Metadata-Flavor": "Google"}
-
-    # Get Project ID
-    project_id_url = f"{metadata_server}/computeMetadata/v1/project/project-id"
-    project_id_response = requests.get(project_id_url, headers=headers)
-    project_id = project_id_response.text if project_id_response.status_code == 200 else "Unavailable"
-
-    # Get GCP Zone
-    zone_url = f"{metadata_server}/computeMetadata/v1/instance/zone"
-    zone_response = requests.get(zone_url, headers=headers)
-    zone = zone_response.text.split('/')[-1] if zone_response.status_code == 200 else "Unavailable"
-
-    # Extract GCP Region
-    region = '-'.join(zone.split('-')[:-1])
-
-    return project_id, region, zone
-
 GCP_PROJECT_ID, GCP_REGION, GCP_ZONE = get_gcp_metadata()
 logging.debug(f'GCP_PROJECT_ID: {GCP_PROJECT_ID}')
 logging.debug(f'GCP_REGION:     {GCP_REGION}')
 logging.debug(f'GCP_ZONE:       {GCP_ZONE}')
 
-# Initialize Vertex LLM Model
-model_vertex_llm_chat = Google_Cloud_GenAI(GCP_PROJECT_ID, GCP_REGION=GCP_REGION, MODEL_TYPE='chat-bison')
+# Initialize Vertex LLM Model. The default model loads at startup; other models and versions are created on first use.
+chat_models = model_pool_from_env(
+    lambda name: Google_Cloud_GenAI(GCP_PROJECT_ID, GCP_REGION=GCP_REGION, MODEL_TYPE='chat-bison', MODEL_NAME=name),
+    default_model='chat-bison@001',
+)
+model_vertex_llm_chat = chat_models.default
+
+# Server-side chat sessions, keyed by conversation_id
+chat_sessions = session_store_from_env()
 
 headers = {"Content-Type": "application/json"}
 
+# Mirrors vertexai.language_models.ChatMessage, so the Vertex SDK is not imported at module load.
+class Chat_Message(BaseModel):
+    author: str
+    content: str
+
+
 class Payload_Vertex_Chat(BaseModel):
     prompt: str
+    conversation_id: str | None = None
     context: str | None = ''
-    message_history: List[ChatMessage] | None = []
+    message_history: List[Chat_Message] | None = []
     max_output_tokens: int | None = 1024
     temperature: float | None = 0.2
     top_p: float | None = 0.8
     top_k: int | None = 40
+    # Model name or version to use, such as "chat-bison@002". Defaults to the service's default model.
+    model: str | None = None
 
 
 # Routes
@@ -82,8 +93,17 @@ async def health_check():
     return {'status': 'ok'}
 
 
+@app.get("/genai_ready", include_in_schema=False)
+async def readiness_check():
+    return JSONResponse(status_code=200 if model_vertex_llm_chat.ready.is_set() else 503, content=chat_models.status())
+
+
 @app.post("/")
-def vertex_llm_chat(payload: Payload_Vertex_Chat):
+async def vertex_llm_chat(payload: Payload_Vertex_Chat):
+    try:
+        model = await chat_models.acquire(payload.model)
+    except Vertex_Error as e:
+        return error_response(e)
     try:
         request_payload = {
             'prompt': payload.prompt,
@@ -94,11 +114,44 @@ def vertex_llm_chat(payload: Payload_Vertex_Chat):
             'top_p': payload.top_p,
             'top_k': payload.top_k,
         }
-        response = model_vertex_llm_chat.call_llm(**request_payload)
+        if payload.conversation_id:
+            # Only the new message is sent; the history lives in the server-side session.
+            response = await send_in_conversation(chat_sessions, model, payload.conversation_id, request_payload)
+        else:
+            response = await model.call_llm_async(**request_payload)
         return response.text
     except Exception as e:
-        print(f'EXCEPTION: {e}')
-        return {}
+        return error_response(e)
+
+
+@app.post("/stream")
+async def vertex_llm_chat_stream(payload: Payload_Vertex_Chat):
+    try:
+        model = await chat_models.acquire(payload.model)
+    except Vertex_Error as e:
+        return error_response(e)
+    request_payload = {
+        'prompt': payload.prompt,
+        'context': payload.context,
+        'message_history': payload.message_history,
+        'max_output_tokens': payload.max_output_tokens,
+        'temperature': payload.temperature,
+        'top_p': payload.top_p,
+        'top_k': payload.top_k,
+    }
+    if payload.conversation_id:
+        try:
+            chunks = stream_in_conversation(chat_sessions, model, payload.conversation_id, request_payload)
+        except Vertex_Error as e:
+            return error_response(e)
+    else:
+        chunks = model.stream_llm_async(**request_payload)
+    return sse_response(sse_text_events(chunks))
+
+
+@app.delete("/conversations/{conversation_id}")
+def vertex_llm_chat_end_conversation(conversation_id: str):
+    return {'deleted': chat_sessions.delete(conversation_id)}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,84 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pytest -s -W ignore
+
+from unittest import mock
+import pytest
+import requests
+from utils import gcp_metadata
+
+
+@pytest.fixture(autouse=True)
+def isolated_metadata(tmp_path, monkeypatch):
+    for name in ('GCP_PROJECT_ID', 'GCP_REGION', 'GCP_ZONE', 'GCP_METADATA_DISABLED'):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv('GCP_METADATA_REQUIRED', 'false')
+    monkeypatch.setattr(gcp_metadata, 'METADATA_CACHE_PATH', str(tmp_path / 'gcp_metadata.json'))
+    gcp_metadata.get_gcp_metadata.cache_clear()
+    yield
+    gcp_metadata.get_gcp_metadata.cache_clear()
+
+
+def test_env_overrides_skip_metadata_server(monkeypatch):
+    monkeypatch.setenv('GCP_PROJECT_ID', 'my-project')
+    monkeypatch.setenv('GCP_ZONE', 'europe-west4-b')
+
+    with mock.patch('requests.get') as mock_get:
+        assert gcp_metadata.get_gcp_metadata() == ('my-project', 'europe-west4', 'europe-west4-b')
+    mock_get.assert_not_called()
+
+
+def test_metadata_server_result_is_cached_on_disk():
+    project_response = mock.Mock(status_code=200, text='my-project')
+    zone_response = mock.Mock(status_code=200, text='projects/123/zones/us-east1-c')
+
+    with mock.patch('requests.get', side_effect=[project_response, zone_response]) as mock_get:
+        assert gcp_metadata.get_gcp_metadata() == ('my-project', 'us-east1', 'us-east1-c')
+        for call in mock_get.call_args_list:
+            assert call.kwargs['timeout'] == gcp_metadata.METADATA_TIMEOUT
+
+    # A new process (simulated by clearing the in-memory cache) reads the disk cache
+    gcp_metadata.get_gcp_metadata.cache_clear()
+    with mock.patch('requests.get') as mock_get:
+        assert gcp_metadata.get_gcp_metadata() == ('my-project', 'us-east1', 'us-east1-c')
+    mock_get.assert_not_called()
+
+
+def test_unreachable_metadata_server_uses_local_stand_in():
+    with mock.patch('requests.get', side_effect=requests.ConnectionError('no metadata server')):
+        project_id, region, zone = gcp_metadata.get_gcp_metadata()
+
+    assert project_id == gcp_metadata.LOCAL_STAND_IN['project_id']
+    assert zone == gcp_metadata.LOCAL_STAND_IN['zone']
+    assert region == 'us-central1'
+
+
+def test_unreachable_metadata_server_on_google_cloud_fails(monkeypatch):
+    monkeypatch.setenv('GCP_METADATA_REQUIRED', 'true')
+    monkeypatch.setattr(gcp_metadata, 'METADATA_STARTUP_TIMEOUT', 1.5)
+    project_response = mock.Mock(status_code=200, text='my-project')
+    zone_response = mock.Mock(status_code=200, text='projects/123/zones/us-east1-c')
+
+    # A flaky metadata server is retried
+    failures = [requests.ConnectionError('no metadata server')] * 2
+    with mock.patch('requests.get', side_effect=failures + [project_response, zone_response]):
+        assert gcp_metadata.get_gcp_metadata() == ('my-project', 'us-east1', 'us-east1-c')
+
+    # One that never answers fails startup instead of using the stand-in
+    gcp_metadata.get_gcp_metadata.cache_clear()
+    monkeypatch.setattr(gcp_metadata, 'METADATA_CACHE_PATH', '/nonexistent/gcp_metadata.json')
+    with mock.patch('requests.get', side_effect=requests.ConnectionError('no metadata server')):
+        with pytest.raises(gcp_metadata.Metadata_Unavailable):
+            gcp_metadata.get_gcp_metadata()
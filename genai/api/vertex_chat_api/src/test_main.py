@@ -16,25 +16,17 @@
 
 from fastapi.testclient import TestClient
 from unittest import mock
-import json
 from main import app
 
 client = TestClient(app)
 
-@mock.patch('requests.post')
-def test_genai(mock_post):
+@mock.patch('main.chat_models.acquire', new_callable=mock.AsyncMock)
+def test_genai(mock_acquire):
 
-    # Define a mock response content as a JSON string
-    expected_response = {'mocked_key': 'mocked_value'}
-    mock_response_content = json.dumps(expected_response).encode()
-
-    # Create a mock response object with the necessary attributes
-    mock_response = mock.Mock()
-    mock_response.status_code = 200
-    mock_response.content = mock_response_content
-
-    # Set the mock object to the patched function
-    mock_post.return_value = mock_response
+    # The model is mocked, so the test needs neither Vertex nor a loaded model
+    mock_model = mock.Mock()
+    mock_model.call_llm_async = mock.AsyncMock(return_value=mock.Mock(text='mocked text'))
+    mock_acquire.return_value = mock_model
 
     # Payload for the POST request
     payload = {
@@ -52,6 +44,13 @@ def test_genai(mock_post):
 
     # Assertions
     assert response.status_code == 200
-    assert response.json() == expected_response
-    mock_post.assert_called_once()
+    assert response.json() == 'mocked text'
+    mock_model.call_llm_async.assert_called_once()
+
 
+def test_genai_waits_for_the_default_model():
+    # The app's lifespan has not run, so the default model is not loaded and the service is not ready
+    assert client.get("/genai_ready").status_code == 503
+    response = client.post("/", json={"prompt": "test prompt"})
+    assert response.status_code == 503
+    assert response.headers['retry-after'] == '1'
@@ -0,0 +1,96 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pytest -s -W ignore
+
+import asyncio
+import threading
+import pytest
+from utils.model_pool import Model_Pool
+from utils.retry import Vertex_Error
+
+
+class Fake_Model:
+
+    def __init__(self, name, fail=False):
+        self.name = name
+        self.fail = fail
+        self.ready = threading.Event()
+        self.load_error = None
+
+    def start_loading(self):
+        if self.fail:
+            self.load_error = 'not found'
+        else:
+            self.ready.set()
+
+    def status(self):
+        return {'ready': self.ready.is_set()}
+
+
+def fake_factory(name):
+    if not name.startswith('chat-bison'):
+        raise ValueError(f'{name} is not a chat-bison model')
+    return Fake_Model(name, fail=name.endswith('@404'))
+
+
+def test_lru_eviction_keeps_default():
+    pool = Model_Pool(fake_factory, 'chat-bison@001', allow_any=True, max_models=3)
+    pool.default.start_loading()
+
+    first = pool.get('chat-bison@002')
+    pool.get('chat-bison@003')
+    # Touching @002 makes @003 the least recently used
+    assert pool.get('chat-bison@002') is first
+    pool.get('chat-bison@004')
+
+    assert set(pool.status()) == {'chat-bison@001', 'chat-bison@002', 'chat-bison@004'}
+    assert pool.get(None) is pool.default
+
+
+def test_allowed_models_and_bad_names_are_400():
+    pool = Model_Pool(fake_factory, 'chat-bison@001', allowed_models=['chat-bison@002'])
+    with pytest.raises(Vertex_Error) as e:
+        pool.get('chat-bison@003')
+    assert e.value.status_code == 400
+
+    # Without an allowed list, only the default model is served
+    pool = Model_Pool(fake_factory, 'chat-bison@001')
+    with pytest.raises(Vertex_Error) as e:
+        pool.get('chat-bison@002')
+    assert e.value.status_code == 400
+    assert pool.get('chat-bison@001') is pool.default
+
+    # When any name is allowed, names the factory rejects are still a 400
+    pool = Model_Pool(fake_factory, 'chat-bison@001', allow_any=True)
+    with pytest.raises(Vertex_Error) as e:
+        pool.get('text-bison@001')
+    assert e.value.status_code == 400
+
+
+def test_acquire():
+    pool = Model_Pool(fake_factory, 'chat-bison@001', allowed_models=['chat-bison@002', 'chat-bison@404'], load_timeout=0.1)
+
+    # The default model is not waited for
+    with pytest.raises(Vertex_Error) as e:
+        asyncio.run(pool.acquire())
+    assert e.value.status_code == 503
+
+    assert asyncio.run(pool.acquire('chat-bison@002')).ready.is_set()
+
+    # A model that fails to load is discarded, so a later request retries the load
+    with pytest.raises(Vertex_Error) as e:
+        asyncio.run(pool.acquire('chat-bison@404'))
+    assert e.value.status_code == 400
+    assert 'chat-bison@404' not in pool.status()
@@ -0,0 +1,47 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pytest -s -W ignore
+
+import asyncio
+import pytest
+from unittest import mock
+from utils.model_util import Google_Cloud_GenAI
+
+
+@pytest.mark.parametrize('model_type', ['chat-bison', 'codechat-bison'])
+def test_chat_token_counts_include_context_and_history(model_type):
+    model = Google_Cloud_GenAI('project', 'region', MODEL_TYPE=model_type)
+    model.model = mock.Mock()
+    session = model.model.start_chat.return_value
+    session.count_tokens.return_value = mock.Mock(total_tokens=12)
+    history = [mock.Mock(author='user', content='Hi'), mock.Mock(author='bot', content='Hello')]
+
+    assert asyncio.run(model.count_tokens_async('How are you?', history, context='You are Mario.')) == 12
+
+    # The session counts its context and history along with the message
+    kwargs = model.model.start_chat.call_args.kwargs
+    assert kwargs['context'] == 'You are Mario.'
+    assert [(m.author, m.content) for m in kwargs['message_history']] == [('user', 'Hi'), ('bot', 'Hello')]
+    session.count_tokens.assert_called_once_with('How are you?')
+    session.send_message.assert_not_called()
+
+
+def test_code_token_counts_include_the_suffix():
+    model = Google_Cloud_GenAI('project', 'region', MODEL_TYPE='code-bison')
+    model.model = mock.Mock()
+    model.model.count_tokens.return_value = mock.Mock(total_tokens=7)
+
+    assert asyncio.run(model.count_tokens_async('def add(a, b):', code_suffix='    return total')) == 7
+    model.model.count_tokens.assert_called_once_with('def add(a, b):', suffix='    return total')
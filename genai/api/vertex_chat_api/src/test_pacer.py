@@ -0,0 +1,91 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pytest -s -W ignore
+
+import time
+import asyncio
+import pytest
+from unittest import mock
+from utils.pacer import Pacer, Local_Counter_Store
+from utils.retry import Vertex_Error
+
+
+def test_bursts_are_queued_at_the_quota_rate():
+    # 600 per minute is one call every 0.1s, after a burst of 3
+    pacer = Pacer(Local_Counter_Store(), quota_per_minute=600, burst=3, max_wait=10)
+    waits = [pacer.reserve('model') for _ in range(6)]
+
+    assert waits[:3] == [0, 0, 0]
+    assert waits[3:] == pytest.approx([0.1, 0.2, 0.3], abs=0.01)
+    # Buckets are per key
+    assert pacer.reserve('other-model') == 0
+
+
+def test_long_queue_is_refused_without_reserving():
+    pacer = Pacer(Local_Counter_Store(), quota_per_minute=60, burst=1, max_wait=1.5)
+    pacer.reserve('model')
+    pacer.reserve('model')
+    with pytest.raises(Vertex_Error) as e:
+        pacer.reserve('model')
+    assert e.value.status_code == 429
+    assert e.value.retry_after >= 1
+    # The refused call did not take a slot, so the queue is no longer
+    assert pacer.store.reserve('model', pacer.interval, pacer.tolerance, 10) == (True, pytest.approx(2.0, abs=0.01))
+
+
+def test_unreachable_store_falls_back_to_local_pacing():
+
+    class Broken_Store:
+        blocking = True
+
+        def reserve(self, *args):
+            raise ConnectionError('redis is down')
+
+    pacer = Pacer(Broken_Store(), quota_per_minute=1200, burst=1)
+
+    async def run():
+        await asyncio.gather(*[pacer.acquire('model') for _ in range(4)])
+
+    start = time.perf_counter()
+    asyncio.run(run())
+    # 4 calls at 20 per second
+    assert time.perf_counter() - start >= 0.14
+
+
+def test_token_counts_are_paced():
+    from utils.model_util import Google_Cloud_GenAI, GCP_GenAI_Gemini
+
+    class Recording_Pacer:
+        def __init__(self):
+            self.keys = []
+
+        async def acquire(self, key):
+            self.keys.append(key)
+
+    text = Google_Cloud_GenAI('project', 'region', MODEL_TYPE='text-bison')
+    text.model = mock.Mock()
+    text.model.count_tokens.return_value = mock.Mock(total_tokens=3)
+    gemini = GCP_GenAI_Gemini('project', 'region', MODEL_TYPE='gemini-pro')
+    gemini.model = mock.Mock()
+    gemini.model.count_tokens_async = mock.AsyncMock(return_value=mock.Mock(total_tokens=4))
+    gemini.build_contents = mock.Mock(return_value=['contents'])
+
+    async def run():
+        return await text.count_tokens_async('three word prompt'), await gemini.count_tokens_async('four word prompt here')
+
+    for model in (text, gemini):
+        model.pacer = Recording_Pacer()
+    assert asyncio.run(run()) == (3, 4)
+    assert text.pacer.keys == [text.quota_key()] and gemini.pacer.keys == [gemini.quota_key()]
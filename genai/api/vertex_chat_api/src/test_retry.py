@@ -0,0 +1,93 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pytest -s -W ignore
+
+import asyncio
+import pytest
+from google.api_core import exceptions
+from utils.retry import Retry_Policy, Retry_Budget, Vertex_Error, error_response
+
+
+def flaky(failures):
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        if len(calls) <= len(failures):
+            raise failures[len(calls) - 1]
+        return 'ok'
+
+    return fn, calls
+
+
+def test_retries_transient_errors():
+    fn, calls = flaky([exceptions.ResourceExhausted('quota'), exceptions.ServiceUnavailable('unavailable')])
+    policy = Retry_Policy(base_delay=0.001)
+
+    assert asyncio.run(policy.call(fn)) == 'ok'
+    assert len(calls) == 3
+
+
+def test_non_retriable_error_keeps_its_status_code():
+    fn, calls = flaky([exceptions.InvalidArgument('bad prompt')])
+    policy = Retry_Policy(base_delay=0.001)
+
+    with pytest.raises(Vertex_Error) as e:
+        asyncio.run(policy.call(fn))
+    assert e.value.status_code == 400
+    assert len(calls) == 1
+    assert error_response(e.value).status_code == 400
+
+
+def test_retry_budget_limits_retries():
+    # No floor, and 1 retry allowed per 10 requests
+    policy = Retry_Policy(base_delay=0.001, budget=Retry_Budget(ratio=0.1, min_per_second=0))
+
+    async def always_429():
+        raise exceptions.ResourceExhausted('quota')
+
+    async def run():
+        results = await asyncio.gather(*[policy.call(always_429) for _ in range(10)], return_exceptions=True)
+        return results
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, Vertex_Error) and r.status_code == 429 for r in results)
+    assert len(policy.budget._retries) == 1
+    assert error_response(results[0]).headers['Retry-After']
+
+
+def test_stream_retries_only_before_first_item():
+    attempts = []
+
+    async def open_stream():
+        attempts.append(1)
+
+        async def items():
+            if len(attempts) == 1:
+                raise exceptions.ServiceUnavailable('unavailable')
+            yield 'a'
+            raise exceptions.ServiceUnavailable('unavailable')
+
+        return items()
+
+    async def run():
+        received = []
+        with pytest.raises(Vertex_Error):
+            async for item in Retry_Policy(base_delay=0.001).stream(open_stream):
+                received.append(item)
+        return received
+
+    assert asyncio.run(run()) == ['a']
+    assert len(attempts) == 2
@@ -0,0 +1,156 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pytest -s -W ignore
+
+import time
+import asyncio
+import threading
+from unittest import mock
+from utils.session_store import Session_Store, conversation_entry, send_in_conversation, stream_in_conversation
+from utils.sse import sse_text_events
+from utils.retry import Vertex_Error
+
+
+def make_session(*contents):
+    session = mock.Mock()
+    session.message_history = [mock.Mock(content=c) for c in contents]
+    return session
+
+
+def test_send_in_conversation_reuses_session():
+    session = make_session()
+    model = mock.Mock()
+    model.start_chat.return_value = session
+
+    async def call_llm_async(prompt, chat_session, **kwargs):
+        chat_session.message_history += [mock.Mock(content=prompt), mock.Mock(content='reply')]
+        return mock.Mock(text='reply')
+
+    model.call_llm_async.side_effect = call_llm_async
+    sessions = Session_Store()
+
+    asyncio.run(send_in_conversation(sessions, model, 'c1', {'prompt': 'hello', 'context': 'You are Mario', 'temperature': 0.2}))
+    asyncio.run(send_in_conversation(sessions, model, 'c1', {'prompt': 'again', 'context': 'You are Mario', 'temperature': 0.2}))
+
+    # The session is started once and only the new message is sent each turn
+    model.start_chat.assert_called_once_with(context='You are Mario', temperature=0.2)
+    assert [c.kwargs['prompt'] for c in model.call_llm_async.call_args_list] == ['hello', 'again']
+    assert all(c.kwargs['chat_session'] is session for c in model.call_llm_async.call_args_list)
+    assert sessions.total_bytes == len('You are Mario') + len('helloreplyagainreply')
+
+
+def test_stream_in_conversation_as_sse():
+    session = make_session()
+    model = mock.Mock()
+    model.start_chat.return_value = session
+
+    async def stream_llm_async(prompt, chat_session, **kwargs):
+        for text in ('Hel', 'lo'):
+            yield text
+        chat_session.message_history += [mock.Mock(content=prompt), mock.Mock(content='Hello')]
+
+    model.stream_llm_async.side_effect = stream_llm_async
+    sessions = Session_Store()
+
+    async def collect():
+        chunks = stream_in_conversation(sessions, model, 'c1', {'prompt': 'hi'})
+        return [event async for event in sse_text_events(chunks)]
+
+    events = asyncio.run(collect())
+    assert events == ['data: {"text": "Hel"}\n\n', 'data: {"text": "lo"}\n\n', 'data: [DONE]\n\n']
+    # The session is re-measured once the stream has finished
+    assert sessions.total_bytes == len('hiHello')
+
+
+def test_conversation_stays_on_its_model():
+    model = mock.Mock(pretrained_model='chat-bison@001')
+    model.start_chat.return_value = make_session()
+    model.call_llm_async = mock.AsyncMock(return_value=mock.Mock(text='reply'))
+    other = mock.Mock(pretrained_model='chat-bison@002')
+    sessions = Session_Store()
+
+    asyncio.run(send_in_conversation(sessions, model, 'c1', {'prompt': 'hello'}))
+    for call in (
+        lambda: asyncio.run(send_in_conversation(sessions, other, 'c1', {'prompt': 'again'})),
+        lambda: stream_in_conversation(sessions, other, 'c1', {'prompt': 'again'}),
+    ):
+        try:
+            call()
+            assert False, 'expected a 409'
+        except Vertex_Error as e:
+            assert e.status_code == 409
+    other.call_llm_async.assert_not_called()
+
+    # Ending the conversation frees its id for another model
+    sessions.delete('c1')
+    other.start_chat.return_value = make_session()
+    other.call_llm_async = mock.AsyncMock(return_value=mock.Mock(text='reply'))
+    asyncio.run(send_in_conversation(sessions, other, 'c1', {'prompt': 'again'}))
+    assert sessions.get('c1').model_name == 'chat-bison@002'
+
+
+def test_lru_and_memory_cap_eviction():
+    sessions = Session_Store(max_sessions=2, max_bytes=10)
+
+    sessions.put('a', make_session('1234'))
+    sessions.put('b', make_session('1234'))
+    sessions.get('a')
+    sessions.put('c', make_session('1234'))
+
+    # 'b' was least recently used when the session count went over the limit
+    assert sessions.get('b') is None
+    assert sessions.get('a') is not None
+
+    sessions.put('d', make_session('123456789'))
+    # Keeping 'd' (9 bytes) within the 10 byte cap evicts everything older
+    assert len(sessions) == 1
+    assert sessions.total_bytes == 9
+
+
+def test_ttl_expiry():
+    sessions = Session_Store(ttl_seconds=60)
+    with mock.patch('time.monotonic', return_value=1000):
+        sessions.put('a', make_session('hi'))
+    with mock.patch('time.monotonic', return_value=1061):
+        assert sessions.get('a') is None
+    assert sessions.total_bytes == 0
+
+
+def test_concurrent_first_turns_share_one_session():
+    model = mock.Mock(pretrained_model='chat-bison@001')
+
+    def start_chat(**kwargs):
+        # A slow start widens the window between the lookup and the insert
+        time.sleep(0.05)
+        return make_session()
+
+    model.start_chat.side_effect = start_chat
+    sessions = Session_Store()
+    barrier = threading.Barrier(8)
+    entries = []
+
+    def first_turn():
+        barrier.wait()
+        entries.append(conversation_entry(sessions, model, 'c1', {'prompt': 'hello', 'context': 'You are Mario'}))
+
+    threads = [threading.Thread(target=first_turn) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    model.start_chat.assert_called_once()
+    assert len(entries) == 8 and all(entry is entries[0] for entry in entries)
+    assert sessions.get('c1') is entries[0] and len(sessions) == 1
@@ -0,0 +1,53 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# This file is shared by the vertex_*_api services. Keep the copies identical.
+
+import json
+import logging
+from fastapi.responses import StreamingResponse
+from utils.retry import status_code_of
+
+
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    # Stops nginx style proxies from buffering the whole response
+    'X-Accel-Buffering': 'no',
+}
+
+
+def sse_event(data, event=None):
+    message = f'event: {event}\n' if event else ''
+    return f'{message}data: {json.dumps(data)}\n\n'
+
+
+async def sse_text_events(chunks):
+    '''
+    Turns an async iterator of text chunks into server-sent events:
+    one {"text": ...} event per chunk, then "data: [DONE]". An error
+    after the stream has started is sent as an "error" event.
+    '''
+    try:
+        async for text in chunks:
+            if text:
+                yield sse_event({'text': text})
+    except Exception as e:
+        logging.exception(f'At streaming response. {e}')
+        yield sse_event({'error': str(e), 'status_code': status_code_of(e)}, event='error')
+        return
+    yield 'data: [DONE]\n\n'
+
+
+def sse_response(events):
+    return StreamingResponse(events, media_type='text/event-stream', headers=SSE_HEADERS)
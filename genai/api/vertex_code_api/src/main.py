@@ -13,14 +13,21 @@
 # limitations under the License.
 
 from fastapi import FastAPI
+from contextlib import asynccontextmanager
 from pydantic import BaseModel
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, JSONResponse
 from utils.model_util import Google_Cloud_GenAI
+from utils.model_pool import model_pool_from_env
+from utils.gcp_metadata import get_gcp_metadata
+from utils.retry import Vertex_Error, error_response
+from utils.session_store import session_store_from_env, send_in_conversation, stream_in_conversation
+from utils.sse import sse_text_events, sse_response
+from utils.completion_session import completion_sessions_from_env, complete_in_session
 import io
 import os, sys
 import json
-import requests
 import logging
+from typing import List
 
 logging.basicConfig(
     level=logging.DEBUG,
@@ -29,39 +36,47 @@ logging.basicConfig(
     stream=sys.stdout,
 )
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Import the Vertex SDK and load the model in the background, so uvicorn
+    # binds its port immediately. Requests are gated on /genai_ready.
+    model_vertex_llm_code.start_loading()
+    model_vertex_llm_codechat.start_loading()
+    yield
+
+
 app = FastAPI(
+    lifespan=lifespan,
     redoc_url=None,
     title="API for Vertex AI Code LLM",
     description="Contains business logic, data processing steps, and uses the GCP SDK to call the Google Cloud Vertex code-bison LLM model.",
     version="0.0.1",
 )
 
-def get_gcp_metadata():
-    metadata_server = "http://metadata.google.internal"
-    headers = {"Metadata-Flavor": "Google"}
-
-    # Get Project ID
-    project_id_url = f"{metadata_server}/computeMetadata/v1/project/project-id"
-    project_id_response = requests.get(project_id_url, headers=headers)
-    project_id = project_id_response.text if project_id_response.status_code == 200 else "Unavailable"
-
-    # Get GCP Zone
-    zone_url = f"{metadata_server}/computeMetadata/v1/instance/zone"
-    zone_response = requests.get(zone_url, headers=headers)
-    zone = zone_response.text.split('/')[-1] if zone_response.status_code == 200 else "Unavailable"
-
-    # Extract GCP Region
-    region = '-'.join(zone.split('-')[:-1])
-
-    return project_id, region, zone
-
 GCP_PROJECT_ID, GCP_REGION, GCP_ZONE = get_gcp_metadata()
 logging.debug(f'GCP_PROJECT_ID: {GCP_PROJECT_ID}')
 logging.debug(f'GCP_REGION:     {GCP_REGION}')
 logging.debug(f'GCP_ZONE:       {GCP_ZONE}')
 
-# Initialize Vertex LLM Model
-model_vertex_llm_code = Google_Cloud_GenAI(GCP_PROJECT_ID, GCP_REGION=GCP_REGION, MODEL_TYPE='code-bison')
+# Initialize Vertex LLM Model. The default model loads at startup; other models and versions are created on first use.
+code_models = model_pool_from_env(
+    lambda name: Google_Cloud_GenAI(GCP_PROJECT_ID, GCP_REGION=GCP_REGION, MODEL_TYPE='code-bison', MODEL_NAME=name),
+    default_model='code-bison@001',
+)
+codechat_models = model_pool_from_env(
+    lambda name: Google_Cloud_GenAI(GCP_PROJECT_ID, GCP_REGION=GCP_REGION, MODEL_TYPE='codechat-bison', MODEL_NAME=name),
+    default_model='codechat-bison@001',
+    prefix='VERTEX_CODECHAT',
+)
+model_vertex_llm_code = code_models.default
+model_vertex_llm_codechat = codechat_models.default
+
+# Server-side code chat sessions, keyed by conversation_id
+codechat_sessions = session_store_from_env()
+
+# Editor completion sessions, keyed by session_id. Each keystroke supersedes the session's older requests.
+completion_sessions = completion_sessions_from_env()
+COMPLETION_DEBOUNCE_SECONDS = int(os.environ.get('CODE_COMPLETION_DEBOUNCE_MS', '100')) / 1000
 
 headers = {"Content-Type": "application/json"}
 
@@ -71,6 +86,37 @@ class Payload_Vertex_Code(BaseModel):
     temperature: float | None = 0.2
     top_p: float | None = 0.8
     top_k: int | None = 40
+    # Model name or version to use, such as "code-bison@002". Defaults to the service's default model.
+    model: str | None = None
+
+
+class Payload_Vertex_Code_Complete(BaseModel):
+    session_id: str
+    prefix: str
+    suffix: str | None = ''
+    # Increasing per session. Optional; without it, requests are ordered by arrival.
+    seq: int | None = None
+    max_output_tokens: int | None = 64
+    temperature: float | None = 0.2
+    # Model name or version to use, such as "code-bison@002". Defaults to the service's default model.
+    model: str | None = None
+
+
+# Mirrors vertexai.language_models.ChatMessage, so the Vertex SDK is not imported at module load.
+class Chat_Message(BaseModel):
+    author: str
+    content: str
+
+
+class Payload_Vertex_Code_Chat(BaseModel):
+    prompt: str
+    conversation_id: str | None = None
+    context: str | None = ''
+    message_history: List[Chat_Message] | None = []
+    max_output_tokens: int | None = 1024
+    temperature: float | None = 0.2
+    # Model name or version to use, such as "codechat-bison@002". Defaults to the service's default model.
+    model: str | None = None
 
 
 # Routes 
@@ -81,8 +127,19 @@ async def health_check():
     return {'status': 'ok'}
 
 
+@app.get("/genai_ready", include_in_schema=False)
+async def readiness_check():
+    ready = model_vertex_llm_code.ready.is_set() and model_vertex_llm_codechat.ready.is_set()
+    content = {'code-bison': code_models.status(), 'codechat-bison': codechat_models.status()}
+    return JSONResponse(status_code=200 if ready else 503, content=content)
+
+
 @app.post("/")
-def vertex_llm_code(payload: Payload_Vertex_Code):
+async def vertex_llm_code(payload: Payload_Vertex_Code):
+    try:
+        model = await code_models.acquire(payload.model)
+    except Vertex_Error as e:
+        return error_response(e)
     try:
         request_payload = {
             'prompt': payload.prompt, 
@@ -91,11 +148,117 @@ def vertex_llm_code(payload: Payload_Vertex_Code):
             'top_p': payload.top_p,
             'top_k': payload.top_k,
         }
-        response = model_vertex_llm_code.call_llm(**request_payload)
+        response = await model.call_llm_async(**request_payload)
         return response.text
     except Exception as e:
-        print(f'EXCEPTION: {e}')
-        return {}
+        return error_response(e)
+
+
+@app.post("/stream")
+async def vertex_llm_code_stream(payload: Payload_Vertex_Code):
+    try:
+        model = await code_models.acquire(payload.model)
+    except Vertex_Error as e:
+        return error_response(e)
+    request_payload = {
+        'prompt': payload.prompt,
+        'max_output_tokens': payload.max_output_tokens,
+        'temperature': payload.temperature,
+        'top_p': payload.top_p,
+        'top_k': payload.top_k,
+    }
+    return sse_response(sse_text_events(model.stream_llm_async(**request_payload)))
+
+
+@app.post("/complete")
+async def vertex_llm_code_complete(payload: Payload_Vertex_Code_Complete):
+    '''
+    Completes the code between prefix and suffix, for an editor that asks on
+    every pause in typing. A newer request for the same session supersedes
+    older ones: they return {"superseded": true} and are not sent to Vertex,
+    or their Vertex call is cancelled. A prefix that extends a recent
+    completion is answered from the session's cache.
+    '''
+    try:
+        model = await code_models.acquire(payload.model)
+    except Vertex_Error as e:
+        return error_response(e)
+    try:
+        session = completion_sessions.get(payload.session_id)
+        settings = (payload.model, payload.max_output_tokens, payload.temperature)
+
+        async def generate():
+            response = await model.call_llm_async(
+                prompt=payload.prefix,
+                code_suffix=payload.suffix,
+                max_output_tokens=payload.max_output_tokens,
+                temperature=payload.temperature,
+            )
+            return response.text
+
+        return await complete_in_session(
+            session, settings, payload.prefix, payload.suffix, generate,
+            debounce_seconds=COMPLETION_DEBOUNCE_SECONDS, seq=payload.seq,
+        )
+    except Exception as e:
+        return error_response(e)
+
+
+@app.delete("/complete/sessions/{session_id}")
+def vertex_llm_code_end_completion_session(session_id: str):
+    return {'deleted': completion_sessions.delete(session_id)}
+
+
+@app.post("/chat")
+async def vertex_llm_codechat(payload: Payload_Vertex_Code_Chat):
+    try:
+        model = await codechat_models.acquire(payload.model)
+    except Vertex_Error as e:
+        return error_response(e)
+    try:
+        request_payload = {
+            'prompt': payload.prompt,
+            'context': payload.context,
+            'message_history': payload.message_history,
+            'max_output_tokens': payload.max_output_tokens,
+            'temperature': payload.temperature,
+        }
+        if payload.conversation_id:
+            # Only the new message is sent; the history lives in the server-side session.
+            response = await send_in_conversation(codechat_sessions, model, payload.conversation_id, request_payload)
+        else:
+            response = await model.call_llm_async(**request_payload)
+        return response.text
+    except Exception as e:
+        return error_response(e)
+
+
+@app.post("/chat/stream")
+async def vertex_llm_codechat_stream(payload: Payload_Vertex_Code_Chat):
+    try:
+        model = await codechat_models.acquire(payload.model)
+    except Vertex_Error as e:
+        return error_response(e)
+    request_payload = {
+        'prompt': payload.prompt,
+        'context': payload.context,
+        'message_history': payload.message_history,
+        'max_output_tokens': payload.max_output_tokens,
+        'temperature': payload.temperature,
+    }
+    if payload.conversation_id:
+        try:
+            chunks = stream_in_conversation(codechat_sessions, model, payload.conversation_id, request_payload)
+        except Vertex_Error as e:
+            return error_response(e)
+    else:
+        chunks = model.stream_llm_async(**request_payload)
+    return sse_response(sse_text_events(chunks))
+
+
+@app.delete("/chat/conversations/{conversation_id}")
+def vertex_llm_codechat_end_conversation(conversation_id: str):
+    return {'deleted': codechat_sessions.delete(conversation_id)}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,95 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pytest -s -W ignore
+
+import asyncio
+from utils.completion_session import Completion_Session, Completion_Sessions, complete_in_session
+
+
+class Fake_Generate:
+    '''Completes after delay seconds, and records which calls ran and which were cancelled.'''
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.calls = []
+        self.cancelled = []
+
+    def __call__(self, completion):
+        async def generate():
+            self.calls.append(completion)
+            try:
+                await asyncio.sleep(self.delay)
+            except asyncio.CancelledError:
+                self.cancelled.append(completion)
+                raise
+            return completion
+        return generate
+
+
+def test_prefix_extension_is_served_from_cache():
+    session = Completion_Session()
+    generate = Fake_Generate()
+
+    async def run():
+        first = await complete_in_session(session, 'code-bison', 'def add(a, b):', '', generate('\n    return a + b'), debounce_seconds=0)
+        second = await complete_in_session(session, 'code-bison', 'def add(a, b):\n    ret', '', generate('unused'), debounce_seconds=0)
+        # Typing that diverges from the completion, or other settings, is a miss
+        third = await complete_in_session(session, 'code-bison', 'def add(a, b):\n    pass', '', generate(''), debounce_seconds=0)
+        fourth = await complete_in_session(session, 'code-bison@002', 'def add(a, b):', '', generate('\n    return b + a'), debounce_seconds=0)
+        return first, second, third, fourth
+
+    first, second, third, fourth = asyncio.run(run())
+    assert first == {'completion': '\n    return a + b', 'cached': False, 'superseded': False, 'seq': 1}
+    assert second == {'completion': 'urn a + b', 'cached': True, 'superseded': False, 'seq': 2}
+    assert not third['cached'] and not fourth['cached']
+    assert generate.calls == ['\n    return a + b', '', '\n    return b + a']
+
+
+def test_newer_requests_supersede_older_ones():
+    session = Completion_Session()
+    generate = Fake_Generate(delay=0.1)
+
+    async def run():
+        # a is in flight when c arrives; b arrives during a's call but is debounced away by c
+        a = asyncio.create_task(complete_in_session(session, None, 'a', '', generate('a'), debounce_seconds=0.02))
+        await asyncio.sleep(0.05)
+        b = asyncio.create_task(complete_in_session(session, None, 'ab', '', generate('b'), debounce_seconds=0.02))
+        await asyncio.sleep(0.01)
+        c = asyncio.create_task(complete_in_session(session, None, 'abc', '', generate('c'), debounce_seconds=0.02))
+        # A late request, older than the newest seen, is dropped at once
+        late = await complete_in_session(session, None, 'ab', '', generate('late'), debounce_seconds=0.02, seq=2)
+        return await asyncio.gather(a, b, c), late
+
+    (a, b, c), late = asyncio.run(run())
+    assert a['superseded'] and b['superseded'] and late['superseded']
+    assert c == {'completion': 'c', 'cached': False, 'superseded': False, 'seq': 3}
+    assert generate.calls == ['a', 'c']
+    assert generate.cancelled == ['a']
+    assert session.task is None
+
+
+def test_sessions_expire_and_are_bounded():
+    sessions = Completion_Sessions(max_sessions=2, ttl_seconds=600)
+    first = sessions.get('one')
+    sessions.get('two')
+    assert sessions.get('one') is first
+    sessions.get('three')
+    assert len(sessions) == 2
+    # 'two' was the least recently used
+    assert sessions.get('one') is first and sessions.delete('three') and not sessions.delete('two')
+
+    sessions.ttl_seconds = 0
+    sessions.get('four')
+    assert len(sessions) == 1
@@ -0,0 +1,157 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+
+
+class Completion_Session:
+    '''
+    The state of one editor session: the newest request seen, the Vertex
+    call in flight, and a small LRU of recent completions.
+    '''
+
+    def __init__(self, cache_size=16):
+        self.latest_seq = 0
+        self.task = None
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self.last_used = time.monotonic()
+
+    def lookup(self, settings, prefix, suffix):
+        '''
+        Returns the rest of a cached completion that the prefix extends, or
+        None. If "def add(a, b):" was completed with "\\n    return a + b",
+        then "def add(a, b):\\n    ret" is served "urn a + b" from the cache.
+        Only completions with the same settings and suffix are reused.
+        '''
+        for (cached_settings, cached_prefix, cached_suffix), completion in reversed(self._cache.items()):
+            if cached_settings != settings or cached_suffix != suffix or not prefix.startswith(cached_prefix):
+                continue
+            typed = prefix[len(cached_prefix):]
+            if completion.startswith(typed):
+                self._cache.move_to_end((cached_settings, cached_prefix, cached_suffix))
+                return completion[len(typed):]
+        return None
+
+    def remember(self, settings, prefix, suffix, completion):
+        self._cache[(settings, prefix, suffix)] = completion
+        self._cache.move_to_end((settings, prefix, suffix))
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+
+class Completion_Sessions:
+    '''Completion sessions keyed by session id, expiring after ttl_seconds without use.'''
+
+    def __init__(self, max_sessions=10000, ttl_seconds=600, cache_size=16):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.cache_size = cache_size
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            cutoff = time.monotonic() - self.ttl_seconds
+            while self._sessions and next(iter(self._sessions.values())).last_used < cutoff:
+                self._sessions.popitem(last=False)
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = Completion_Session(self.cache_size)
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            session.last_used = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def delete(self, session_id):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None and session.task is not None:
+            session.task.cancel()
+        return session is not None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+
+async def complete_in_session(session, settings, prefix, suffix, generate, debounce_seconds=0.1, seq=None):
+    '''
+    Completes prefix (and suffix) for one keystroke of an editor session.
+
+    A request is superseded, and returns without calling Vertex, when a newer
+    one arrives for the session during the debounce. A newer request that
+    survives its debounce cancels the older request's Vertex call. Cache hits
+    are answered at once. seq, when the client sends it, orders requests that
+    arrive out of order; otherwise arrival order is used.
+
+    settings is anything hashable that changes the completion, such as the
+    model and temperature; cached completions are only reused for the same
+    settings. generate() is awaited for the completion text on a cache miss.
+    Returns {"completion", "cached", "superseded", "seq"}.
+    '''
+    seq = seq if seq is not None else session.latest_seq + 1
+    if seq <= session.latest_seq:
+        return superseded(seq)
+    session.latest_seq = seq
+
+    completion = session.lookup(settings, prefix, suffix)
+    if completion is not None:
+        return {'completion': completion, 'cached': True, 'superseded': False, 'seq': seq}
+
+    await asyncio.sleep(debounce_seconds)
+    if session.latest_seq != seq:
+        return superseded(seq)
+
+    # The older call may have finished during the debounce, and cover this prefix
+    completion = session.lookup(settings, prefix, suffix)
+    if completion is not None:
+        return {'completion': completion, 'cached': True, 'superseded': False, 'seq': seq}
+
+    if session.task is not None and not session.task.done():
+        session.task.cancel()
+    task = session.task = asyncio.ensure_future(generate())
+    try:
+        completion = await asyncio.shield(task)
+    except asyncio.CancelledError:
+        if task.cancelled():
+            # Cancelled by a newer request, not by this request's client going away
+            return superseded(seq)
+        task.cancel()
+        raise
+    finally:
+        if session.task is task and task.done():
+            session.task = None
+
+    session.remember(settings, prefix, suffix, completion)
+    if session.latest_seq != seq:
+        return superseded(seq)
+    return {'completion': completion, 'cached': False, 'superseded': False, 'seq': seq}
+
+
+def superseded(seq):
+    return {'completion': None, 'cached': False, 'superseded': True, 'seq': seq}
+
+
+def completion_sessions_from_env():
+    return Completion_Sessions(
+        max_sessions=int(os.environ.get('CODE_COMPLETION_SESSIONS_MAX', '10000')),
+        ttl_seconds=int(os.environ.get('CODE_COMPLETION_SESSION_TTL', '600')),
+        cache_size=int(os.environ.get('CODE_COMPLETION_CACHE_SIZE', '16')),
+    )
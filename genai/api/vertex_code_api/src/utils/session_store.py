@@ -0,0 +1,201 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# This file is shared by vertex_chat_api and vertex_code_api. Keep the copies identical.
+
+import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from utils.retry import Vertex_Error
+
+
+def session_size(session, context=''):
+    '''Approximate memory held by a chat session: the bytes of its context and message history.'''
+    size = len(context.encode())
+    for message in session.message_history:
+        size += len(message.content.encode())
+    return size
+
+
+class Session_Entry:
+
+    def __init__(self, session, context='', model_name=None):
+        self.session = session
+        self.context = context
+        # The model version the session was started on, such as "chat-bison@002"
+        self.model_name = model_name
+        # Serializes turns within one conversation
+        self.lock = asyncio.Lock()
+        self.size = session_size(session, context)
+        self.last_used = time.monotonic()
+
+
+class Session_Store:
+    '''
+    Thread-safe store of live chat sessions keyed by conversation id.
+
+    Sessions expire after ttl_seconds without use. When there are more than
+    max_sessions sessions, or their total size exceeds max_bytes, the least
+    recently used sessions are evicted first. Callers that find no session
+    start a new one, so an evicted conversation only loses its server-side
+    history, and can be rebuilt from a message_history sent by the client.
+    '''
+
+    def __init__(self, max_sessions=1000, ttl_seconds=1800, max_bytes=64 * 1024 * 1024):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, conversation_id):
+        with self._lock:
+            self._purge_expired()
+            entry = self._entries.get(conversation_id)
+            if entry is not None:
+                entry.last_used = time.monotonic()
+                self._entries.move_to_end(conversation_id)
+            return entry
+
+    def put(self, conversation_id, session, context='', model_name=None):
+        entry = Session_Entry(session, context, model_name)
+        with self._lock:
+            self._remove(conversation_id)
+            self._insert(conversation_id, entry)
+        return entry
+
+    def get_or_create(self, conversation_id, create):
+        '''
+        Returns the conversation's entry, or stores a new one from create(),
+        which returns (session, context, model_name). The lookup and insert
+        hold the lock together, so concurrent first turns share one session.
+        '''
+        with self._lock:
+            self._purge_expired()
+            entry = self._entries.get(conversation_id)
+            if entry is not None:
+                entry.last_used = time.monotonic()
+                self._entries.move_to_end(conversation_id)
+                return entry
+            entry = Session_Entry(*create())
+            self._insert(conversation_id, entry)
+            return entry
+
+    def touch(self, conversation_id, entry):
+        '''Re-measures a session after a turn and re-applies the memory cap.'''
+        with self._lock:
+            if self._entries.get(conversation_id) is not entry:
+                return
+            size = session_size(entry.session, entry.context)
+            self.total_bytes += size - entry.size
+            entry.size = size
+            entry.last_used = time.monotonic()
+            self._entries.move_to_end(conversation_id)
+            self._evict()
+
+    def delete(self, conversation_id):
+        with self._lock:
+            return self._remove(conversation_id) is not None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _insert(self, conversation_id, entry):
+        self._entries[conversation_id] = entry
+        self.total_bytes += entry.size
+        self._evict()
+
+    def _remove(self, conversation_id):
+        entry = self._entries.pop(conversation_id, None)
+        if entry is not None:
+            self.total_bytes -= entry.size
+        return entry
+
+    def _purge_expired(self):
+        cutoff = time.monotonic() - self.ttl_seconds
+        while self._entries:
+            conversation_id, entry = next(iter(self._entries.items()))
+            if entry.last_used >= cutoff:
+                break
+            self._remove(conversation_id)
+
+    def _evict(self):
+        self._purge_expired()
+        while self._entries and (len(self._entries) > self.max_sessions or self.total_bytes > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+
+
+def conversation_entry(sessions, model, conversation_id, request_payload):
+    '''
+    Returns the conversation's session entry, starting the session from the
+    payload's context and message_history when the conversation is new,
+    expired or evicted. A session stays on the model version it was started
+    on; a request for another version is refused with 409 rather than being
+    answered by the session's model.
+    '''
+    def start():
+        # Starting a session is local to the SDK, so it is cheap enough to run under the store lock
+        start_params = ('context', 'message_history', 'temperature', 'max_output_tokens', 'top_p', 'top_k')
+        session = model.start_chat(**{k: v for k, v in request_payload.items() if k in start_params})
+        return session, request_payload.get('context') or '', model.pretrained_model
+
+    entry = sessions.get_or_create(conversation_id, start)
+    if entry.model_name != model.pretrained_model:
+        raise Vertex_Error(
+            409,
+            f'Conversation {conversation_id!r} is on {entry.model_name}, not {model.pretrained_model}. '
+            f'End it, or use a new conversation_id, to change models.')
+    return entry
+
+
+async def send_in_conversation(sessions, model, conversation_id, request_payload):
+    '''
+    Sends request_payload['prompt'] on the conversation's server-side chat
+    session (see conversation_entry). Turns within one conversation are
+    serialized.
+    '''
+    entry = conversation_entry(sessions, model, conversation_id, request_payload)
+    async with entry.lock:
+        response = await model.call_llm_async(**request_payload, chat_session=entry.session)
+    sessions.touch(conversation_id, entry)
+    return response
+
+
+def stream_in_conversation(sessions, model, conversation_id, request_payload):
+    '''
+    Streaming variant of send_in_conversation. The session is looked up at
+    once, so a 409 is raised before the stream starts, and the conversation
+    stays locked until the stream ends.
+    '''
+    entry = conversation_entry(sessions, model, conversation_id, request_payload)
+    return _stream_entry(sessions, model, conversation_id, entry, request_payload)
+
+
+async def _stream_entry(sessions, model, conversation_id, entry, request_payload):
+    async with entry.lock:
+        async for text in model.stream_llm_async(**request_payload, chat_session=entry.session):
+            yield text
+    sessions.touch(conversation_id, entry)
+
+
+def session_store_from_env():
+    return Session_Store(
+        max_sessions=int(os.environ.get('CHAT_SESSION_MAX', '1000')),
+        ttl_seconds=int(os.environ.get('CHAT_SESSION_TTL', '1800')),
+        max_bytes=int(os.environ.get('CHAT_SESSION_MAX_BYTES', str(64 * 1024 * 1024))),
+    )
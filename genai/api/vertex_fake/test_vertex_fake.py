@@ -0,0 +1,211 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pytest -s -W ignore
+
+import os
+import sys
+import json
+import time
+import asyncio
+import inspect
+import subprocess
+import pytest
+import vertexai
+from vertexai import _fake, language_models
+from vertexai.preview.language_models import TextGenerationModel, ChatModel, CodeChatModel
+from vertexai.preview.generative_models import GenerativeModel, GenerationConfig, Content, Part
+from vertexai.preview.vision_models import ImageGenerationModel
+
+
+@pytest.fixture(autouse=True)
+def fast_config():
+    # Each test gets its own config, so latency and error settings do not leak between tests
+    _fake.config = _fake.Fake_Config(env={'VERTEX_FAKE_LATENCY': '0', 'VERTEX_FAKE_TOKENS_PER_SECOND': '0', 'VERTEX_FAKE_SEED': '1'})
+    yield _fake.config
+
+
+def test_text_is_deterministic_and_respects_max_output_tokens():
+    model = TextGenerationModel.from_pretrained('text-bison@001')
+    first = model.predict('Describe the castle.', max_output_tokens=1024).text
+    assert model.predict('Describe the castle.', max_output_tokens=1024).text == first
+    assert model.predict('Describe the bridge.', max_output_tokens=1024).text != first
+    assert len(model.predict('Describe the castle.', max_output_tokens=5).text.split()) == 5
+    assert model.count_tokens(['three word prompt']).total_tokens == 3
+
+
+def test_streaming_is_paced_at_tokens_per_second(fast_config):
+    fast_config.tokens_per_second = 400
+    fast_config.response_tokens = 40
+    model = TextGenerationModel.from_pretrained('text-bison@001')
+
+    async def run():
+        return [chunk.text async for chunk in model.predict_streaming_async('Describe the castle.', max_output_tokens=40)]
+
+    start = time.perf_counter()
+    chunks = asyncio.run(run())
+    elapsed = time.perf_counter() - start
+
+    assert len(chunks) > 1
+    assert ''.join(chunks) == model.predict('Describe the castle.', max_output_tokens=40).text
+    tokens = len(''.join(chunks).split())
+    assert elapsed >= 0.9 * tokens / 400
+
+
+def test_chat_session_keeps_history():
+    session = ChatModel.from_pretrained('chat-bison@001').start_chat(context='You are Mario.')
+    first = session.send_message('Hello').text
+    second = session.send_message('Hello').text
+    assert [m.author for m in session.message_history] == ['user', 'bot', 'user', 'bot']
+    # The reply depends on the whole conversation
+    assert first != second
+
+
+def test_injected_errors_carry_status_codes(fast_config):
+    model = TextGenerationModel.from_pretrained('text-bison@001')
+
+    fast_config.error_rate_429 = 1.0
+    with pytest.raises(Exception) as e:
+        model.predict('x')
+    assert e.value.code == 429
+
+    fast_config.error_rate_429, fast_config.error_rate_500 = 0.0, 1.0
+    with pytest.raises(Exception) as e:
+        asyncio.run(model.predict_async('x'))
+    assert e.value.code == 500
+
+    fast_config.error_rate_500 = 0.0
+    fast_config.quota_per_minute = 2
+    model.predict('x')
+    model.predict('x')
+    with pytest.raises(Exception) as e:
+        model.predict('x')
+    assert e.value.code == 429
+
+
+def test_gemini_stream_reports_usage():
+    model = GenerativeModel('gemini-pro')
+    contents = [Content(role='user', parts=[Part.from_data(b'png', mime_type='image/png'), Part.from_text('What is this?')])]
+
+    async def run():
+        chunks = await model.generate_content_async(contents, generation_config=GenerationConfig(max_output_tokens=1024), stream=True)
+        return [chunk async for chunk in chunks]
+
+    chunks = asyncio.run(run())
+    usage = chunks[-1]._raw_response.usage_metadata
+    assert usage.prompt_token_count == model.count_tokens(contents).total_tokens
+    assert usage.candidates_token_count == len(''.join(c.text for c in chunks).split())
+    assert chunks[-1].candidates[0].finish_reason.name == 'STOP'
+
+
+def test_images_are_png_and_depend_on_seed(fast_config):
+    fast_config.image_latency = _fake.Latency('0')
+    model = ImageGenerationModel.from_pretrained('imagegeneration@005')
+    images = model.generate_images(prompt='a castle', number_of_images=2, seed=1)
+    assert len(images.images) == 2
+    assert images.images[0]._image_bytes.startswith(b'\x89PNG')
+    assert model.generate_images(prompt='a castle', seed=1).images[0]._image_bytes == images.images[0]._image_bytes
+    assert model.generate_images(prompt='a castle', seed=2).images[0]._image_bytes != images.images[0]._image_bytes
+
+
+# The SDK calls the services make, as (module, class, method), which the fake must accept exactly as the SDK does
+SDK_CALLS = [
+    ('vertexai', None, 'init'),
+    ('vertexai.language_models', 'ChatModel', 'start_chat'),
+    ('vertexai.language_models', 'CodeChatModel', 'start_chat'),
+    ('vertexai.language_models', 'ChatSession', 'send_message'),
+    ('vertexai.language_models', 'ChatSession', 'send_message_async'),
+    ('vertexai.language_models', 'ChatSession', 'send_message_streaming_async'),
+    ('vertexai.language_models', 'CodeChatSession', 'send_message'),
+    ('vertexai.language_models', 'CodeChatSession', 'send_message_async'),
+    ('vertexai.language_models', 'CodeChatSession', 'send_message_streaming_async'),
+    ('vertexai.language_models', 'CodeGenerationModel', 'predict'),
+    ('vertexai.language_models', 'CodeGenerationModel', 'predict_async'),
+    ('vertexai.language_models', 'CodeGenerationModel', 'predict_streaming_async'),
+    ('vertexai.preview.language_models', 'ChatModel', 'start_chat'),
+    ('vertexai.preview.language_models', 'CodeChatModel', 'start_chat'),
+    ('vertexai.preview.language_models', 'ChatSession', '__init__'),
+    ('vertexai.preview.language_models', 'ChatSession', 'send_message'),
+    ('vertexai.preview.language_models', 'ChatSession', 'send_message_async'),
+    ('vertexai.preview.language_models', 'ChatSession', 'send_message_streaming_async'),
+    ('vertexai.preview.language_models', 'ChatSession', 'count_tokens'),
+    ('vertexai.preview.language_models', 'CodeChatSession', '__init__'),
+    ('vertexai.preview.language_models', 'CodeChatSession', 'send_message'),
+    ('vertexai.preview.language_models', 'CodeChatSession', 'send_message_async'),
+    ('vertexai.preview.language_models', 'CodeChatSession', 'send_message_streaming_async'),
+    ('vertexai.preview.language_models', 'CodeChatSession', 'count_tokens'),
+    ('vertexai.preview.language_models', 'CodeGenerationModel', 'predict'),
+    ('vertexai.preview.language_models', 'CodeGenerationModel', 'predict_async'),
+    ('vertexai.preview.language_models', 'CodeGenerationModel', 'predict_streaming_async'),
+    ('vertexai.preview.language_models', 'TextGenerationModel', 'predict'),
+    ('vertexai.preview.language_models', 'TextGenerationModel', 'predict_async'),
+    ('vertexai.preview.language_models', 'TextGenerationModel', 'predict_streaming_async'),
+    ('vertexai.preview.language_models', 'TextGenerationModel', 'count_tokens'),
+    ('vertexai.preview.language_models', 'CodeGenerationModel', 'count_tokens'),
+    ('vertexai.preview.generative_models', 'GenerativeModel', '__init__'),
+    ('vertexai.preview.generative_models', 'GenerativeModel', 'generate_content'),
+    ('vertexai.preview.generative_models', 'GenerativeModel', 'generate_content_async'),
+    ('vertexai.preview.generative_models', 'GenerativeModel', 'count_tokens'),
+    ('vertexai.preview.generative_models', 'GenerativeModel', 'count_tokens_async'),
+    ('vertexai.preview.generative_models', 'GenerationConfig', '__init__'),
+    ('vertexai.preview.generative_models', 'Content', '__init__'),
+    ('vertexai.preview.generative_models', 'Part', 'from_text'),
+    ('vertexai.preview.generative_models', 'Part', 'from_data'),
+    ('vertexai.preview.vision_models', 'ImageGenerationModel', 'generate_images'),
+]
+
+SIGNATURES = '''
+import importlib, inspect, json, sys
+def signature(module, cls, name):
+    target = importlib.import_module(module)
+    target = getattr(getattr(target, cls), name) if cls else getattr(target, name)
+    return [(p.name, p.kind.name, p.default is p.empty) for p in inspect.signature(target).parameters.values()]
+print(json.dumps([signature(*call) for call in json.loads(sys.argv[1])]))
+'''
+
+
+def signatures(calls, cwd, env):
+    result = subprocess.run([sys.executable, '-c', SIGNATURES, json.dumps(calls)], cwd=cwd, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    return [[tuple(parameter) for parameter in parameters] for parameters in json.loads(result.stdout)]
+
+
+def test_signatures_match_the_sdk(tmp_path):
+    # The real SDK is imported in a separate process, outside this directory, so the fake does not shadow it
+    env = {name: value for name, value in os.environ.items() if name != 'PYTHONPATH'}
+    real = subprocess.run([sys.executable, '-c', 'import vertexai, sys; sys.exit(getattr(vertexai, "__version__", None) == "fake")'], cwd=tmp_path, env=env)
+    if real.returncode != 0:
+        pytest.skip('google-cloud-aiplatform is not installed')
+
+    fake_env = {**env, 'PYTHONPATH': os.path.dirname(os.path.dirname(vertexai.__file__))}
+    expected = signatures(SDK_CALLS, tmp_path, env)
+    for call, fake, sdk in zip(SDK_CALLS, signatures(SDK_CALLS, tmp_path, fake_env), expected):
+        assert fake == sdk, call
+
+
+def test_unknown_arguments_are_rejected_like_the_sdk():
+    # GA code chat takes no sampling arguments; the preview session accepts them
+    session = language_models.CodeChatModel.from_pretrained('codechat-bison@002').start_chat(context='You write Python.')
+    with pytest.raises(TypeError):
+        session.send_message('Write a loop.', top_k=40)
+    with pytest.raises(TypeError):
+        ImageGenerationModel.from_pretrained('imagegeneration@005').generate_images('a castle', 2)
+
+
+def test_chat_count_tokens_includes_context_and_history():
+    session = ChatModel.from_pretrained('chat-bison@001').start_chat(context='You are Mario.')
+    before = session.count_tokens('Hello').total_tokens
+    session.send_message('Hello')
+    assert session.count_tokens('Hello').total_tokens > before
+    assert before > _fake.count_tokens('Hello')
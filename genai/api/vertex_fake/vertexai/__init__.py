@@ -0,0 +1,28 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Offline stand-in for the parts of the Vertex AI SDK that the vertex_*_api
+services use. Put this directory first on PYTHONPATH and the services run,
+and can be load tested, without GCP. See README.md.
+'''
+
+import logging
+
+__version__ = 'fake'
+
+
+def init(*, project=None, location=None, experiment=None, experiment_description=None, experiment_tensorboard=None, staging_bucket=None,
+         credentials=None, encryption_spec_key_name=None, network=None, service_account=None, api_endpoint=None):
+    logging.warning(f'Using the offline Vertex AI stand-in (project={project}, location={location}). No requests reach Vertex.')
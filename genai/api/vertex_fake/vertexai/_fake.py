@@ -0,0 +1,195 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Behaviour shared by the fake models: latency, streaming pace, injected
+errors, and the deterministic text and images they return.
+'''
+
+import os
+import math
+import time
+import zlib
+import struct
+import random
+import asyncio
+import hashlib
+import threading
+from collections import deque
+
+try:
+    from google.api_core.exceptions import ResourceExhausted, InternalServerError
+except ImportError:
+    class ResourceExhausted(Exception):
+        code = 429
+
+    class InternalServerError(Exception):
+        code = 500
+
+
+WORDS = (
+    'the castle level mario princess bridge lava coin block pipe goomba koopa star '
+    'world jump secret door key boss shell cloud hill tower map warp flag time bonus '
+    'player enemy path water cave forest sky fire ice stone gold red green blue'
+).split()
+
+
+class Latency:
+    '''
+    A latency distribution in seconds, parsed from a spec such as "0.2",
+    "fixed:0.2", "uniform:0.1,0.5", "normal:0.3,0.1", "exponential:0.3"
+    or "lognormal:0.3,0.5" (median and sigma).
+    '''
+
+    def __init__(self, spec):
+        self.spec = spec
+        kind, _, args = spec.partition(':') if ':' in spec else ('fixed', '', spec)
+        self.kind = kind.strip().lower()
+        self.args = [float(a) for a in args.split(',') if a.strip()]
+        if self.kind not in ('fixed', 'uniform', 'normal', 'exponential', 'lognormal'):
+            raise ValueError(f'Unknown latency distribution {spec!r}')
+
+    def sample(self, rng):
+        if self.kind == 'fixed':
+            value = self.args[0]
+        elif self.kind == 'uniform':
+            value = rng.uniform(self.args[0], self.args[1])
+        elif self.kind == 'normal':
+            value = rng.gauss(self.args[0], self.args[1])
+        elif self.kind == 'exponential':
+            value = rng.expovariate(1 / self.args[0]) if self.args[0] > 0 else 0
+        else:
+            value = rng.lognormvariate(math.log(self.args[0]), self.args[1]) if self.args[0] > 0 else 0
+        return max(0.0, value)
+
+
+class Fake_Config:
+    '''
+    Read from VERTEX_FAKE_* environment variables at import. Tests can
+    change the attributes of the module-level config directly.
+    '''
+
+    def __init__(self, env=os.environ):
+        # Time until the first token, and until an image is generated
+        self.latency = Latency(env.get('VERTEX_FAKE_LATENCY', 'lognormal:0.3,0.4'))
+        self.image_latency = Latency(env.get('VERTEX_FAKE_IMAGE_LATENCY', 'lognormal:4,0.3'))
+        # Generation speed after the first token. 0 returns all tokens at once.
+        self.tokens_per_second = float(env.get('VERTEX_FAKE_TOKENS_PER_SECOND', '60'))
+        self.chunk_tokens = int(env.get('VERTEX_FAKE_CHUNK_TOKENS', '8'))
+        # Responses are up to this many tokens, and never more than max_output_tokens
+        self.response_tokens = int(env.get('VERTEX_FAKE_RESPONSE_TOKENS', '128'))
+        self.load_seconds = float(env.get('VERTEX_FAKE_LOAD_SECONDS', '0'))
+        self.image_size = int(env.get('VERTEX_FAKE_IMAGE_SIZE', '256'))
+        # Probability of failing a call with a 429 or a 500
+        self.error_rate_429 = float(env.get('VERTEX_FAKE_ERROR_RATE_429', '0'))
+        self.error_rate_500 = float(env.get('VERTEX_FAKE_ERROR_RATE_500', '0'))
+        # Calls per minute before every call fails with a 429, like a Vertex quota. 0 is unlimited.
+        self.quota_per_minute = int(env.get('VERTEX_FAKE_QUOTA_PER_MINUTE', '0'))
+        seed = env.get('VERTEX_FAKE_SEED')
+        self.rng = random.Random(int(seed) if seed else None)
+        self._rng_lock = threading.Lock()
+        self._calls = deque()
+        self._calls_lock = threading.Lock()
+
+    def sample(self, latency):
+        with self._rng_lock:
+            return latency.sample(self.rng)
+
+    def check_errors(self):
+        '''Raises the injected error for a call, if any.'''
+        if self.quota_per_minute:
+            now = time.monotonic()
+            with self._calls_lock:
+                while self._calls and self._calls[0] < now - 60:
+                    self._calls.popleft()
+                if len(self._calls) >= self.quota_per_minute:
+                    raise ResourceExhausted(f'Quota exceeded: {self.quota_per_minute} requests per minute (fake).')
+                self._calls.append(now)
+        with self._rng_lock:
+            draw = self.rng.random()
+        if draw < self.error_rate_429:
+            raise ResourceExhausted('Quota exceeded (injected by the fake).')
+        if draw < self.error_rate_429 + self.error_rate_500:
+            raise InternalServerError('Internal error (injected by the fake).')
+
+    def generation_seconds(self, tokens):
+        return tokens / self.tokens_per_second if self.tokens_per_second > 0 else 0
+
+
+config = Fake_Config()
+
+
+def count_tokens(text):
+    return len(text.split())
+
+
+def fake_text(model_name, prompt, max_output_tokens=None):
+    '''The same model, prompt and max_output_tokens always give the same text.'''
+    rng = random.Random(hashlib.sha256(f'{model_name}\n{prompt}'.encode()).digest())
+    tokens = rng.randint(min(16, config.response_tokens), config.response_tokens)
+    if max_output_tokens:
+        tokens = min(tokens, max_output_tokens)
+    return ' '.join(rng.choice(WORDS) for _ in range(tokens))
+
+
+def chunks_of(text):
+    words = text.split(' ')
+    size = max(1, config.chunk_tokens)
+    for i in range(0, len(words), size):
+        yield ' '.join(words[i:i + size]) + (' ' if i + size < len(words) else '')
+
+
+def generate(text):
+    '''Blocks for the time a call returning text takes, after checking for injected errors.'''
+    config.check_errors()
+    time.sleep(config.sample(config.latency) + config.generation_seconds(count_tokens(text)))
+
+
+async def generate_async(text):
+    config.check_errors()
+    await asyncio.sleep(config.sample(config.latency) + config.generation_seconds(count_tokens(text)))
+
+
+async def stream_async(text, check_errors=True):
+    '''Yields the chunks of text, paced at tokens_per_second after the first-token latency.'''
+    if check_errors:
+        config.check_errors()
+    await asyncio.sleep(config.sample(config.latency))
+    for chunk in chunks_of(text):
+        yield chunk
+        await asyncio.sleep(config.generation_seconds(count_tokens(chunk)))
+
+
+def load():
+    time.sleep(config.load_seconds)
+
+
+def fake_png(key, size=None):
+    '''A gradient PNG whose colours are derived from key.'''
+    size = size or config.image_size
+    r, g, b = hashlib.sha256(key.encode()).digest()[:3]
+    rows = b''.join(
+        b'\x00' + bytes(
+            value
+            for x in range(size)
+            for value in ((r + x) % 256, (g + y) % 256, (b + x + y) % 256)
+        )
+        for y in range(size)
+    )
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    header = struct.pack('>IIBBBBB', size, size, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b'')
@@ -0,0 +1,190 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Signatures mirror vertexai.language_models in google-cloud-aiplatform 1.40, so
+a call the SDK would reject with a TypeError fails the same way on the fake.
+Sampling parameters are accepted and ignored.
+'''
+
+from dataclasses import dataclass
+from vertexai import _fake
+
+
+@dataclass
+class ChatMessage:
+    content: str
+    author: str
+
+
+@dataclass
+class InputOutputTextPair:
+    input_text: str
+    output_text: str
+
+
+class TextGenerationResponse:
+
+    def __init__(self, text, _prediction_response=None, is_blocked=False, errors=(), safety_attributes=None, grounding_metadata=None):
+        self.text = text
+        self._prediction_response = _prediction_response
+        self.is_blocked = is_blocked
+        self.errors = errors
+        self.safety_attributes = safety_attributes or {}
+        self.grounding_metadata = grounding_metadata
+
+    def __repr__(self):
+        return self.text
+
+
+class _Fake_Model:
+
+    def __init__(self, model_name):
+        self._model_name = model_name
+
+    @classmethod
+    def from_pretrained(cls, model_name):
+        _fake.load()
+        return cls(model_name)
+
+    def _text(self, prompt, max_output_tokens):
+        return _fake.fake_text(self._model_name, prompt, max_output_tokens)
+
+    def _predict(self, text):
+        _fake.generate(text)
+        return TextGenerationResponse(text)
+
+    async def _predict_async(self, text):
+        await _fake.generate_async(text)
+        return TextGenerationResponse(text)
+
+    async def _predict_streaming_async(self, text):
+        async for chunk in _fake.stream_async(text):
+            yield TextGenerationResponse(chunk)
+
+
+class TextGenerationModel(_Fake_Model):
+    '''text-bison. predict takes a prompt.'''
+
+    def predict(self, prompt, *, max_output_tokens=128, temperature=None, top_k=None, top_p=None, stop_sequences=None,
+                candidate_count=None, grounding_source=None, logprobs=None, presence_penalty=None, frequency_penalty=None, logit_bias=None):
+        return self._predict(self._text(prompt, max_output_tokens))
+
+    async def predict_async(self, prompt, *, max_output_tokens=128, temperature=None, top_k=None, top_p=None, stop_sequences=None,
+                            candidate_count=None, grounding_source=None, logprobs=None, presence_penalty=None, frequency_penalty=None, logit_bias=None):
+        return await self._predict_async(self._text(prompt, max_output_tokens))
+
+    def predict_streaming_async(self, prompt, *, max_output_tokens=128, temperature=None, top_k=None, top_p=None, stop_sequences=None,
+                                logprobs=None, presence_penalty=None, frequency_penalty=None, logit_bias=None):
+        return self._predict_streaming_async(self._text(prompt, max_output_tokens))
+
+
+class CodeGenerationModel(_Fake_Model):
+    '''code-bison. predict takes a prefix and an optional suffix.'''
+
+    def _code(self, prefix, suffix, max_output_tokens):
+        return self._text(f'{prefix}\n{suffix or ""}', max_output_tokens)
+
+    def predict(self, prefix, suffix=None, *, max_output_tokens=None, temperature=None, stop_sequences=None, candidate_count=None):
+        return self._predict(self._code(prefix, suffix, max_output_tokens))
+
+    async def predict_async(self, prefix, suffix=None, *, max_output_tokens=None, temperature=None, stop_sequences=None, candidate_count=None):
+        return await self._predict_async(self._code(prefix, suffix, max_output_tokens))
+
+    def predict_streaming_async(self, prefix, suffix=None, *, max_output_tokens=None, temperature=None, stop_sequences=None):
+        return self._predict_streaming_async(self._code(prefix, suffix, max_output_tokens))
+
+
+class _Chat_Session_Base:
+    '''Keeps the message history, like the SDK, so the reply depends on the whole conversation.'''
+
+    def __init__(self, model, context=None, max_output_tokens=None, message_history=None):
+        self._model = model
+        self._context = context or ''
+        self._max_output_tokens = max_output_tokens
+        self.message_history = list(message_history or [])
+
+    def _conversation(self, message):
+        return '\n'.join([self._context, *(m.content for m in self.message_history), message])
+
+    def _text(self, message, max_output_tokens):
+        return self._model._text(self._conversation(message), max_output_tokens or self._max_output_tokens)
+
+    def _record(self, message, text):
+        self.message_history += [ChatMessage(content=message, author='user'), ChatMessage(content=text, author='bot')]
+
+    def _send_message(self, message, max_output_tokens):
+        text = self._text(message, max_output_tokens)
+        _fake.generate(text)
+        self._record(message, text)
+        return TextGenerationResponse(text)
+
+    async def _send_message_async(self, message, max_output_tokens):
+        text = self._text(message, max_output_tokens)
+        await _fake.generate_async(text)
+        self._record(message, text)
+        return TextGenerationResponse(text)
+
+    async def _send_message_streaming_async(self, message, max_output_tokens):
+        text = self._text(message, max_output_tokens)
+        async for chunk in _fake.stream_async(text):
+            yield TextGenerationResponse(chunk)
+        self._record(message, text)
+
+
+class ChatSession(_Chat_Session_Base):
+
+    def __init__(self, model, context=None, examples=None, max_output_tokens=None, temperature=None, top_k=None, top_p=None,
+                 message_history=None, stop_sequences=None):
+        super().__init__(model, context, max_output_tokens, message_history)
+
+    def send_message(self, message, *, max_output_tokens=None, temperature=None, top_k=None, top_p=None, stop_sequences=None,
+                     candidate_count=None, grounding_source=None):
+        return self._send_message(message, max_output_tokens)
+
+    async def send_message_async(self, message, *, max_output_tokens=None, temperature=None, top_k=None, top_p=None, stop_sequences=None,
+                                 candidate_count=None, grounding_source=None):
+        return await self._send_message_async(message, max_output_tokens)
+
+    def send_message_streaming_async(self, message, *, max_output_tokens=None, temperature=None, top_k=None, top_p=None, stop_sequences=None):
+        return self._send_message_streaming_async(message, max_output_tokens)
+
+
+class CodeChatSession(_Chat_Session_Base):
+    '''Code chat takes no top_k or top_p, and its send_message_async no stop_sequences, as in the SDK.'''
+
+    def __init__(self, model, context=None, max_output_tokens=None, temperature=None, message_history=None, stop_sequences=None):
+        super().__init__(model, context, max_output_tokens, message_history)
+
+    def send_message(self, message, *, max_output_tokens=None, temperature=None, stop_sequences=None, candidate_count=None):
+        return self._send_message(message, max_output_tokens)
+
+    async def send_message_async(self, message, *, max_output_tokens=None, temperature=None, candidate_count=None):
+        return await self._send_message_async(message, max_output_tokens)
+
+    def send_message_streaming_async(self, message, *, max_output_tokens=None, temperature=None, stop_sequences=None):
+        return self._send_message_streaming_async(message, max_output_tokens)
+
+
+class ChatModel(_Fake_Model):
+
+    def start_chat(self, *, context=None, examples=None, max_output_tokens=None, temperature=None, top_k=None, top_p=None,
+                   message_history=None, stop_sequences=None):
+        return ChatSession(self, context=context, examples=examples, max_output_tokens=max_output_tokens, message_history=message_history)
+
+
+class CodeChatModel(_Fake_Model):
+
+    def start_chat(self, *, context=None, max_output_tokens=None, temperature=None, message_history=None, stop_sequences=None):
+        return CodeChatSession(self, context=context, max_output_tokens=max_output_tokens, message_history=message_history)
@@ -0,0 +1,171 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+from types import SimpleNamespace
+from vertexai import _fake
+
+
+# Gemini bills an image or document part as a fixed number of tokens
+DATA_PART_TOKENS = 258
+
+HARM_CATEGORIES = (
+    'HARM_CATEGORY_HATE_SPEECH',
+    'HARM_CATEGORY_DANGEROUS_CONTENT',
+    'HARM_CATEGORY_HARASSMENT',
+    'HARM_CATEGORY_SEXUALLY_EXPLICIT',
+)
+
+
+class Part:
+
+    def __init__(self, text=None, data=None, mime_type=None):
+        self.text = text
+        self.data = data
+        self.mime_type = mime_type
+
+    @staticmethod
+    def from_text(text):
+        return Part(text=text)
+
+    @staticmethod
+    def from_data(data, mime_type):
+        return Part(data=data, mime_type=mime_type)
+
+
+class Content:
+
+    def __init__(self, *, parts=None, role=None):
+        self.role = role
+        self.parts = parts or []
+
+
+class GenerationConfig:
+
+    def __init__(self, *, temperature=None, top_p=None, top_k=None, candidate_count=None, max_output_tokens=None, stop_sequences=None):
+        self.temperature = temperature
+        self.top_p = top_p
+        self.top_k = top_k
+        self.candidate_count = candidate_count
+        self.max_output_tokens = max_output_tokens
+        self.stop_sequences = stop_sequences
+
+
+class GenerationResponse:
+
+    def __init__(self, text, finish_reason, prompt_tokens, candidates_tokens):
+        candidate = SimpleNamespace(
+            text=text,
+            finish_reason=SimpleNamespace(name=finish_reason) if finish_reason else None,
+            safety_ratings=[
+                SimpleNamespace(category=SimpleNamespace(name=c), probability=SimpleNamespace(name='NEGLIGIBLE'), blocked=False)
+                for c in HARM_CATEGORIES
+            ],
+        )
+        self.candidates = [candidate]
+        usage = SimpleNamespace(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=candidates_tokens,
+            total_token_count=prompt_tokens + candidates_tokens,
+        )
+        self._raw_response = SimpleNamespace(usage_metadata=usage)
+
+    @property
+    def text(self):
+        return self.candidates[0].text
+
+
+def contents_text(contents):
+    '''The text of a request, which the reply is derived from. Data parts contribute their size and type.'''
+    if isinstance(contents, str):
+        return contents
+    if isinstance(contents, Content):
+        contents = [contents]
+    text = []
+    for content in contents:
+        for part in content.parts:
+            text.append(part.text if part.text is not None else f'<{part.mime_type} {len(part.data)} bytes>')
+    return '\n'.join(text)
+
+
+def contents_tokens(contents):
+    if isinstance(contents, str):
+        return _fake.count_tokens(contents)
+    if isinstance(contents, Content):
+        contents = [contents]
+    return sum(
+        _fake.count_tokens(part.text) if part.text is not None else DATA_PART_TOKENS
+        for content in contents
+        for part in content.parts
+    )
+
+
+class GenerativeModel:
+
+    def __init__(self, model_name, *, generation_config=None, safety_settings=None, tools=None):
+        _fake.load()
+        self._model_name = model_name
+        self._generation_config = generation_config
+
+    def _reply(self, contents, generation_config):
+        # Like the SDK, a config passed to the call replaces the model's, and may be a dict
+        generation_config = generation_config or self._generation_config
+        if isinstance(generation_config, dict):
+            generation_config = GenerationConfig(**generation_config)
+        max_output_tokens = generation_config.max_output_tokens if generation_config else None
+        text = _fake.fake_text(self._model_name, contents_text(contents), max_output_tokens)
+        finish_reason = 'MAX_TOKENS' if max_output_tokens and _fake.count_tokens(text) >= max_output_tokens else 'STOP'
+        return text, finish_reason, contents_tokens(contents)
+
+    def _chunks(self, text, finish_reason, prompt_tokens):
+        chunks = list(_fake.chunks_of(text))
+        generated = 0
+        for i, chunk in enumerate(chunks):
+            generated += _fake.count_tokens(chunk)
+            yield GenerationResponse(chunk, finish_reason if i == len(chunks) - 1 else None, prompt_tokens, generated)
+
+    def generate_content(self, contents, *, generation_config=None, safety_settings=None, tools=None, stream=False):
+        text, finish_reason, prompt_tokens = self._reply(contents, generation_config)
+        if not stream:
+            _fake.generate(text)
+            return GenerationResponse(text, finish_reason, prompt_tokens, _fake.count_tokens(text))
+
+        def chunks():
+            _fake.config.check_errors()
+            time.sleep(_fake.config.sample(_fake.config.latency))
+            for chunk in self._chunks(text, finish_reason, prompt_tokens):
+                yield chunk
+                time.sleep(_fake.config.generation_seconds(_fake.count_tokens(chunk.text)))
+        return chunks()
+
+    async def generate_content_async(self, contents, *, generation_config=None, safety_settings=None, tools=None, stream=False):
+        text, finish_reason, prompt_tokens = self._reply(contents, generation_config)
+        if not stream:
+            await _fake.generate_async(text)
+            return GenerationResponse(text, finish_reason, prompt_tokens, _fake.count_tokens(text))
+
+        # Like the SDK, errors are raised when the streaming call is made, not on the first chunk
+        _fake.config.check_errors()
+        chunk_responses = self._chunks(text, finish_reason, prompt_tokens)
+
+        async def chunks():
+            async for chunk in _fake.stream_async(text, check_errors=False):
+                yield next(chunk_responses)
+        return chunks()
+
+    def count_tokens(self, contents):
+        return SimpleNamespace(total_tokens=contents_tokens(contents), total_billable_characters=len(contents_text(contents)))
+
+    async def count_tokens_async(self, contents):
+        return self.count_tokens(contents)
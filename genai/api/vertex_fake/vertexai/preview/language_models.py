@@ -0,0 +1,86 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# The preview namespace adds count_tokens, as in google-cloud-aiplatform 1.40,
+# and its code chat takes the same arguments as chat
+from vertexai import _fake
+from vertexai import language_models
+from vertexai.language_models import (  # noqa: F401
+    ChatMessage,
+    InputOutputTextPair,
+    TextGenerationResponse,
+)
+
+
+class CountTokensResponse:
+
+    def __init__(self, total_tokens, total_billable_characters, _count_tokens_response=None):
+        self.total_tokens = total_tokens
+        self.total_billable_characters = total_billable_characters
+        self._count_tokens_response = _count_tokens_response
+
+
+def _count_tokens_response(text):
+    return CountTokensResponse(_fake.count_tokens(text), len(text.replace(' ', '')))
+
+
+class TextGenerationModel(language_models.TextGenerationModel):
+
+    def count_tokens(self, prompts):
+        return _count_tokens_response(' '.join(prompts))
+
+
+class CodeGenerationModel(language_models.CodeGenerationModel):
+
+    def count_tokens(self, prefix, *, suffix=None):
+        return _count_tokens_response(f'{prefix}\n{suffix or ""}')
+
+
+class ChatSession(language_models._Chat_Session_Base):
+
+    def __init__(self, model, context=None, examples=None, max_output_tokens=None, temperature=None, top_k=None, top_p=None,
+                 message_history=None, stop_sequences=None):
+        super().__init__(model, context, max_output_tokens, message_history)
+
+    def send_message(self, message, *, max_output_tokens=None, temperature=None, top_k=None, top_p=None, stop_sequences=None,
+                     candidate_count=None, grounding_source=None):
+        return self._send_message(message, max_output_tokens)
+
+    async def send_message_async(self, message, *, max_output_tokens=None, temperature=None, top_k=None, top_p=None, stop_sequences=None,
+                                 candidate_count=None, grounding_source=None):
+        return await self._send_message_async(message, max_output_tokens)
+
+    def send_message_streaming_async(self, message, *, max_output_tokens=None, temperature=None, top_k=None, top_p=None, stop_sequences=None):
+        return self._send_message_streaming_async(message, max_output_tokens)
+
+    def count_tokens(self, message):
+        '''Counts the message with the session's context and history, as the SDK does.'''
+        return _count_tokens_response(self._conversation(message))
+
+
+class CodeChatSession(ChatSession):
+    pass
+
+
+class ChatModel(language_models.ChatModel):
+
+    def start_chat(self, *, context=None, examples=None, max_output_tokens=None, temperature=None, top_k=None, top_p=None,
+                   message_history=None, stop_sequences=None):
+        return ChatSession(self, context=context, examples=examples, max_output_tokens=max_output_tokens, message_history=message_history)
+
+
+class CodeChatModel(language_models.CodeChatModel):
+
+    def start_chat(self, *, context=None, examples=None, max_output_tokens=None, temperature=None, message_history=None, stop_sequences=None):
+        return CodeChatSession(self, context=context, examples=examples, max_output_tokens=max_output_tokens, message_history=message_history)
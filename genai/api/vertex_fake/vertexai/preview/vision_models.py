@@ -0,0 +1,59 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+from vertexai import _fake
+
+
+class GeneratedImage:
+
+    def __init__(self, image_bytes, generation_parameters):
+        self._image_bytes = image_bytes
+        self.generation_parameters = generation_parameters
+
+    def save(self, location, include_generation_parameters=True):
+        with open(location, 'wb') as f:
+            f.write(self._image_bytes)
+
+
+class ImageGenerationResponse:
+
+    def __init__(self, images):
+        self.images = images
+
+    def __getitem__(self, idx):
+        return self.images[idx]
+
+    def __iter__(self):
+        return iter(self.images)
+
+
+class ImageGenerationModel:
+
+    def __init__(self, model_name):
+        self._model_name = model_name
+
+    @classmethod
+    def from_pretrained(cls, model_name):
+        _fake.load()
+        return cls(model_name)
+
+    def generate_images(self, prompt, *, negative_prompt=None, number_of_images=1, guidance_scale=None, language=None, seed=None):
+        '''The same prompt and seed always give the same images. Without a seed, the prompt alone decides.'''
+        _fake.config.check_errors()
+        time.sleep(_fake.config.sample(_fake.config.image_latency))
+        return ImageGenerationResponse([
+            GeneratedImage(_fake.fake_png(f'{self._model_name}\n{prompt}\n{seed}\n{i}'), {'prompt': prompt, 'seed': seed, 'index_of_image_in_batch': i})
+            for i in range(number_of_images or 1)
+        ])
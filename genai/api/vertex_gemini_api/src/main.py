@@ -12,14 +12,21 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from contextlib import asynccontextmanager
 from pydantic import BaseModel
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, JSONResponse
 from utils.model_util import GCP_GenAI_Gemini
+from utils.model_pool import model_pool_from_env
+from utils.gcp_metadata import get_gcp_metadata
+from utils.retry import Vertex_Error, error_response, status_code_of
+from utils.part_store import part_store_from_env
+from utils.token_budget import Token_Counter, Token_Budget_Exceeded, preflight, token_limits_from_env, PREFLIGHT_OFF
+from utils.sse import sse_event, sse_response
+from typing import List, Literal
 import io
 import os, sys
 import json
-import requests
 import logging
 
 logging.basicConfig(
@@ -29,50 +36,91 @@ logging.basicConfig(
     stream=sys.stdout,
 )
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Import the Vertex SDK and load the model in the background, so uvicorn
+    # binds its port immediately. Requests are gated on /genai_ready.
+    model.start_loading()
+    yield
+
+
 app = FastAPI(
+    lifespan=lifespan,
     redoc_url=None,
     title="API for the Vertex AI Gemini LLM",
     description="GenAI service that may contain business logic, data processing steps, and makes calls to the Google Cloud Gemini LLM",
     version="0.0.1",
 )
 
-def get_gcp_metadata():
-    metadata_server = "http://metadata.google.internal"
-    headers = {"Metadata-Flavor": "Google"}
+GCP_PROJECT_ID, GCP_REGION, GCP_ZONE = get_gcp_metadata()
+logging.debug(f'GCP_PROJECT_ID: {GCP_PROJECT_ID}')
+logging.debug(f'GCP_REGION:     {GCP_REGION}')
+logging.debug(f'GCP_ZONE:       {GCP_ZONE}')
+
+# Initialize Vertex LLM Model. The default model loads at startup; other models and versions are created on first use.
+gemini_models = model_pool_from_env(
+    lambda name: GCP_GenAI_Gemini(GCP_PROJECT_ID=GCP_PROJECT_ID, GCP_REGION=GCP_REGION, MODEL_TYPE=name),
+    default_model='gemini-pro',
+)
+model = gemini_models.default
 
-    # Get Project ID
-    project_id_url = f"{metadata_server}/computeMetadata/v1/project/project-id"
-    project_id_response = requests.get(project_id_url, headers=headers)
-    project_id = project_id_response.text if project_id_response.status_code == 200 else "Unavailable"
+# Token limits per model used by the preflight check. Defaults are the models' published limits.
+token_limits = token_limits_from_env(gemini_models.default_model)
 
-    # Get GCP Zone
-    zone_url = f"{metadata_server}/computeMetadata/v1/instance/zone"
-    zone_response = requests.get(zone_url, headers=headers)
-    zone = zone_response.text.split('/')[-1] if zone_response.status_code == 200 else "Unavailable"
+# Uploaded images and documents, referenced by the sha256 of their bytes
+part_store = part_store_from_env()
 
-    # Extract GCP Region
-    region = '-'.join(zone.split('-')[:-1])
 
-    return project_id, region, zone
+async def count_tokens(model, prompt, message_history=None, parts=None):
+    return await model.count_tokens_async(prompt, message_history, part_store.resolve(parts))
 
-GCP_PROJECT_ID, GCP_REGION, GCP_ZONE = get_gcp_metadata()
-logging.debug(f'GCP_PROJECT_ID: {GCP_PROJECT_ID}')
-logging.debug(f'GCP_REGION:     {GCP_REGION}')
-logging.debug(f'GCP_ZONE:       {GCP_ZONE}')
 
-# Initialize Vertex LLM Model
-model = GCP_GenAI_Gemini(GCP_PROJECT_ID=GCP_PROJECT_ID, GCP_REGION=GCP_REGION,  MODEL_TYPE='gemini-pro')
+token_counter = Token_Counter(count_tokens, max_entries=int(os.environ.get('TOKEN_COUNT_CACHE_SIZE', '10000')))
 
 headers = {"Content-Type": "application/json"}
 
+
+class Gemini_Message(BaseModel):
+    role: Literal['user', 'model']
+    text: str
+
+
+# One of: text; base64 data with its mime_type; or the hash of a part uploaded earlier
+class Gemini_Part(BaseModel):
+    text: str | None = None
+    data: str | None = None
+    mime_type: str | None = None
+    hash: str | None = None
+
+
+class Payload_Part(BaseModel):
+    data: str
+    mime_type: str
+
+
+class Payload_Count_Tokens(BaseModel):
+    prompt: str
+    message_history: List[Gemini_Message] | None = []
+    parts: List[Gemini_Part] | None = []
+    # Counts with this model's tokenizer. Defaults to the service's default model.
+    model: str | None = None
+
+
 class Payload_Vertex_Gemini(BaseModel):
     prompt: str
+    message_history: List[Gemini_Message] | None = []
+    # Images, documents or text sent ahead of the prompt
+    parts: List[Gemini_Part] | None = []
     max_output_tokens: int | None = 1024
     temperature: float | None = 0.4
     top_p: float | None = 0.8
     top_k: int | None = 40
     stop_sequences: list | None = None
     safety_settings: dict | None = None
+    # Count tokens before generating: 'reject' over-budget requests, or 'truncate' them to fit
+    preflight: Literal['off', 'reject', 'truncate'] | None = 'off'
+    # Model name or version to use, such as "gemini-1.0-pro-002". Defaults to the service's default model.
+    model: str | None = None
 
 
 # Routes
@@ -83,8 +131,67 @@ async def health_check():
     return {'status': 'ok'}
 
 
+@app.get("/genai_ready", include_in_schema=False)
+async def readiness_check():
+    return JSONResponse(status_code=200 if model.ready.is_set() else 503, content=gemini_models.status())
+
+
+async def apply_preflight(payload, request_payload, model):
+    '''Returns the payload to send to model, or a 413 response when the request is over its budget.'''
+    if payload.preflight in (None, PREFLIGHT_OFF):
+        return request_payload
+    try:
+        max_input_tokens, max_output_tokens = token_limits.for_model(model.pretrained_model)
+        request_payload, report = await preflight(token_counter, model, request_payload, payload.preflight, max_input_tokens, max_output_tokens)
+        logging.debug(f'preflight: {report}')
+        return request_payload
+    except Token_Budget_Exceeded as e:
+        return JSONResponse(status_code=413, content=e.report)
+
+
+def resolve_parts(request_payload):
+    return {**request_payload, 'parts': part_store.resolve(request_payload.get('parts'))}
+
+
+@app.post("/parts")
+async def vertex_gemini_upload_part(payload: Payload_Part):
+    '''
+    Stores an image or document for later requests, which reference it by
+    {"hash": ...} instead of sending the bytes again. The hash is the sha256
+    of the bytes.
+    '''
+    try:
+        return {'hash': part_store.put_base64(payload.data, payload.mime_type), 'mime_type': payload.mime_type}
+    except Exception as e:
+        return error_response(e)
+
+
+@app.get("/parts/{part_hash}")
+async def vertex_gemini_get_part(part_hash: str):
+    '''Checks whether a part is still stored, before referencing it.'''
+    stored = part_store.get(part_hash)
+    if stored is None:
+        return JSONResponse(status_code=404, content={'status': 'unknown part', 'hash': part_hash})
+    return {'hash': part_hash, 'mime_type': stored.mime_type, 'size': len(stored.data)}
+
+
+@app.post("/count_tokens")
+async def vertex_count_tokens(payload: Payload_Count_Tokens):
+    try:
+        model = await gemini_models.acquire(payload.model)
+        parts = part_store.store_inline(payload.model_dump()['parts'])
+        total_tokens = await token_counter.count(model, payload.prompt, payload.model_dump()['message_history'], parts)
+        return {'total_tokens': total_tokens}
+    except Exception as e:
+        return error_response(e)
+
+
 @app.post("/")
-def vertex_gemini_llm(payload: Payload_Vertex_Gemini):
+async def vertex_gemini_llm(payload: Payload_Vertex_Gemini):
+    try:
+        model = await gemini_models.acquire(payload.model)
+    except Vertex_Error as e:
+        return error_response(e)
     try:
         request_payload = {
             'prompt': payload.prompt,
@@ -94,12 +201,95 @@ def vertex_gemini_llm(payload: Payload_Vertex_Gemini):
             'top_k': payload.top_k,
             'stop_sequences': payload.stop_sequences,
             'safety_settings': payload.safety_settings,
+            'message_history': payload.model_dump()['message_history'],
+            'parts': part_store.store_inline(payload.model_dump()['parts']),
         }
-        response = model.call_llm(**request_payload)
+        request_payload = await apply_preflight(payload, request_payload, model)
+        if isinstance(request_payload, JSONResponse):
+            return request_payload
+        response = await model.call_llm_async(**resolve_parts(request_payload))
         return response.text
     except Exception as e:
-        print(f'EXCEPTION: {e}')
-        return {}
+        return error_response(e)
+
+
+def chunk_event(chunk):
+    '''The text of a streamed chunk, with the safety ratings that apply to it.'''
+    candidate = chunk.candidates[0] if chunk.candidates else None
+    try:
+        text = candidate.text if candidate else ''
+    except (ValueError, AttributeError):
+        # Chunks blocked by a safety filter have no text
+        text = ''
+    return {
+        'text': text,
+        'safety_ratings': [
+            {'category': r.category.name, 'probability': r.probability.name, 'blocked': r.blocked}
+            for r in (candidate.safety_ratings if candidate else [])
+        ],
+        'finish_reason': candidate.finish_reason.name if candidate and candidate.finish_reason else None,
+    }
+
+
+def usage_event(chunk):
+    # Token counts are cumulative, so the last chunk carries the totals for the request.
+    usage = chunk._raw_response.usage_metadata
+    return {
+        'usage': {
+            'prompt_token_count': usage.prompt_token_count,
+            'candidates_token_count': usage.candidates_token_count,
+            'total_token_count': usage.total_token_count,
+        }
+    }
+
+
+async def gemini_events(request, chunks):
+    last_chunk = None
+    try:
+        async for chunk in chunks:
+            if await request.is_disconnected():
+                logging.info('Client disconnected. Abandoning the Gemini stream.')
+                return
+            last_chunk = chunk
+            yield sse_event(chunk_event(chunk))
+    except Exception as e:
+        logging.exception(f'At Gemini stream. {e}')
+        yield sse_event({'error': str(e), 'status_code': status_code_of(e)}, event='error')
+        return
+    finally:
+        # Cancels the streaming RPC if the loop stopped early
+        await chunks.aclose()
+
+    if last_chunk is not None:
+        yield sse_event(usage_event(last_chunk), event='usage')
+    yield 'data: [DONE]\n\n'
+
+
+@app.post("/stream")
+async def vertex_gemini_llm_stream(payload: Payload_Vertex_Gemini, request: Request):
+    try:
+        model = await gemini_models.acquire(payload.model)
+    except Vertex_Error as e:
+        return error_response(e)
+    request_payload = {
+        'prompt': payload.prompt,
+        'max_output_tokens': payload.max_output_tokens,
+        'temperature': payload.temperature,
+        'top_p': payload.top_p,
+        'top_k': payload.top_k,
+        'stop_sequences': payload.stop_sequences,
+        'safety_settings': payload.safety_settings,
+        'message_history': payload.model_dump()['message_history'],
+    }
+    try:
+        request_payload['parts'] = part_store.store_inline(payload.model_dump()['parts'])
+        request_payload = await apply_preflight(payload, request_payload, model)
+        if isinstance(request_payload, JSONResponse):
+            return request_payload
+        request_payload = resolve_parts(request_payload)
+    except Exception as e:
+        return error_response(e)
+    return sse_response(gemini_events(request, model.stream_llm_async(**request_payload)))
 
 
 if __name__ == "__main__":
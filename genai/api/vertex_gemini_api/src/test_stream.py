@@ -0,0 +1,101 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pytest -s -W ignore
+
+from fastapi.testclient import TestClient
+from unittest import mock
+import json
+import base64
+import hashlib
+from vertexai.preview.generative_models import GenerationResponse
+import main
+
+client = TestClient(main.app)
+
+
+def make_chunk(text, total_token_count, finish_reason=None):
+    candidate = {
+        'content': {'role': 'model', 'parts': [{'text': text}]},
+        'safety_ratings': [{'category': 'HARM_CATEGORY_HARASSMENT', 'probability': 'NEGLIGIBLE'}],
+    }
+    if finish_reason:
+        candidate['finish_reason'] = finish_reason
+    return GenerationResponse.from_dict({
+        'candidates': [candidate],
+        'usage_metadata': {'prompt_token_count': 4, 'candidates_token_count': total_token_count - 4, 'total_token_count': total_token_count},
+    })
+
+
+def test_gemini_stream():
+    chunks = [make_chunk('Hello', 5), make_chunk(' world', 6, finish_reason='STOP')]
+
+    async def stream():
+        for chunk in chunks:
+            yield chunk
+
+    async def generate_content_async(contents, stream=False, **kwargs):
+        # The previous turns are sent ahead of the new prompt
+        assert [c.role for c in contents] == ['user', 'model', 'user']
+        return stream_chunks
+
+    stream_chunks = stream()
+    fake_model = mock.Mock()
+    fake_model.generate_content_async.side_effect = generate_content_async
+
+    payload = {
+        "prompt": "and again",
+        "message_history": [{"role": "user", "text": "hi"}, {"role": "model", "text": "hello"}],
+    }
+    with mock.patch.object(main.model, 'model', fake_model), mock.patch.object(main.model.ready, 'is_set', return_value=True):
+        response = client.post("/stream", json=payload)
+
+    assert response.status_code == 200
+    events = [line[len('data: '):] for line in response.text.splitlines() if line.startswith('data: ')]
+    first, second, usage, done = [json.loads(e) if e != '[DONE]' else e for e in events]
+    assert first['text'] == 'Hello'
+    assert first['safety_ratings'] == [{'category': 'HARM_CATEGORY_HARASSMENT', 'probability': 'NEGLIGIBLE', 'blocked': False}]
+    assert second['finish_reason'] == 'STOP'
+    assert usage == {'usage': {'prompt_token_count': 4, 'candidates_token_count': 2, 'total_token_count': 6}}
+    assert 'event: usage' in response.text
+    assert done == '[DONE]'
+
+
+def test_gemini_parts_by_hash():
+    image = b'\x89PNG fake image bytes'
+    sent = []
+
+    async def generate_content_async(contents, **kwargs):
+        sent.append(contents)
+        return mock.Mock(text='a cat')
+
+    fake_model = mock.Mock()
+    fake_model.generate_content_async.side_effect = generate_content_async
+
+    with mock.patch.object(main.model, 'model', fake_model), mock.patch.object(main.model.ready, 'is_set', return_value=True):
+        part_hash = hashlib.sha256(image).hexdigest()
+        # Unknown hashes are rejected, so the caller can send the bytes inline instead
+        assert client.post("/", json={"prompt": "What is this?", "parts": [{"hash": part_hash}]}).status_code == 404
+
+        response = client.post("/parts", json={"data": base64.b64encode(image).decode(), "mime_type": "image/png"})
+        assert response.json()['hash'] == part_hash
+        assert client.get(f"/parts/{part_hash}").json()['size'] == len(image)
+
+        response = client.post("/", json={"prompt": "What is this?", "parts": [{"hash": part_hash}]})
+
+    assert response.status_code == 200
+    assert response.json() == 'a cat'
+    user_turn = sent[-1][-1]
+    assert user_turn.parts[0].inline_data.data == image
+    assert user_turn.parts[1].text == 'What is this?'
@@ -0,0 +1,150 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# This file is shared by the vertex_*_api services. Keep the copies identical.
+
+import os
+import math
+import time
+import asyncio
+import logging
+import threading
+from utils.retry import Vertex_Error
+
+
+# A token bucket kept as a GCRA theoretical arrival time (TAT): the time at
+# which the bucket is full again. Each call reserves a token and waits until
+# its slot, so bursts are queued and spread out rather than rejected. A call
+# that would wait longer than max_wait is refused, and reserves nothing.
+GCRA_SCRIPT = '''
+redis.replicate_commands()
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local interval = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local max_wait = tonumber(ARGV[3])
+local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+if tat < now then tat = now end
+local wait = math.max(0, tat - tolerance - now)
+if wait > max_wait then return {0, tostring(wait)} end
+redis.call('SET', KEYS[1], tostring(tat + interval), 'PX', math.ceil((tat + interval - now) * 1000) + 1000)
+return {1, tostring(wait)}
+'''
+
+
+class Local_Counter_Store:
+    '''
+    Keeps the buckets in process memory. It paces one replica only, so it is
+    meant for tests, local runs and single-replica deployments, and as the
+    fallback when the shared store is unreachable.
+    '''
+
+    blocking = False
+
+    def __init__(self):
+        self._tats = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, key, interval, tolerance, max_wait):
+        '''Returns (granted, wait): whether a token was reserved, and how long to wait for it.'''
+        with self._lock:
+            now = time.monotonic()
+            tat = max(self._tats.get(key, now), now)
+            wait = max(0.0, tat - tolerance - now)
+            if wait > max_wait:
+                return False, wait
+            self._tats[key] = tat + interval
+            return True, wait
+
+
+class Redis_Counter_Store:
+    '''
+    Keeps the buckets in Redis, so every replica draws from the same quota.
+    The reservation is one Lua script, using the Redis server clock, so it is
+    atomic and independent of clock skew between replicas.
+    '''
+
+    blocking = True
+
+    def __init__(self, url):
+        import redis
+
+        self._client = redis.Redis.from_url(url, socket_timeout=1.0, socket_connect_timeout=1.0)
+        self._script = self._client.register_script(GCRA_SCRIPT)
+
+    def reserve(self, key, interval, tolerance, max_wait):
+        granted, wait = self._script(keys=[key], args=[interval, tolerance, max_wait])
+        return bool(int(granted)), float(wait)
+
+
+class Pacer:
+    '''
+    Paces outbound Vertex calls to quota_per_minute, allowing bursts of up to
+    burst calls. Calls over the rate wait for their slot; a call whose wait
+    would exceed max_wait fails with a 429 instead. Buckets are keyed, one
+    per project, region and model, since Vertex quotas are per base model.
+    '''
+
+    def __init__(self, store, quota_per_minute, burst=None, max_wait=30.0):
+        self.store = store
+        self.fallback_store = store if isinstance(store, Local_Counter_Store) else Local_Counter_Store()
+        self.quota_per_minute = quota_per_minute
+        self.interval = 60.0 / quota_per_minute
+        self.burst = burst or max(1, round(quota_per_minute / 60))
+        self.tolerance = self.interval * (self.burst - 1)
+        self.max_wait = max_wait
+
+    def reserve(self, key):
+        '''Reserves a slot for one call, returning the seconds to wait for it.'''
+        try:
+            granted, wait = self.store.reserve(key, self.interval, self.tolerance, self.max_wait)
+        except Exception as e:
+            # Pacing each replica on its own is better than not pacing at all
+            logging.warning(f'Quota store unavailable, pacing this replica only. {e}')
+            granted, wait = self.fallback_store.reserve(key, self.interval, self.tolerance, self.max_wait)
+        if not granted:
+            raise Vertex_Error(
+                429,
+                f'Over the Vertex quota of {self.quota_per_minute:g} requests per minute. The queue is {wait:.1f}s long.',
+                retry_after=max(1, math.ceil(wait - self.max_wait)),
+            )
+        return wait
+
+    async def acquire(self, key):
+        if self.store.blocking:
+            wait = await asyncio.to_thread(self.reserve, key)
+        else:
+            wait = self.reserve(key)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def acquire_sync(self, key):
+        wait = self.reserve(key)
+        if wait > 0:
+            time.sleep(wait)
+
+
+def pacer_from_env():
+    '''
+    VERTEX_QUOTA_PER_MINUTE is the project's per-minute quota for each model
+    the service calls; unset or 0 turns pacing off. VERTEX_QUOTA_STORE is
+    "local", or a redis:// URL shared by all replicas.
+    '''
+    quota_per_minute = float(os.environ.get('VERTEX_QUOTA_PER_MINUTE', '0'))
+    if quota_per_minute <= 0:
+        return None
+    store_url = os.environ.get('VERTEX_QUOTA_STORE', 'local')
+    store = Local_Counter_Store() if store_url == 'local' else Redis_Counter_Store(store_url)
+    burst = int(os.environ.get('VERTEX_QUOTA_BURST', '0'))
+    return Pacer(store, quota_per_minute, burst=burst or None, max_wait=float(os.environ.get('VERTEX_QUOTA_MAX_WAIT', '30')))
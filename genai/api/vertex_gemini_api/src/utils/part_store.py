@@ -0,0 +1,138 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import base64
+import hashlib
+import binascii
+import threading
+from collections import OrderedDict
+from utils.retry import Vertex_Error
+
+
+def part_hash(data):
+    '''Parts are addressed by the sha256 of their bytes, so clients can compute the hash themselves.'''
+    return hashlib.sha256(data).hexdigest()
+
+
+class Stored_Part:
+
+    def __init__(self, data, mime_type):
+        self.data = data
+        self.mime_type = mime_type
+        self._part = None
+
+    @property
+    def part(self):
+        # Built once, on first use, and reused by every request that references it
+        if self._part is None:
+            from vertexai.preview.generative_models import Part
+            self._part = Part.from_data(self.data, mime_type=self.mime_type)
+        return self._part
+
+
+class Part_Store:
+    '''
+    Bounded LRU of uploaded multimodal parts (images, PDFs, ...), keyed by
+    the sha256 of their bytes. Requests reference a stored part by hash
+    instead of re-sending it. Evicted parts have to be sent again.
+    '''
+
+    def __init__(self, max_entries=1000, max_bytes=256 * 1024 * 1024, max_part_bytes=20 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_part_bytes = max_part_bytes
+        self.total_bytes = 0
+        self._parts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, data, mime_type):
+        if len(data) > self.max_part_bytes:
+            raise Vertex_Error(413, f'parts are limited to {self.max_part_bytes} bytes')
+        key = part_hash(data)
+        with self._lock:
+            if key in self._parts:
+                self._parts.move_to_end(key)
+                return key
+            self._parts[key] = Stored_Part(data, mime_type)
+            self.total_bytes += len(data)
+            while len(self._parts) > self.max_entries or self.total_bytes > self.max_bytes:
+                _, evicted = self._parts.popitem(last=False)
+                self.total_bytes -= len(evicted.data)
+        return key
+
+    def put_base64(self, data, mime_type):
+        try:
+            return self.put(base64.b64decode(data, validate=True), mime_type)
+        except binascii.Error as e:
+            raise Vertex_Error(400, f'part data is not valid base64. {e}')
+
+    def get(self, key):
+        with self._lock:
+            stored = self._parts.get(key)
+            if stored is not None:
+                self._parts.move_to_end(key)
+            return stored
+
+    def __len__(self):
+        with self._lock:
+            return len(self._parts)
+
+    def store_inline(self, parts):
+        '''
+        Stores the inline data of request parts and returns references for
+        them: {'text': ...} for text parts and {'hash': ...} for data parts.
+        '''
+        refs = []
+        for part in parts or []:
+            if part.get('text') is not None:
+                refs.append({'text': part['text']})
+            elif part.get('data') is not None:
+                if not part.get('mime_type'):
+                    raise Vertex_Error(400, 'inline parts need a mime_type')
+                refs.append({'hash': self.put_base64(part['data'], part['mime_type'])})
+            elif part.get('hash'):
+                refs.append({'hash': part['hash']})
+            else:
+                raise Vertex_Error(400, 'each part needs text, data or hash')
+        return refs
+
+    def resolve(self, refs):
+        '''Turns part references into SDK Parts. Unknown hashes raise a 404 naming them.'''
+        if not refs:
+            return None
+
+        from vertexai.preview.generative_models import Part
+
+        parts, missing = [], []
+        for ref in refs:
+            if 'text' in ref:
+                parts.append(Part.from_text(ref['text']))
+                continue
+            stored = self.get(ref['hash'])
+            if stored is None:
+                missing.append(ref['hash'])
+            else:
+                parts.append(stored.part)
+        if missing:
+            raise Vertex_Error(404, f'unknown part hashes, send them inline: {missing}')
+        return parts
+
+
+def part_store_from_env():
+    return Part_Store(
+        max_entries=int(os.environ.get('GEMINI_PART_STORE_MAX_ENTRIES', '1000')),
+        max_bytes=int(os.environ.get('GEMINI_PART_STORE_MAX_BYTES', str(256 * 1024 * 1024))),
+        max_part_bytes=int(os.environ.get('GEMINI_PART_MAX_BYTES', str(20 * 1024 * 1024))),
+    )
@@ -12,15 +12,23 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from fastapi import FastAPI
-from pydantic import BaseModel
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, Query, Request, Response
+from contextlib import asynccontextmanager
+from pydantic import BaseModel, Field
+from fastapi.responses import StreamingResponse, JSONResponse
 from utils.model_util import Google_Cloud_Imagen
+from utils.model_pool import model_pool_from_env
+from utils.gcp_metadata import get_gcp_metadata
+from utils.retry import Vertex_Error, error_response
+from utils.image_response import images_response, Image_File, close_images
+from utils.image_cache import image_cache_from_env, cache_key, http_etag, etag_matches, http_cache_headers
+from utils.image_transcode import transcoder_from_env, is_original, variant_name, MEDIA_TYPES
 import io
 import os, sys
+import asyncio
 import json
-import requests
 import logging
+from typing import Literal
 
 logging.basicConfig(
     level=logging.DEBUG,
@@ -29,32 +37,22 @@ logging.basicConfig(
     stream=sys.stdout,
 )
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Import the Vertex SDK and load the model in the background, so uvicorn
+    # binds its port immediately. Requests are gated on /genai_ready.
+    model_vertex_imagen.start_loading()
+    yield
+
+
 app = FastAPI(
+    lifespan=lifespan,
     redoc_url=None,
     title="API for Vertex AI Imagen",
     description="Contains business logic, data processing steps, and uses the GCP SDK to call the Google Cloud Vertex Imagen model.",
     version="0.0.1",
 )
 
-def get_gcp_metadata():
-    metadata_server = "http://metadata.google.internal"
-    headers = {"Metadata-Flavor": "Google"}
-
-    # Get Project ID
-    project_id_url = f"{metadata_server}/computeMetadata/v1/project/project-id"
-    project_id_response = requests.get(project_id_url, headers=headers)
-    project_id = project_id_response.text if project_id_response.status_code == 200 else "Unavailable"
-
-    # Get GCP Zone
-    zone_url = f"{metadata_server}/computeMetadata/v1/instance/zone"
-    zone_response = requests.get(zone_url, headers=headers)
-    zone = zone_response.text.split('/')[-1] if zone_response.status_code == 200 else "Unavailable"
-
-    # Extract GCP Region
-    region = '-'.join(zone.split('-')[:-1])
-
-    return project_id, region, zone
-
 GCP_PROJECT_ID, GCP_REGION, GCP_ZONE = get_gcp_metadata()
 VERTEX_IMAGE_GENERATION_MODEL = os.environ['VERTEX_IMAGE_GENERATION_MODEL']
 
@@ -64,11 +62,21 @@ logging.debug(f'GCP_ZONE:                        {GCP_ZONE}')
 logging.debug(f'VERTEX_IMAGE_GENERATION_MODEL:   {VERTEX_IMAGE_GENERATION_MODEL}')
 
 
-# Initialize Vertex LLM Model
-model_vertex_imagen   = Google_Cloud_Imagen(
-    GCP_PROJECT_ID,
-    GCP_REGION=GCP_REGION,
-    VERTEX_IMAGE_GENERATION_MODEL=VERTEX_IMAGE_GENERATION_MODEL)
+# Initialize Vertex LLM Model. The default model loads at startup; other models and versions are created on first use.
+image_models = model_pool_from_env(
+    lambda name: Google_Cloud_Imagen(
+        GCP_PROJECT_ID,
+        GCP_REGION=GCP_REGION,
+        VERTEX_IMAGE_GENERATION_MODEL=name),
+    default_model=VERTEX_IMAGE_GENERATION_MODEL,
+)
+model_vertex_imagen = image_models.default
+
+# Seeded generations are reproducible, so their images are kept on disk and served from there
+image_cache = image_cache_from_env()
+
+# Encodes and resizes image variants on worker threads, off the event loop
+transcoder = transcoder_from_env()
 
 headers = {"Content-Type": "application/json"}
 
@@ -76,6 +84,91 @@ class Payload_Vertex_Image(BaseModel):
     prompt: str
     number_of_images: int | None = 1
     seed: int | None = None
+    # Model name or version to use, such as "imagegeneration@005". Defaults to the service's default model.
+    model: str | None = None
+    # png returns the first image. multipart (multipart/mixed), zip or json (a manifest of data: URLs) return them all.
+    response_format: Literal['png', 'multipart', 'zip', 'json'] | None = 'png'
+    # The image encoding. quality applies to webp and jpeg; max_dim shrinks images to fit in max_dim x max_dim.
+    format: Literal['png', 'webp', 'jpeg'] | None = 'png'
+    quality: int | None = Field(None, ge=1, le=100)
+    max_dim: int | None = Field(None, ge=16, le=4096)
+
+
+class Image_Bytes:
+    '''Encoded image bytes, in the shape of a generated image.'''
+
+    def __init__(self, data):
+        self._image_bytes = data
+
+
+async def transcode_images(images, image_format, quality, max_dim):
+    encoded = await asyncio.gather(*[transcoder.transcode(image._image_bytes, image_format, quality, max_dim) for image in images])
+    return [Image_Bytes(data) for data in encoded]
+
+
+async def generate_images(model, prompt, number_of_images, seed, response_format, image_format='png', quality=None, max_dim=None, boundary=None):
+    '''
+    Generates the images and encodes them as asked, or serves them from the
+    cache when the same model, prompt, seed and number of images were
+    generated before. Variants are cached alongside the original images, and
+    made from the cached originals when only those are cached.
+    '''
+    request_payload = {
+        'prompt': prompt,
+        'number_of_images': number_of_images,
+        'seed': seed,
+    }
+    original = is_original(image_format, max_dim)
+    if image_cache is None or seed is None:
+        images = (await model.generate_images_async(**request_payload)).images
+        if not original:
+            images = await transcode_images(images, image_format, quality, max_dim)
+        return images_response(images, response_format, image_format, boundary)
+
+    key = cache_key(model=model.VERTEX_IMAGE_GENERATION_MODEL, **request_payload)
+    names = [f'{key}-{i}' for i in range(number_of_images or 1)]
+    cached = await asyncio.to_thread(cached_image_files, names, image_format, quality, max_dim)
+    if cached is not None:
+        return images_response(cached, response_format, image_format, boundary)
+
+    cached = await asyncio.to_thread(cached_images, names) if not original else None
+    if cached is not None:
+        images = cached
+    else:
+        images = (await model.generate_images_async(**request_payload)).images
+        await asyncio.to_thread(cache_images, images, names)
+    if not original:
+        images = await transcode_images(images, image_format, quality, max_dim)
+        await asyncio.to_thread(cache_images, images, names, image_format, quality, max_dim)
+    return images_response(images, response_format, image_format, boundary)
+
+
+def cached_image_files(names, image_format='png', quality=None, max_dim=None):
+    '''The cached images of names, as open files to stream, or None unless all of them are cached.'''
+    images = []
+    for name in names:
+        f = image_cache.open(variant_name(name, image_format, quality, max_dim))
+        if f is None:
+            close_images(images)
+            return None
+        images.append(Image_File(f))
+    return images
+
+
+def cached_images(names):
+    '''The bytes of the cached original images of names, to transcode, or None unless all of them are cached.'''
+    images = []
+    for name in names:
+        data = image_cache.get(variant_name(name))
+        if data is None:
+            return None
+        images.append(Image_Bytes(data))
+    return images
+
+
+def cache_images(images, names, image_format='png', quality=None, max_dim=None):
+    for image, name in zip(images, names):
+        image_cache.put(variant_name(name, image_format, quality, max_dim), image._image_bytes)
 
 
 # Routes 
@@ -86,40 +179,64 @@ async def health_check():
     return {'status': 'ok'}
 
 
+@app.get("/genai_ready", include_in_schema=False)
+async def readiness_check():
+    return JSONResponse(status_code=200 if model_vertex_imagen.ready.is_set() else 503, content=image_models.status())
+
+
 @app.get("/")
 async def vertex_image_gen_x_get(
+        request: Request,
         prompt: str,
         number_of_images: int = 1, 
         seed: int = None,
+        model: str = None,
+        response_format: Literal['png', 'multipart', 'zip', 'json'] = 'png',
+        format: Literal['png', 'webp', 'jpeg'] = 'png',
+        quality: int = Query(None, ge=1, le=100),
+        max_dim: int = Query(None, ge=16, le=4096),
     ):
     try:
-        request_payload = {
-            'prompt': prompt, 
-            'number_of_images': number_of_images,
-            'seed': seed,
-        }
-        images = model_vertex_imagen.model.generate_images(**request_payload)
-        # Return the first image of the list
-        return StreamingResponse(io.BytesIO(images.images[0]._image_bytes), media_type="image/png")
+        model = await image_models.acquire(model)
+    except Vertex_Error as e:
+        return error_response(e)
+    if seed is None:
+        etag = None
+    else:
+        # A seeded request gives the same image, so browsers and CDNs may keep the
+        # response, and revalidate it without the model being called. With the
+        # image cache on, it is served from or stored in the cache, so its bytes never change.
+        etag = http_etag(
+            model=model.VERTEX_IMAGE_GENERATION_MODEL, prompt=prompt, number_of_images=number_of_images, seed=seed,
+            response_format=response_format, format=format, quality=quality, max_dim=max_dim,
+        )
+        if etag_matches(request.headers.get('if-none-match'), etag):
+            return Response(status_code=304, headers=http_cache_headers(etag, cached=image_cache is not None))
+    try:
+        response = await generate_images(
+            model, prompt, number_of_images, seed, response_format, format, quality, max_dim,
+            boundary=etag.strip('"')[:32] if etag else None,
+        )
     except Exception as e:
-        print(f'EXCEPTION: {e}')
-        return {}
+        return error_response(e)
+    if response.status_code == 200:
+        response.headers.update(http_cache_headers(etag, cached=image_cache is not None) if etag else {'Cache-Control': 'no-store'})
+    return response
 
 
 @app.post("/")
 async def vertex_image_gen_x_post(payload: Payload_Vertex_Image):
     try:
-        request_payload = {
-            'prompt': payload.prompt, 
-            'number_of_images': payload.number_of_images,
-            'seed': payload.seed,
-        }
-        images = model_vertex_imagen.model.generate_images(**request_payload)
-        # Return the first image of the list
-        return StreamingResponse(io.BytesIO(images.images[0]._image_bytes), media_type="image/png")
+        model = await image_models.acquire(payload.model)
+    except Vertex_Error as e:
+        return error_response(e)
+    try:
+        return await generate_images(
+            model, payload.prompt, payload.number_of_images, payload.seed, payload.response_format,
+            payload.format, payload.quality, payload.max_dim,
+        )
     except Exception as e:
-        print(f'EXCEPTION: {e}')
-        return {}
+        return error_response(e)
 
 
 if __name__ == "__main__":
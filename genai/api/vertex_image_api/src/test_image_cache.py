@@ -0,0 +1,105 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pytest -s -W ignore
+
+import os
+import time
+from utils.image_cache import Image_Cache, cache_key, http_etag, etag_matches, http_cache_headers, file_chunks
+
+
+def test_put_and_get(tmp_path):
+    cache = Image_Cache(str(tmp_path), max_bytes=1000)
+    key = cache_key(model='imagegeneration@005', prompt='castle', seed=7)
+    assert key == cache_key(seed=7, prompt='castle', model='imagegeneration@005')
+    assert key != cache_key(model='imagegeneration@005', prompt='castle', seed=8)
+
+    assert cache.get(f'{key}-0.png') is None
+    path = cache.put(f'{key}-0.png', b'png')
+    assert cache.get(f'{key}-0.png') == b'png'
+    with open(path, 'rb') as f:
+        assert f.read() == b'png'
+    # Nothing is left behind by the atomic write
+    assert os.listdir(tmp_path) == [f'{key}-0.png']
+    assert cache.status()['hits'] == 1 and cache.status()['misses'] == 1
+
+    # A file evicted by another process is a miss, not an error
+    os.remove(path)
+    assert cache.get(f'{key}-0.png') is None
+    assert cache.status()['bytes'] == 0
+
+
+def test_open_file_outlives_eviction(tmp_path):
+    cache = Image_Cache(str(tmp_path), max_bytes=150)
+    cache.put('a.png', b'a' * 100)
+    f = cache.open('a.png')
+
+    # A concurrent put evicts a while its response is still streaming it
+    cache.put('b.png', b'b' * 100)
+    assert not os.path.exists(tmp_path / 'a.png')
+    assert b''.join(file_chunks(f, chunk_size=30)) == b'a' * 100
+    assert f.closed
+    assert cache.open('a.png') is None
+
+
+def test_lru_eviction_by_bytes(tmp_path):
+    cache = Image_Cache(str(tmp_path), max_bytes=250)
+    cache.put('a.png', b'a' * 100)
+    cache.put('b.png', b'b' * 100)
+    # Reading a makes b the least recently used
+    assert cache.get('a.png')
+    cache.put('c.png', b'c' * 100)
+
+    assert cache.get('b.png') is None
+    assert cache.get('a.png') and cache.get('c.png')
+    assert cache.total_bytes == 200
+    assert sorted(os.listdir(tmp_path)) == ['a.png', 'c.png']
+
+
+def test_reload_from_disk(tmp_path):
+    cache = Image_Cache(str(tmp_path), max_bytes=250)
+    cache.put('a.png', b'a' * 100)
+    cache.put('b.png', b'b' * 100)
+    # Make a the most recently used on disk too
+    time.sleep(0.01)
+    cache.get('a.png')
+    (tmp_path / 'c.png.0123.tmp').write_bytes(b'partial')
+
+    reloaded = Image_Cache(str(tmp_path), max_bytes=250)
+    assert reloaded.total_bytes == 200
+    assert not os.path.exists(tmp_path / 'c.png.0123.tmp')
+    reloaded.put('d.png', b'd' * 100)
+    assert reloaded.get('b.png') is None and reloaded.get('a.png')
+
+
+def test_etags():
+    etag = http_etag(model='imagegeneration@005', prompt='castle', seed=7, format='webp')
+    assert etag.startswith('"') and etag == http_etag(format='webp', seed=7, prompt='castle', model='imagegeneration@005')
+    assert etag != http_etag(model='imagegeneration@005', prompt='castle', seed=7, format='png')
+
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", W/{etag}', etag)
+    assert etag_matches('*', etag)
+    assert not etag_matches(None, etag) and not etag_matches('"other"', etag)
+
+
+def test_http_cache_headers():
+    etag = http_etag(model='imagegeneration@005', prompt='castle', seed=7, format='png')
+    assert http_cache_headers(etag)['ETag'] == etag
+    assert 'immutable' in http_cache_headers(etag)['Cache-Control']
+
+    # Without the image cache the bytes may change, so the ETag is weak and the response is revalidated
+    headers = http_cache_headers(etag, cached=False)
+    assert headers == {'ETag': f'W/{etag}', 'Cache-Control': 'public, no-cache'}
+    assert etag_matches(headers['ETag'], etag) and etag_matches(etag, headers['ETag'])
@@ -0,0 +1,96 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pytest -s -W ignore
+
+import io
+import base64
+import zipfile
+from email import message_from_bytes
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from utils.image_response import images_response, Image_File
+
+
+class Fake_Image:
+
+    def __init__(self, data):
+        self._image_bytes = data
+
+
+IMAGES = [Fake_Image(b'\x89PNG first'), Fake_Image(b'\x89PNG second'), Fake_Image(b'\x89PNG third')]
+
+app = FastAPI()
+
+
+@app.get('/')
+def images(response_format: str = 'png', filtered: bool = False):
+    return images_response([] if filtered else IMAGES, response_format)
+
+
+client = TestClient(app)
+
+
+def test_png_is_the_first_image():
+    response = client.get('/')
+    assert response.headers['content-type'] == 'image/png'
+    assert response.content == b'\x89PNG first'
+
+
+def test_multipart_and_zip_carry_every_image():
+    response = client.get('/', params={'response_format': 'multipart'})
+    assert response.headers['content-type'].startswith('multipart/mixed; boundary=')
+    message = message_from_bytes(b'Content-Type: ' + response.headers['content-type'].encode() + b'\r\n\r\n' + response.content)
+    parts = message.get_payload()
+    assert [part.get_content_type() for part in parts] == ['image/png'] * 3
+    assert [part.get_payload(decode=True) for part in parts] == [image._image_bytes for image in IMAGES]
+
+    response = client.get('/', params={'response_format': 'zip'})
+    assert response.headers['content-type'] == 'application/zip'
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    assert archive.namelist() == ['image-0.png', 'image-1.png', 'image-2.png']
+    assert archive.read('image-2.png') == b'\x89PNG third'
+
+
+def test_json_manifest():
+    manifest = client.get('/', params={'response_format': 'json'}).json()
+    assert [entry['index'] for entry in manifest['images']] == [0, 1, 2]
+    url = manifest['images'][1]['url']
+    assert url.startswith('data:image/png;base64,')
+    assert base64.b64decode(url.split(',', 1)[1]) == b'\x89PNG second'
+
+
+def test_all_images_filtered_is_422():
+    for response_format in ('png', 'multipart', 'zip', 'json'):
+        response = client.get('/', params={'response_format': response_format, 'filtered': True})
+        assert response.status_code == 422
+        assert 'filtered' in response.json()['error']
+
+
+def test_cached_files_are_streamed_and_closed(tmp_path):
+    for i, image in enumerate(IMAGES):
+        (tmp_path / f'{i}.png').write_bytes(image._image_bytes)
+
+    for response_format in ('png', 'multipart', 'zip', 'json'):
+        files = [Image_File(open(tmp_path / f'{i}.png', 'rb')) for i in range(len(IMAGES))]
+        file_app = FastAPI()
+        file_app.get('/')(lambda: images_response(files, response_format, boundary='fixed'))
+        response = TestClient(file_app).get('/')
+
+        # The same body as for the images in memory, with every file closed once sent
+        expected = client.get('/', params={'response_format': response_format}).content
+        if response_format == 'multipart':
+            expected = expected.replace(expected[2:expected.index(b'\r\n')], b'fixed')
+        assert response.content == expected
+        assert all(image.file.closed for image in files)
@@ -0,0 +1,49 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pytest -s -W ignore
+
+import io
+import asyncio
+from PIL import Image
+from utils.image_transcode import Transcoder, transcode, variant_name
+
+
+def png(width, height):
+    buffer = io.BytesIO()
+    Image.new('RGBA', (width, height), (200, 40, 40, 255)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def test_transcode():
+    data = png(1024, 512)
+
+    thumbnail = Image.open(io.BytesIO(transcode(data, 'webp', quality=50, max_dim=256)))
+    assert thumbnail.format == 'WEBP' and thumbnail.size == (256, 128)
+
+    # RGBA is flattened for jpeg, and small images are never enlarged
+    small = Image.open(io.BytesIO(transcode(png(64, 32), 'jpeg', max_dim=256)))
+    assert small.format == 'JPEG' and small.size == (64, 32)
+
+    resized = asyncio.run(Transcoder(max_workers=2).transcode(data, 'png', max_dim=100))
+    assert Image.open(io.BytesIO(resized)).size == (100, 50)
+
+
+def test_variant_names():
+    assert variant_name('key-0') == 'key-0.png'
+    assert variant_name('key-0', 'png', quality=50) == 'key-0.png'
+    assert variant_name('key-0', 'png', max_dim=256) == 'key-0.256px.png'
+    # The default quality is part of the name, so it matches an explicit request for it
+    assert variant_name('key-0', 'webp') == variant_name('key-0', 'webp', quality=80) == 'key-0.full.q80.webp'
+    assert variant_name('key-0', 'jpeg', quality=60, max_dim=128) == 'key-0.128px.q60.jpg'
@@ -16,31 +16,23 @@
 
 from fastapi.testclient import TestClient
 from unittest import mock
-import json
 from main import app
 
 client = TestClient(app)
 
-@mock.patch('requests.post')
-def test_genai(mock_post):
+@mock.patch('main.image_models.acquire', new_callable=mock.AsyncMock)
+def test_genai(mock_acquire):
 
-    # Define a mock response content as a JSON string
-    expected_response = {'mocked_key': 'mocked_value'}
-    mock_response_content = json.dumps(expected_response).encode()
-
-    # Create a mock response object with the necessary attributes
-    mock_response = mock.Mock()
-    mock_response.status_code = 200
-    mock_response.content = mock_response_content
-
-    # Set the mock object to the patched function
-    mock_post.return_value = mock_response
+    # The model is mocked, so the test needs neither Vertex nor a loaded model
+    mock_model = mock.Mock()
+    mock_model.VERTEX_IMAGE_GENERATION_MODEL = 'imagegeneration@005'
+    mock_model.generate_images_async = mock.AsyncMock(return_value=mock.Mock(images=[mock.Mock(_image_bytes=b'mocked png bytes')]))
+    mock_acquire.return_value = mock_model
 
     # Payload for the POST request
     payload = {
         "prompt": "test prompt",
         "number_of_images": 1,
-        "seed": 12345,
     }
 
     # Make a request to your API
@@ -48,6 +40,13 @@ def test_genai(mock_post):
 
     # Assertions
     assert response.status_code == 200
-    assert response.json() == expected_response
-    mock_post.assert_called_once()
+    assert response.content == b'mocked png bytes'
+    mock_model.generate_images_async.assert_called_once()
+
 
+def test_genai_waits_for_the_default_model():
+    # The app's lifespan has not run, so the default model is not loaded and the service is not ready
+    assert client.get("/genai_ready").status_code == 503
+    response = client.post("/", json={"prompt": "test prompt"})
+    assert response.status_code == 503
+    assert response.headers['retry-after'] == '1'
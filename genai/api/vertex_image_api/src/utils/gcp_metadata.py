@@ -0,0 +1,158 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# This file is shared by the vertex_*_api and npc_chat_api services. Keep the copies identical.
+
+import os
+import json
+import time
+import logging
+import functools
+import requests
+
+
+# Resolution order for the project, region and zone:
+#   1. GCP_PROJECT_ID / GCP_REGION / GCP_ZONE environment variables
+#   2. The on-disk cache of an earlier metadata server lookup
+#   3. The metadata server (or GCE_METADATA_HOST), with short timeouts
+#   4. A local stand-in, for local development, CI and benchmarks off GCE
+# On GCE and GKE the metadata server must answer: it is retried for up to
+# GCP_METADATA_STARTUP_TIMEOUT, and startup fails rather than run against the
+# stand-in's project.
+METADATA_HOST = os.environ.get('GCE_METADATA_HOST', 'metadata.google.internal')
+METADATA_TIMEOUT = float(os.environ.get('GCP_METADATA_TIMEOUT', '1.0'))
+METADATA_STARTUP_TIMEOUT = float(os.environ.get('GCP_METADATA_STARTUP_TIMEOUT', '30'))
+METADATA_CACHE_PATH = os.environ.get('GCP_METADATA_CACHE_PATH', '/tmp/gcp_metadata.json')
+METADATA_CACHE_TTL = int(os.environ.get('GCP_METADATA_CACHE_TTL', str(24 * 60 * 60)))
+
+LOCAL_STAND_IN = {
+    'project_id': os.environ.get('GOOGLE_CLOUD_PROJECT', 'local-project'),
+    'zone': 'us-central1-a',
+}
+
+
+# GCE VMs, and so GKE nodes and their pods, report this product name
+DMI_PRODUCT_NAME_PATH = '/sys/class/dmi/id/product_name'
+
+
+class Metadata_Unavailable(RuntimeError):
+    pass
+
+
+def region_from_zone(zone):
+    return '-'.join(zone.split('-')[:-1])
+
+
+def metadata_disabled():
+    return os.environ.get('GCP_METADATA_DISABLED', 'false').lower() in ('1', 'true', 'yes')
+
+
+def on_google_cloud():
+    '''Whether this runs on GCE or GKE, where the metadata server should answer. GCP_METADATA_REQUIRED overrides the check.'''
+    required = os.environ.get('GCP_METADATA_REQUIRED', '').lower()
+    if required:
+        return required in ('1', 'true', 'yes')
+    try:
+        with open(DMI_PRODUCT_NAME_PATH) as f:
+            return 'Google' in f.read()
+    except OSError:
+        return False
+
+
+@functools.lru_cache(maxsize=1)
+def get_gcp_metadata():
+    '''
+    Returns (project_id, region, zone). Off Google Cloud this blocks for at
+    most a couple of timeouts before using the local stand-in. On Google Cloud
+    it raises Metadata_Unavailable when the metadata server does not answer
+    within GCP_METADATA_STARTUP_TIMEOUT.
+    '''
+    project_id = os.environ.get('GCP_PROJECT_ID', '')
+    zone = os.environ.get('GCP_ZONE', '')
+    region = os.environ.get('GCP_REGION', '')
+
+    if not (project_id and (zone or region)):
+        resolved = _read_cache() or _query_metadata_server()
+        if resolved is None and not metadata_disabled() and on_google_cloud():
+            resolved = _wait_for_metadata_server()
+            if resolved is None:
+                raise Metadata_Unavailable(
+                    f'Running on Google Cloud, but the metadata server {METADATA_HOST} did not answer within '
+                    f'{METADATA_STARTUP_TIMEOUT}s. Set GCP_PROJECT_ID and GCP_REGION, or retry.')
+        if resolved is None:
+            logging.warning(
+                f'Metadata server {METADATA_HOST} unavailable. Using local stand-in {LOCAL_STAND_IN}. '
+                f'Vertex calls go to project {LOCAL_STAND_IN["project_id"]!r}; set GCP_PROJECT_ID and GCP_REGION if that is not a real project.')
+            resolved = LOCAL_STAND_IN
+        project_id = project_id or resolved['project_id']
+        zone = zone or resolved['zone']
+
+    return project_id, region or region_from_zone(zone), zone
+
+
+def _wait_for_metadata_server():
+    deadline = time.monotonic() + METADATA_STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(1)
+        resolved = _query_metadata_server()
+        if resolved is not None:
+            return resolved
+        logging.warning(f'Metadata server {METADATA_HOST} unavailable. Retrying.')
+    return None
+
+
+def _query_metadata_server():
+    if metadata_disabled():
+        return None
+
+    headers = {"Metadata-Flavor": "Google"}
+    base_url = f'http://{METADATA_HOST}/computeMetadata/v1'
+    try:
+        project_id_response = requests.get(f'{base_url}/project/project-id', headers=headers, timeout=METADATA_TIMEOUT)
+        zone_response = requests.get(f'{base_url}/instance/zone', headers=headers, timeout=METADATA_TIMEOUT)
+    except requests.RequestException as e:
+        logging.debug(f'Metadata server lookup failed. {e}')
+        return None
+
+    if project_id_response.status_code != 200 or zone_response.status_code != 200:
+        return None
+
+    resolved = {
+        'project_id': project_id_response.text,
+        'zone': zone_response.text.split('/')[-1],
+    }
+    _write_cache(resolved)
+    return resolved
+
+
+def _read_cache():
+    try:
+        with open(METADATA_CACHE_PATH) as f:
+            cached = json.load(f)
+        if time.time() - cached['resolved_at'] < METADATA_CACHE_TTL:
+            return cached
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+def _write_cache(resolved):
+    # Write to a temporary file and rename, so concurrent readers never see a partial file.
+    tmp_path = f'{METADATA_CACHE_PATH}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump({**resolved, 'resolved_at': time.time()}, f)
+        os.replace(tmp_path, METADATA_CACHE_PATH)
+    except OSError as e:
+        logging.debug(f'Could not write metadata cache {METADATA_CACHE_PATH}. {e}')
@@ -0,0 +1,176 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+import json
+import uuid
+import base64
+import hashlib
+import zipfile
+from fastapi.responses import StreamingResponse, JSONResponse
+from utils.image_transcode import MEDIA_TYPES, EXTENSIONS
+from utils.image_cache import file_chunks
+
+
+# How a response carries the images of one generation. png returns the first
+# image only, as the service always has, in whichever image format was asked
+# for; the others return every image.
+RESPONSE_FORMATS = ('png', 'multipart', 'zip', 'json')
+
+
+class Image_File:
+    '''
+    A cached image, in the shape of a generated image, served from its open
+    file. chunks() streams the file without reading it into memory first;
+    _image_bytes reads it whole, for the formats that need every byte at once.
+    Either closes the file.
+    '''
+
+    def __init__(self, f):
+        self.file = f
+        self.size = os.fstat(f.fileno()).st_size
+
+    @property
+    def _image_bytes(self):
+        with self.file:
+            return self.file.read()
+
+    def chunks(self):
+        return file_chunks(self.file)
+
+    def close(self):
+        self.file.close()
+
+
+def close_images(images):
+    for image in images:
+        if isinstance(image, Image_File):
+            image.close()
+
+
+def image_bytes(images):
+    '''Yields the bytes of each image, as they are needed rather than all at once.'''
+    for image in images:
+        yield image._image_bytes
+
+
+def image_chunks(image):
+    '''Yields an image's bytes: a cached image in chunks of its file, a generated one at once.'''
+    if isinstance(image, Image_File):
+        yield from image.chunks()
+    else:
+        yield image._image_bytes
+
+
+def multipart_chunks(images, boundary, image_format='png'):
+    '''A multipart/mixed body with one image part per image.'''
+    try:
+        for i, image in enumerate(images):
+            size = image.size if isinstance(image, Image_File) else len(image._image_bytes)
+            yield (
+                f'--{boundary}\r\n'
+                f'Content-Type: {MEDIA_TYPES[image_format]}\r\n'
+                f'Content-Disposition: attachment; filename="image-{i}.{EXTENSIONS[image_format]}"\r\n'
+                f'Content-Length: {size}\r\n'
+                f'\r\n'
+            ).encode()
+            yield from image_chunks(image)
+            yield b'\r\n'
+        yield f'--{boundary}--\r\n'.encode()
+    finally:
+        # A client that went away leaves the remaining files open
+        close_images(images)
+
+
+class _Chunk_Buffer(io.RawIOBase):
+    '''A write-only, unseekable file that hands over what was written since the last take().'''
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def zip_chunks(images, image_format='png'):
+    '''
+    A zip archive of image-0.png, image-1.png, ... Each entry is sent as soon
+    as it is written. Images are already compressed, so entries are stored.
+    '''
+    buffer = _Chunk_Buffer()
+    try:
+        with zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_STORED) as archive:
+            for i, data in enumerate(image_bytes(images)):
+                # A fixed timestamp keeps the archive the same bytes for the same images, as its ETag promises
+                archive.writestr(zipfile.ZipInfo(f'image-{i}.{EXTENSIONS[image_format]}', date_time=(1980, 1, 1, 0, 0, 0)), data)
+                yield buffer.take()
+        yield buffer.take()
+    finally:
+        close_images(images)
+
+
+def json_chunks(images, image_format='png'):
+    '''
+    {"images": [{"index", "media_type", "sha256", "url"}]}, where url is a
+    data: URL of the image, so the manifest is usable on its own.
+    '''
+    yield b'{"images": ['
+    try:
+        for i, data in enumerate(image_bytes(images)):
+            entry = {
+                'index': i,
+                'media_type': MEDIA_TYPES[image_format],
+                'sha256': hashlib.sha256(data).hexdigest(),
+                'url': f'data:{MEDIA_TYPES[image_format]};base64,' + base64.b64encode(data).decode(),
+            }
+            yield (', ' if i else '').encode() + json.dumps(entry).encode()
+    finally:
+        close_images(images)
+    yield b']}'
+
+
+def images_response(images, response_format='png', image_format='png', boundary=None):
+    '''
+    The response for a generation's images, in one of RESPONSE_FORMATS, with
+    the images encoded as image_format. A multipart boundary is random unless
+    given, as it must be for a response with an ETag. When the safety filter
+    removed every image, the response is a 422 in every format. Cached images
+    are Image_Files, which are streamed from disk and closed once sent.
+    '''
+    if not images:
+        return JSONResponse(status_code=422, content={'status': 'error', 'error': 'All images were filtered out by the safety filter. Try another prompt.'})
+    if response_format == 'multipart':
+        boundary = boundary or uuid.uuid4().hex
+        return StreamingResponse(multipart_chunks(images, boundary, image_format), media_type=f'multipart/mixed; boundary={boundary}')
+    if response_format == 'zip':
+        return StreamingResponse(zip_chunks(images, image_format), media_type='application/zip', headers={'Content-Disposition': 'attachment; filename="images.zip"'})
+    if response_format == 'json':
+        return StreamingResponse(json_chunks(images, image_format), media_type='application/json')
+    close_images(images[1:])
+    return StreamingResponse(image_chunks(images[0]), media_type=MEDIA_TYPES[image_format])
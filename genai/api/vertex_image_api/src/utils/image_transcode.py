@@ -0,0 +1,85 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# This file is shared by vertex_image_api and image/stable_diffusion. Keep the copies identical.
+
+import io
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+
+MEDIA_TYPES = {'png': 'image/png', 'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+EXTENSIONS = {'png': 'png', 'webp': 'webp', 'jpeg': 'jpg'}
+DEFAULT_QUALITY = {'webp': 80, 'jpeg': 85}
+
+
+def is_original(image_format='png', max_dim=None):
+    '''Whether the requested variant is the generated PNG itself.'''
+    return image_format == 'png' and not max_dim
+
+
+def variant_name(name, image_format='png', quality=None, max_dim=None):
+    '''
+    The cache file name of a variant of the image cached as name, such as
+    "<key>-0.png" for the original and "<key>-0.256px.q80.webp" for a webp
+    thumbnail, so variants are cached alongside their original.
+    '''
+    if is_original(image_format, max_dim):
+        return f'{name}.png'
+    parts = [name, f'{max_dim}px' if max_dim else 'full']
+    if image_format != 'png':
+        parts.append(f'q{quality or DEFAULT_QUALITY[image_format]}')
+    return '.'.join(parts + [EXTENSIONS[image_format]])
+
+
+def transcode(data, image_format='png', quality=None, max_dim=None):
+    '''
+    Re-encodes an image as png, webp or jpeg, shrinking it to fit in
+    max_dim x max_dim first. The aspect ratio is kept, and images are never
+    enlarged. quality applies to webp and jpeg.
+    '''
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+        if max_dim and max(image.size) > max_dim:
+            image.thumbnail((max_dim, max_dim), Image.LANCZOS)
+        if image_format == 'jpeg' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        buffer = io.BytesIO()
+        if image_format == 'png':
+            image.save(buffer, format='PNG')
+        else:
+            image.save(buffer, format=image_format.upper(), quality=quality or DEFAULT_QUALITY[image_format])
+        return buffer.getvalue()
+
+
+class Transcoder:
+    '''
+    Runs transcode on a pool of worker threads, off the event loop. Pillow
+    releases the GIL while it resizes and encodes, so the workers run in
+    parallel.
+    '''
+
+    def __init__(self, max_workers=4):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='transcode')
+
+    async def transcode(self, data, image_format='png', quality=None, max_dim=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(transcode, data, image_format, quality, max_dim))
+
+
+def transcoder_from_env():
+    return Transcoder(max_workers=int(os.environ.get('IMAGE_TRANSCODE_WORKERS', str(min(4, os.cpu_count() or 1)))))
@@ -0,0 +1,120 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# This file is shared by the vertex_*_api services. Keep the copies identical.
+
+import os
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from utils.retry import Vertex_Error
+
+
+class Model_Pool:
+    '''
+    The model handles one service serves, selected per request by name.
+
+    The default model is created up front and never evicted. Other models
+    are created, and loaded in the background, on first use, and kept in an
+    LRU of at most max_models handles. Requests may only select the default
+    model and allowed_models, unless allow_any is set, in which case any
+    name the factory accepts may be selected, and a client can churn the
+    LRU with names of its own.
+    '''
+
+    def __init__(self, factory, default_model, allowed_models=None, allow_any=False, max_models=4, load_timeout=60.0):
+        self.factory = factory
+        self.default_model = default_model
+        self.allowed_models = set(allowed_models or []) | {default_model}
+        self.allow_any = allow_any
+        self.max_models = max_models
+        self.load_timeout = load_timeout
+        self.default = factory(default_model)
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, name=None):
+        '''Returns the handle for a model name, creating it and starting its load if needed.'''
+        if not name or name == self.default_model:
+            return self.default
+        if not self.allow_any and name not in self.allowed_models:
+            raise Vertex_Error(400, f'model {name!r} is not served here. Served models: {sorted(self.allowed_models)}')
+
+        with self._lock:
+            model = self._models.get(name)
+            if model is not None:
+                self._models.move_to_end(name)
+                return model
+            try:
+                model = self.factory(name)
+            except ValueError as e:
+                raise Vertex_Error(400, str(e))
+            self._models[name] = model
+            while len(self._models) > max(self.max_models - 1, 0):
+                evicted, _ = self._models.popitem(last=False)
+                logging.info(f'Evicted model handle {evicted}')
+        model.start_loading()
+        return model
+
+    async def acquire(self, name=None):
+        '''
+        Returns a loaded handle for a model name. A model created for this
+        request is waited for, up to load_timeout. The default model is not:
+        until it is loaded the service is not ready, and a 503 is raised.
+        '''
+        model = self.get(name)
+        if model is self.default:
+            if not model.ready.is_set():
+                raise Vertex_Error(503, f'model {self.default_model!r} is loading', retry_after=1)
+            return model
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.load_timeout
+        while not model.ready.is_set():
+            if model.load_error:
+                self.discard(name, model)
+                raise Vertex_Error(400, f'model {name!r} could not be loaded. {model.load_error}')
+            if loop.time() > deadline:
+                raise Vertex_Error(503, f'model {name!r} is loading', retry_after=1)
+            await asyncio.sleep(0.05)
+        return model
+
+    def discard(self, name, model):
+        with self._lock:
+            if self._models.get(name) is model:
+                del self._models[name]
+
+    def status(self):
+        with self._lock:
+            models = dict(self._models)
+        return {name: model.status() for name, model in {self.default_model: self.default, **models}.items()}
+
+
+def model_pool_from_env(factory, default_model, prefix='VERTEX'):
+    '''
+    {prefix}_DEFAULT_MODEL overrides the default model, and {prefix}_MODELS is a
+    comma separated list of the other model names requests may select. When it
+    is empty, only the default model is served. "*" allows any model name the
+    factory accepts.
+    '''
+    allowed_models = [name.strip() for name in os.environ.get(f'{prefix}_MODELS', '').split(',') if name.strip()]
+    return Model_Pool(
+        factory,
+        default_model=os.environ.get(f'{prefix}_DEFAULT_MODEL', default_model),
+        allowed_models=[name for name in allowed_models if name != '*'],
+        allow_any='*' in allowed_models,
+        max_models=int(os.environ.get('VERTEX_MAX_MODELS', '4')),
+        load_timeout=float(os.environ.get('VERTEX_MODEL_LOAD_TIMEOUT', '60')),
+    )
@@ -13,14 +13,21 @@
 # limitations under the License.
 
 from fastapi import FastAPI
+from contextlib import asynccontextmanager
 from pydantic import BaseModel
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, JSONResponse
 from utils.model_util import Google_Cloud_GenAI
+from utils.model_pool import model_pool_from_env
+from utils.gcp_metadata import get_gcp_metadata
+from utils.retry import Vertex_Error, error_response, status_code_of
+from utils.token_budget import Token_Counter, Token_Budget_Exceeded, preflight, token_limits_from_env, PREFLIGHT_OFF
+from utils.sse import sse_text_events, sse_response
 import io
 import os, sys
 import json
-import requests
+import asyncio
 import logging
+from typing import List, Literal
 
 logging.basicConfig(
     level=logging.DEBUG,
@@ -29,48 +36,85 @@ logging.basicConfig(
     stream=sys.stdout,
 )
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Import the Vertex SDK and load the model in the background, so uvicorn
+    # binds its port immediately. Requests are gated on /genai_ready.
+    model_vertex_llm_text.start_loading()
+    yield
+
+
 app = FastAPI(
+    lifespan=lifespan,
     redoc_url=None,
     title="API for Vertex AI Text LLM",
     description="Contains business logic, data processing steps, and uses the GCP SDK to call the Google Cloud Vertex text-bison LLM model.",
     version="0.0.1",
 )
 
-def get_gcp_metadata():
-    metadata_server = "http://metadata.google.internal"
-    headers = {"Metadata-Flavor": "Google"}
+GCP_PROJECT_ID, GCP_REGION, GCP_ZONE = get_gcp_metadata()
+logging.debug(f'GCP_PROJECT_ID: {GCP_PROJECT_ID}')
+logging.debug(f'GCP_REGION:     {GCP_REGION}')
+logging.debug(f'GCP_ZONE:       {GCP_ZONE}')
 
-    # Get Project ID
-    project_id_url = f"{metadata_server}/computeMetadata/v1/project/project-id"
-    project_id_response = requests.get(project_id_url, headers=headers)
-    project_id = project_id_response.text if project_id_response.status_code == 200 else "Unavailable"
+# Initialize Vertex LLM Model. The default model loads at startup; other text-bison models and versions are created on first use.
+text_models = model_pool_from_env(
+    lambda name: Google_Cloud_GenAI(GCP_PROJECT_ID, GCP_REGION=GCP_REGION, MODEL_TYPE='text-bison', MODEL_NAME=name),
+    default_model='text-bison@001',
+)
+model_vertex_llm_text = text_models.default
 
-    # Get GCP Zone
-    zone_url = f"{metadata_server}/computeMetadata/v1/instance/zone"
-    zone_response = requests.get(zone_url, headers=headers)
-    zone = zone_response.text.split('/')[-1] if zone_response.status_code == 200 else "Unavailable"
+# Token limits per model used by the preflight check. Defaults are the models' published limits.
+token_limits = token_limits_from_env(text_models.default_model)
 
-    # Extract GCP Region
-    region = '-'.join(zone.split('-')[:-1])
+# Limits for /batch. Items in a batch share the process-wide VERTEX_MAX_CONCURRENCY limit as well.
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', '1000'))
+BATCH_MAX_CONCURRENCY = int(os.environ.get('BATCH_MAX_CONCURRENCY', '32'))
 
-    return project_id, region, zone
+async def count_tokens(model, prompt, message_history=None):
+    return await model.count_tokens_async(prompt, message_history)
 
-GCP_PROJECT_ID, GCP_REGION, GCP_ZONE = get_gcp_metadata()
-logging.debug(f'GCP_PROJECT_ID: {GCP_PROJECT_ID}')
-logging.debug(f'GCP_REGION:     {GCP_REGION}')
-logging.debug(f'GCP_ZONE:       {GCP_ZONE}')
 
-# Initialize Vertex LLM Model
-model_vertex_llm_text = Google_Cloud_GenAI(GCP_PROJECT_ID, GCP_REGION=GCP_REGION, MODEL_TYPE='text-bison')
+token_counter = Token_Counter(count_tokens, max_entries=int(os.environ.get('TOKEN_COUNT_CACHE_SIZE', '10000')))
 
 headers = {"Content-Type": "application/json"}
 
+class Payload_Count_Tokens(BaseModel):
+    prompt: str
+    # Counts with this model's tokenizer. Defaults to the service's default model.
+    model: str | None = None
+
+
 class Payload_Vertex_Text(BaseModel):
     prompt: str
     max_output_tokens: int | None = 1024
     temperature: float | None = 0.2
     top_p: float | None = 0.8
     top_k: int | None = 40
+    # Count tokens before generating: 'reject' over-budget requests, or 'truncate' them to fit
+    preflight: Literal['off', 'reject', 'truncate'] | None = 'off'
+    # Model name or version to use, such as "text-bison@002". Defaults to the service's default model.
+    model: str | None = None
+
+
+# Unset parameters fall back to the batch's shared parameters
+class Payload_Batch_Item(BaseModel):
+    prompt: str
+    max_output_tokens: int | None = None
+    temperature: float | None = None
+    top_p: float | None = None
+    top_k: int | None = None
+
+
+class Payload_Vertex_Text_Batch(BaseModel):
+    items: List[Payload_Batch_Item]
+    max_output_tokens: int | None = 1024
+    temperature: float | None = 0.2
+    top_p: float | None = 0.8
+    top_k: int | None = 40
+    preflight: Literal['off', 'reject', 'truncate'] | None = 'off'
+    max_concurrency: int | None = BATCH_MAX_CONCURRENCY
+    model: str | None = None
 
 
 # Routes 
@@ -81,8 +125,40 @@ async def health_check():
     return {'status': 'ok'}
 
 
+@app.get("/genai_ready", include_in_schema=False)
+async def readiness_check():
+    return JSONResponse(status_code=200 if model_vertex_llm_text.ready.is_set() else 503, content=text_models.status())
+
+
+async def apply_preflight(payload, request_payload, model):
+    '''Returns the payload to send to model, or a 413 response when the request is over its budget.'''
+    if payload.preflight in (None, PREFLIGHT_OFF):
+        return request_payload
+    try:
+        max_input_tokens, max_output_tokens = token_limits.for_model(model.pretrained_model)
+        request_payload, report = await preflight(token_counter, model, request_payload, payload.preflight, max_input_tokens, max_output_tokens)
+        logging.debug(f'preflight: {report}')
+        return request_payload
+    except Token_Budget_Exceeded as e:
+        return JSONResponse(status_code=413, content=e.report)
+
+
+@app.post("/count_tokens")
+async def vertex_count_tokens(payload: Payload_Count_Tokens):
+    try:
+        model = await text_models.acquire(payload.model)
+        total_tokens = await token_counter.count(model, payload.prompt)
+        return {'total_tokens': total_tokens}
+    except Exception as e:
+        return error_response(e)
+
+
 @app.post("/")
-def vertex_llm_text(payload: Payload_Vertex_Text):
+async def vertex_llm_text(payload: Payload_Vertex_Text):
+    try:
+        model = await text_models.acquire(payload.model)
+    except Vertex_Error as e:
+        return error_response(e)
     try:
         request_payload = {
             'prompt': payload.prompt, 
@@ -91,11 +167,75 @@ def vertex_llm_text(payload: Payload_Vertex_Text):
             'top_p': payload.top_p,
             'top_k': payload.top_k,
         }
-        response = model_vertex_llm_text.call_llm(**request_payload)
+        request_payload = await apply_preflight(payload, request_payload, model)
+        if isinstance(request_payload, JSONResponse):
+            return request_payload
+        response = await model.call_llm_async(**request_payload)
         return response.text
     except Exception as e:
-        print(f'EXCEPTION: {e}')
-        return {}
+        return error_response(e)
+
+
+@app.post("/stream")
+async def vertex_llm_text_stream(payload: Payload_Vertex_Text):
+    try:
+        model = await text_models.acquire(payload.model)
+    except Vertex_Error as e:
+        return error_response(e)
+    request_payload = {
+        'prompt': payload.prompt,
+        'max_output_tokens': payload.max_output_tokens,
+        'temperature': payload.temperature,
+        'top_p': payload.top_p,
+        'top_k': payload.top_k,
+    }
+    try:
+        request_payload = await apply_preflight(payload, request_payload, model)
+    except Exception as e:
+        return error_response(e)
+    if isinstance(request_payload, JSONResponse):
+        return request_payload
+    return sse_response(sse_text_events(model.stream_llm_async(**request_payload)))
+
+
+
+@app.post("/batch")
+async def vertex_llm_text_batch(payload: Payload_Vertex_Text_Batch):
+    '''
+    Runs every item with bounded concurrency and returns the results in the
+    order of items: {"text": ...} for a success, {"error": ...} for a failure.
+    One failed item does not fail the batch.
+    '''
+    try:
+        model = await text_models.acquire(payload.model)
+    except Vertex_Error as e:
+        return error_response(e)
+    if len(payload.items) > BATCH_MAX_ITEMS:
+        return JSONResponse(status_code=413, content={'status': f'batches are limited to {BATCH_MAX_ITEMS} items'})
+
+    semaphore = asyncio.Semaphore(max(1, min(payload.max_concurrency or BATCH_MAX_CONCURRENCY, BATCH_MAX_CONCURRENCY)))
+
+    async def run_item(item):
+        request_payload = {
+            'prompt': item.prompt,
+            'max_output_tokens': item.max_output_tokens if item.max_output_tokens is not None else payload.max_output_tokens,
+            'temperature': item.temperature if item.temperature is not None else payload.temperature,
+            'top_p': item.top_p if item.top_p is not None else payload.top_p,
+            'top_k': item.top_k if item.top_k is not None else payload.top_k,
+        }
+        async with semaphore:
+            try:
+                request_payload = await apply_preflight(payload, request_payload, model)
+                if isinstance(request_payload, JSONResponse):
+                    return {'error': 'over token budget', 'detail': json.loads(request_payload.body)}
+                response = await model.call_llm_async(**request_payload)
+                return {'text': response.text}
+            except Exception as e:
+                logging.warning(f'At /batch item. {e}')
+                return {'error': str(e), 'status_code': status_code_of(e)}
+
+    results = await asyncio.gather(*[run_item(item) for item in payload.items])
+    return {'results': results}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,57 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pytest -s -W ignore
+
+from fastapi.testclient import TestClient
+from unittest import mock
+import asyncio
+import main
+
+client = TestClient(main.app)
+
+
+def test_batch_keeps_order_and_isolates_errors():
+    in_flight = []
+    peak = []
+
+    async def predict_async(prompt, **kwargs):
+        in_flight.append(prompt)
+        peak.append(len(in_flight))
+        await asyncio.sleep(0.01)
+        in_flight.remove(prompt)
+        if prompt == 'bad':
+            raise RuntimeError('quota exceeded')
+        return mock.Mock(text=f'{prompt} at {kwargs["temperature"]}')
+
+    fake_model = mock.Mock()
+    fake_model.predict_async.side_effect = predict_async
+
+    payload = {
+        "items": [{"prompt": "a"}, {"prompt": "bad"}, {"prompt": "c", "temperature": 0.9}] + [{"prompt": "d"}] * 7,
+        "temperature": 0.2,
+        "max_concurrency": 3,
+    }
+    with mock.patch.object(main.model_vertex_llm_text, 'model', fake_model), \
+            mock.patch.object(main.model_vertex_llm_text.ready, 'is_set', return_value=True):
+        response = client.post("/batch", json=payload)
+
+    assert response.status_code == 200
+    results = response.json()['results']
+    assert len(results) == 10
+    assert results[0] == {'text': 'a at 0.2'}
+    assert 'error' in results[1]
+    # Per-item parameters override the shared ones
+    assert results[2] == {'text': 'c at 0.9'}
+    assert max(peak) <= 3
@@ -0,0 +1,90 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pytest -s -W ignore
+
+import asyncio
+import pytest
+from unittest import mock
+from utils.token_budget import Token_Counter, Token_Budget_Exceeded, Token_Limits, preflight
+
+TEXT_BISON = mock.Mock(pretrained_model='text-bison@001')
+
+
+def word_counter(calls):
+    # One token per word stands in for the model's count_tokens call
+    async def count_fn(model, prompt, message_history=None):
+        calls.append(prompt)
+        return len(prompt.split())
+    return count_fn
+
+
+def test_counts_are_cached_by_prompt():
+    calls = []
+    counter = Token_Counter(word_counter(calls), max_entries=2)
+
+    async def run():
+        return [await counter.count(TEXT_BISON, p) for p in ('a b', 'a b', 'c', 'd', 'a b')]
+
+    assert asyncio.run(run()) == [2, 2, 1, 1, 2]
+    # 'a b' was evicted by 'c' and 'd', so it is counted again at the end
+    assert calls == ['a b', 'c', 'd', 'a b']
+    assert (counter.hits, counter.misses) == (1, 4)
+
+
+def test_counts_and_limits_are_per_model():
+    calls = []
+    counter = Token_Counter(word_counter(calls))
+    text_bison_32k = mock.Mock(pretrained_model='text-bison-32k@002')
+
+    async def run():
+        return [await counter.count(model, 'a b') for model in (TEXT_BISON, text_bison_32k, TEXT_BISON)]
+
+    # Each model's tokenizer is asked once
+    assert asyncio.run(run()) == [2, 2, 2]
+    assert len(calls) == 2
+
+    limits = Token_Limits('text-bison@001', {'text-bison@002': (100, 10)})
+    assert limits.for_model('text-bison-32k@002') == (32768, 8192)
+    assert limits.for_model('text-bison@002') == (100, 10)
+    assert limits.for_model('gemini-1.0-pro-002') == (30720, 2048)
+    # Unknown models get the default model's limits
+    assert limits.for_model('text-unicorn@001') == (8192, 1024)
+
+
+def test_preflight_rejects_over_budget():
+    counter = Token_Counter(word_counter([]))
+    payload = {'prompt': 'one two three four', 'max_output_tokens': 10}
+
+    with pytest.raises(Token_Budget_Exceeded) as e:
+        asyncio.run(preflight(counter, TEXT_BISON, payload, 'reject', max_input_tokens=3, max_output_tokens=100))
+    assert e.value.report['prompt_tokens'] == 4
+
+    # Within budget, the payload is returned unchanged
+    request_payload, report = asyncio.run(preflight(counter, TEXT_BISON, payload, 'reject', max_input_tokens=4, max_output_tokens=100))
+    assert request_payload == payload
+    assert not report['truncated']
+
+
+def test_preflight_truncates_to_fit():
+    counter = Token_Counter(word_counter([]))
+    payload = {'prompt': ' '.join(['word'] * 100), 'max_output_tokens': 4096}
+
+    request_payload, report = asyncio.run(preflight(counter, TEXT_BISON, payload, 'truncate', max_input_tokens=50, max_output_tokens=1024))
+
+    assert report['truncated']
+    assert 0 < len(request_payload['prompt'].split()) <= 50
+    assert request_payload['max_output_tokens'] == 1024
+    # The caller's payload is not modified
+    assert payload['max_output_tokens'] == 4096
@@ -12,125 +12,507 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+# This file is shared by the vertex_*_api services. Keep the copies identical.
+
+import os
 import sys
-import json
-import requests
-import vertexai
-from vertexai.language_models import TextGenerationModel, ChatModel, CodeGenerationModel, CodeChatModel, InputOutputTextPair
-from vertexai.preview.vision_models import Image, ImageGenerationModel
+import time
+import asyncio
+import logging
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils.retry import retry_policy_from_env
+from utils.pacer import pacer_from_env
 
 
-class Google_Cloud_GenAI:
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+    stream=sys.stdout,
+)
 
-    def __init__(self, GCP_PROJECT_ID, GCP_REGION,  MODEL_TYPE):
+
+# Maximum number of Vertex calls one process keeps in flight. Calls beyond this wait for a slot.
+VERTEX_MAX_CONCURRENCY = int(os.environ.get('VERTEX_MAX_CONCURRENCY', '256'))
+# Threads used for SDK calls that have no async variant, such as Imagen's generate_images.
+VERTEX_EXECUTOR_WORKERS = int(os.environ.get('VERTEX_EXECUTOR_WORKERS', '16'))
+
+# Shared by every model handle in the process, so serving several models does
+# not multiply the in-flight, retry or thread limits.
+process_concurrency = asyncio.Semaphore(VERTEX_MAX_CONCURRENCY)
+process_retry_policy = retry_policy_from_env()
+# Paces calls to the project quota, or None when VERTEX_QUOTA_PER_MINUTE is unset
+process_pacer = pacer_from_env()
+_process_executor = None
+
+
+class Deferred_Model:
+    '''
+    Base class for the Vertex model wrappers.
+
+    Importing the Vertex SDK, vertexai.init and from_pretrained take seconds, so
+    they run in load() rather than in the constructor. Services call
+    start_loading() from their lifespan so uvicorn binds its port immediately,
+    and gate requests (and the readiness probe) on the ready event.
+    '''
+
+    def __init__(self):
+        self.model = None
+        self.ready = threading.Event()
+        self.load_error = None
+        self.startup_report = {}
+        self.concurrency = process_concurrency
+        self.retry = process_retry_policy
+        self.pacer = process_pacer
+
+    def start_loading(self):
+        thread = threading.Thread(target=self.load, name=f'{type(self).__name__}-loader', daemon=True)
+        thread.start()
+        return thread
+
+    def load(self):
+        start = time.perf_counter()
+        try:
+            self._load()
+        except Exception as e:
+            self.load_error = f'{e}'
+            logging.exception(f'Failed to load {type(self).__name__}. {e}')
+            return
+        self.startup_report['total_s'] = round(time.perf_counter() - start, 3)
+        logging.info(f'{type(self).__name__} ready. Startup report: {self.startup_report}')
+        self.ready.set()
+
+    def _load(self):
+        raise NotImplementedError
+
+    def status(self):
+        if self.ready.is_set():
+            status = 'ok'
+        elif self.load_error:
+            status = 'error'
+        else:
+            status = 'loading'
+        return {'status': status, 'error': self.load_error, 'startup': self.startup_report}
+
+    async def run_in_executor(self, func, *args, **kwargs):
+        '''Runs a blocking SDK call on a bounded thread pool, so the event loop is never blocked.'''
+        global _process_executor
+        if _process_executor is None:
+            _process_executor = ThreadPoolExecutor(max_workers=VERTEX_EXECUTOR_WORKERS, thread_name_prefix='vertex-sdk')
+        return await asyncio.get_running_loop().run_in_executor(_process_executor, functools.partial(func, *args, **kwargs))
+
+    def quota_key(self):
+        return f'vertex-quota:{self.GCP_PROJECT_ID}:{self.GCP_REGION}:{self.pretrained_model}'
+
+    async def pace(self):
+        '''Waits for a slot in the project quota for this model.'''
+        if self.pacer is not None:
+            await self.pacer.acquire(self.quota_key())
+
+    def paced(self, fn):
+        '''Wraps an async Vertex call so each attempt, retries included, waits for its quota slot.'''
+        if self.pacer is None:
+            return fn
+
+        async def paced_call(*args, **kwargs):
+            await self.pace()
+            return await fn(*args, **kwargs)
+        return paced_call
+
+    def paced_sync(self, fn):
+        if self.pacer is None:
+            return fn
+
+        def paced_call(*args, **kwargs):
+            self.pacer.acquire_sync(self.quota_key())
+            return fn(*args, **kwargs)
+        return paced_call
+
+    def _record(self, phase, since):
+        self.startup_report[phase] = round(time.perf_counter() - since, 3)
+        return time.perf_counter()
+
+    def _init_vertexai(self):
+        start = time.perf_counter()
+        import vertexai
+        start = self._record('import_vertexai_s', start)
+        vertexai.init(project=self.GCP_PROJECT_ID, location=self.GCP_REGION)
+        self._record('vertexai_init_s', start)
+
+
+class Google_Cloud_GenAI(Deferred_Model):
+    '''
+    MODEL_TYPE is the model family, which selects the SDK class. MODEL_NAME
+    optionally picks a model or version in that family, such as
+    "text-bison@002" or "text-bison-32k"; it defaults to "{MODEL_TYPE}@001".
+    '''
+
+    def __init__(self, GCP_PROJECT_ID, GCP_REGION,  MODEL_TYPE, MODEL_NAME=None):
+        super().__init__()
         if GCP_PROJECT_ID=="":
             print(f'[ WARNING ] GCP_PROJECT_ID ENV variable is empty. Be sure to set the GCP_PROJECT_ID ENV variable.')
-        
+
         if GCP_REGION=="":
             print(f'[ WARNING ] GCP_REGION ENV variable is empty. Be sure to set the GCP_REGION ENV variable.')
 
         if MODEL_TYPE=="":
-            print(f'[ WARNING ] MODEL_TYPE ENV variable is empty. Be sure to set the MODEL_TYPE ENV variable.') 
-        
+            print(f'[ WARNING ] MODEL_TYPE ENV variable is empty. Be sure to set the MODEL_TYPE ENV variable.')
+
         self.GCP_PROJECT_ID = GCP_PROJECT_ID
         self.GCP_REGION = GCP_REGION
         self.MODEL_TYPE = MODEL_TYPE
-        self.pretrained_model = f'{MODEL_TYPE.lower()}@001'
-
-        self.vertexai = vertexai.init(project=GCP_PROJECT_ID, location=GCP_REGION)
-        
-        if MODEL_TYPE.lower() == 'text-bison':
-            self.model = TextGenerationModel.from_pretrained(self.pretrained_model)
-        elif MODEL_TYPE.lower() == 'chat-bison':
-            self.model = ChatModel.from_pretrained(self.pretrained_model)
-        elif MODEL_TYPE.lower() == 'code-bison':
-            self.model = CodeGenerationModel.from_pretrained(self.pretrained_model)
-        elif MODEL_TYPE.lower() == 'codechat-bison':
-            self.model = CodeChatModel.from_pretrained(self.pretrained_model)
-        else:
+        self.pretrained_model = MODEL_NAME or f'{MODEL_TYPE.lower()}@001'
+
+        if MODEL_TYPE.lower() not in ('text-bison', 'chat-bison', 'code-bison', 'codechat-bison'):
             # MODEL_TYPE can be "text-bison", "chat-bison", "code-bison", or "codechat-bison"
-            print(f'[ ERROR ] No MODEL_TYPE specified or MODEL_TYPE is incorrect. Expecting MODEL_TYPE ENV var of "text-bison", "chat-bison", "code-bison", or "codechat-bison".')
-            sys.exit()
+            raise ValueError(f'MODEL_TYPE {MODEL_TYPE!r} is incorrect. Expecting "text-bison", "chat-bison", "code-bison", or "codechat-bison".')
+
+        if not self.pretrained_model.lower().startswith(MODEL_TYPE.lower()):
+            raise ValueError(f'Model {self.pretrained_model!r} is not a {MODEL_TYPE} model.')
 
-    def call_llm(self, prompt, temperature=0.2, max_output_tokens=256, top_p=0.8, top_k=40, context='', chat_examples=[], code_suffix=''):
+    def _load(self):
+        self._init_vertexai()
+
+        start = time.perf_counter()
+        # The preview classes add count_tokens
+        from vertexai.preview.language_models import TextGenerationModel, ChatModel, CodeGenerationModel, CodeChatModel
+        model_classes = {
+            'text-bison': TextGenerationModel,
+            'chat-bison': ChatModel,
+            'code-bison': CodeGenerationModel,
+            'codechat-bison': CodeChatModel,
+        }
+        self.model = model_classes[self.MODEL_TYPE.lower()].from_pretrained(self.pretrained_model)
+        self._record('from_pretrained_s', start)
+
+    def start_chat(self, context='', chat_examples=[], message_history=[], temperature=0.2, max_output_tokens=256, top_p=0.8, top_k=40):
+        '''
+        Creates a ChatSession (chat-bison) or CodeChatSession (codechat-bison)
+        that can be kept server-side and passed to call_llm as chat_session, so
+        each turn only sends the new message.
+        '''
+        from vertexai.language_models import ChatMessage
+
+        message_history = [ChatMessage(author=m.author, content=m.content) for m in message_history]
+        if self.MODEL_TYPE.lower() == 'chat-bison':
+            return self.model.start_chat(
+                context=context,
+                examples=chat_examples,
+                message_history=message_history,
+                temperature=temperature,
+                max_output_tokens=max_output_tokens,
+                top_p=top_p,
+                top_k=top_k
+            )
+        elif self.MODEL_TYPE.lower() == 'codechat-bison':
+            return self.model.start_chat(
+                context=context or None,
+                message_history=message_history,
+                temperature=temperature,
+                max_output_tokens=max_output_tokens,
+            )
+        raise ValueError(f'{self.MODEL_TYPE} does not support chat sessions')
+
+    def call_llm(self, prompt, temperature=0.2, max_output_tokens=256, top_p=0.8, top_k=40, context='', chat_examples=[], message_history=[], code_suffix='', chat_session=None):
+        '''Calls the model, retrying transient errors. Failures are raised as Vertex_Error.'''
+        return self.retry.call_sync(self.paced_sync(self._call_llm), prompt, temperature, max_output_tokens, top_p, top_k, context, chat_examples, message_history, code_suffix, chat_session)
+
+    def _call_llm(self, prompt, temperature, max_output_tokens, top_p, top_k, context, chat_examples, message_history, code_suffix, chat_session):
         if self.MODEL_TYPE.lower() == 'text-bison':
-            try:
-                parameters = {
-                    "temperature": temperature,  # Temperature controls the degree of randomness in token selection.
-                    "max_output_tokens": max_output_tokens, # Token limit determines the maximum amount of text output.
-                    "top_p": top_p,  # Tokens are selected from most probable to least until the sum of their probabilities equals the top_p value.
-                    "top_k": top_k,  # A top_k of 1 means the selected token is the most probable among all tokens.
-                }
-
-                response = self.model.predict(
+            parameters = {
+                "temperature": temperature,  # Temperature controls the degree of randomness in token selection.
+                "max_output_tokens": max_output_tokens, # Token limit determines the maximum amount of text output.
+                "top_p": top_p,  # Tokens are selected from most probable to least until the sum of their probabilities equals the top_p value.
+                "top_k": top_k,  # A top_k of 1 means the selected token is the most probable among all tokens.
+            }
+
+            response = self.model.predict(
+                prompt,
+                **parameters,
+            )
+            return response
+
+        elif self.MODEL_TYPE.lower() == 'chat-bison':
+            '''
+            examples=[
+                InputOutputTextPair(
+                    input_text="Who do you work for?",
+                    output_text="I work for Ned.",
+                ),
+                InputOutputTextPair(
+                    input_text="What do I like?",
+                    output_text="Ned likes watching movies.",
+                ),
+            ]
+            '''
+            if chat_session is None:
+                chat_session = self.start_chat(context, chat_examples, message_history, temperature, max_output_tokens, top_p, top_k)
+
+            response = chat_session.send_message(
+                prompt,
+                temperature=temperature,
+                max_output_tokens=max_output_tokens,
+                top_p=top_p,
+                top_k=top_k,
+            )
+            return response
+
+        elif self.MODEL_TYPE.lower() == 'code-bison':
+            '''A language model that generates code.'''
+            response = self.model.predict(prefix=prompt, temperature=temperature, max_output_tokens=max_output_tokens, suffix=code_suffix)
+            return response
+
+        elif self.MODEL_TYPE.lower() == 'codechat-bison':
+            '''CodeChatModel represents a model that is capable of completing code.'''
+            if chat_session is None:
+                chat_session = self.start_chat(context, message_history=message_history, temperature=temperature, max_output_tokens=max_output_tokens)
+
+            response = chat_session.send_message(prompt, max_output_tokens=max_output_tokens, temperature=temperature)
+            return response
+
+    async def call_llm_async(self, prompt, temperature=0.2, max_output_tokens=256, top_p=0.8, top_k=40, context='', chat_examples=[], message_history=[], code_suffix='', chat_session=None):
+        '''Same as call_llm, using the SDK's async methods so many calls can be in flight at once.'''
+        if chat_session is None and self.MODEL_TYPE.lower() == 'chat-bison':
+            chat_session = self.start_chat(context, chat_examples, message_history, temperature, max_output_tokens, top_p, top_k)
+        elif chat_session is None and self.MODEL_TYPE.lower() == 'codechat-bison':
+            chat_session = self.start_chat(context, message_history=message_history, temperature=temperature, max_output_tokens=max_output_tokens)
+
+        async with self.concurrency:
+            if self.MODEL_TYPE.lower() == 'text-bison':
+                return await self.retry.call(
+                    self.paced(self.model.predict_async),
                     prompt,
-                    **parameters,
+                    temperature=temperature,
+                    max_output_tokens=max_output_tokens,
+                    top_p=top_p,
+                    top_k=top_k,
                 )
-                return response
-            except Exception as e:
-                print(f'[ EXCEPTION ] At call_llm for text-bison. {e}')
-                return ''
-        
-        elif self.MODEL_TYPE.lower() == 'chat-bison':
-            try:
-                '''
-                examples=[
-                    InputOutputTextPair(
-                        input_text="Who do you work for?",
-                        output_text="I work for Ned.",
-                    ),
-                    InputOutputTextPair(
-                        input_text="What do I like?",
-                        output_text="Ned likes watching movies.",
-                    ),
-                ]
-                '''
-
-                chat = self.model.start_chat(
-                    context=context,
-                    examples=chat_examples,
+
+            elif self.MODEL_TYPE.lower() == 'chat-bison':
+                return await self.retry.call(
+                    self.paced(chat_session.send_message_async),
+                    prompt,
                     temperature=temperature,
                     max_output_tokens=max_output_tokens,
                     top_p=top_p,
-                    top_k=top_k
+                    top_k=top_k,
                 )
 
-                response = chat.send_message(prompt)
-                return response
-            except Exception as e:
-                print(f'[ EXCEPTION ] At call_chat for chat-bison. {e}')
-                return ''
-        
+            elif self.MODEL_TYPE.lower() == 'code-bison':
+                return await self.retry.call(self.paced(self.model.predict_async), prefix=prompt, temperature=temperature, max_output_tokens=max_output_tokens, suffix=code_suffix)
+
+            elif self.MODEL_TYPE.lower() == 'codechat-bison':
+                return await self.retry.call(self.paced(chat_session.send_message_async), prompt, max_output_tokens=max_output_tokens, temperature=temperature)
+
+    async def count_tokens_async(self, prompt, message_history=None, context='', code_suffix=''):
+        '''
+        Counts the input tokens of a request. Chat models count the context and
+        message history along with the prompt. count_tokens has no async variant.
+        '''
+        if self.MODEL_TYPE.lower() == 'text-bison':
+            count, args, kwargs = self.model.count_tokens, ([prompt],), {}
         elif self.MODEL_TYPE.lower() == 'code-bison':
-            '''A language model that generates code.'''
-            try:
-                response = self.model.predict(prefix=prompt, temperature=temperature, max_output_tokens=max_output_tokens, suffix=code_suffix)
-                return response
-            except Exception as e:
-                print(f'[ EXCEPTION ] At call_chat for codechat-bison. {e}')
-                return ''        
-        
-        elif self.MODEL_TYPE.lower() == 'codechat-bison':
-            '''CodeChatModel represents a model that is capable of completing code.'''
-            try:
-                code_chat = self.model.start_chat(
+            count, args, kwargs = self.model.count_tokens, (prompt,), {'suffix': code_suffix or None}
+        else:
+            # A session is local state until a message is sent, so starting one here makes no request
+            count, args, kwargs = self.start_chat(context, message_history=message_history or []).count_tokens, (prompt,), {}
+
+        async with self.concurrency:
+            # Token counts draw on the same project quota as generation
+            response = await self.retry.call(self.paced(self.run_in_executor), count, *args, **kwargs)
+        return response.total_tokens
+
+    async def stream_llm_async(self, prompt, temperature=0.2, max_output_tokens=256, top_p=0.8, top_k=40, context='', chat_examples=[], message_history=[], code_suffix='', chat_session=None):
+        '''
+        Streaming variant of call_llm_async. Yields the text of each chunk as
+        the model produces it. Transient errors are retried until the first
+        chunk arrives; after that they are raised, since part of the response
+        may already have been sent.
+        '''
+        if chat_session is None and self.MODEL_TYPE.lower() == 'chat-bison':
+            chat_session = self.start_chat(context, chat_examples, message_history, temperature, max_output_tokens, top_p, top_k)
+        elif chat_session is None and self.MODEL_TYPE.lower() == 'codechat-bison':
+            chat_session = self.start_chat(context, message_history=message_history, temperature=temperature, max_output_tokens=max_output_tokens)
+
+        async def open_stream():
+            await self.pace()
+            if self.MODEL_TYPE.lower() == 'text-bison':
+                return self.model.predict_streaming_async(
+                    prompt,
+                    temperature=temperature,
                     max_output_tokens=max_output_tokens,
+                    top_p=top_p,
+                    top_k=top_k,
+                )
+
+            elif self.MODEL_TYPE.lower() == 'chat-bison':
+                return chat_session.send_message_streaming_async(
+                    prompt,
                     temperature=temperature,
+                    max_output_tokens=max_output_tokens,
+                    top_p=top_p,
+                    top_k=top_k,
                 )
 
-                response = code_chat.send_message(prompt)
-                return response
-            except Exception as e:
-                print(f'[ EXCEPTION ] At call_chat for codechat-bison. {e}')
-                return ''
+            elif self.MODEL_TYPE.lower() == 'code-bison':
+                return self.model.predict_streaming_async(prefix=prompt, suffix=code_suffix, temperature=temperature, max_output_tokens=max_output_tokens)
+
+            elif self.MODEL_TYPE.lower() == 'codechat-bison':
+                return chat_session.send_message_streaming_async(prompt, max_output_tokens=max_output_tokens, temperature=temperature)
+
+        async with self.concurrency:
+            async for chunk in self.retry.stream(open_stream):
+                yield chunk.text
+
+
+class GCP_GenAI_Gemini(Deferred_Model):
 
+    def __init__(self, GCP_PROJECT_ID, GCP_REGION,  MODEL_TYPE):
+        super().__init__()
+        if GCP_PROJECT_ID=="":
+            logging.warning(f'GCP_PROJECT_ID ENV variable is empty. Be sure to set the GCP_PROJECT_ID ENV variable.')
+
+        if GCP_REGION=="":
+            logging.warning(f'GCP_REGION ENV variable is empty. Be sure to set the GCP_REGION ENV variable.')
+
+        if MODEL_TYPE=="":
+            logging.warning(f'MODEL_TYPE ENV variable is empty. Be sure to set the MODEL_TYPE ENV variable.')
+
+        self.GCP_PROJECT_ID = GCP_PROJECT_ID
+        self.GCP_REGION = GCP_REGION
+        self.MODEL_TYPE = MODEL_TYPE
+        self.pretrained_model = f'{MODEL_TYPE.lower()}'
+
+        if not MODEL_TYPE.lower().startswith('gemini-'):
+            # MODEL_TYPE can be "gemini-pro", or a Gemini model version such as "gemini-1.0-pro-001"
+            raise ValueError(f'MODEL_TYPE {MODEL_TYPE!r} is incorrect. Expecting a Gemini model, such as "gemini-pro".')
+
+    def _load(self):
+        self._init_vertexai()
+
+        start = time.perf_counter()
+        from vertexai.preview.generative_models import GenerativeModel
+        self.model = GenerativeModel(self.pretrained_model)
+        self._record('from_pretrained_s', start)
+
+    def call_llm(self,
+        prompt,
+        temperature=0.5,
+        max_output_tokens=1024,
+        top_p=0.8,
+        top_k=40,
+        stop_sequences=None,
+        safety_settings=None,
+        ):
 
-class Google_Cloud_Imagen:
+        if self.MODEL_TYPE.lower().startswith('gemini-'):
+            '''
+                The Vertex AI Gemini API supports multimodal prompts as input and ouputs text or code.
+                https://cloud.google.com/vertex-ai/docs/generative-ai/model-reference/gemini
+                https://cloud.google.com/vertex-ai/docs/generative-ai/multimodal/send-chat-prompts-gemini
+            '''
+            return self.retry.call_sync(
+                self.paced_sync(self.model.generate_content),
+                contents=prompt,
+                generation_config=self.generation_config(temperature, max_output_tokens, top_p, top_k, stop_sequences),
+                safety_settings=safety_settings
+            )
+
+    @staticmethod
+    def build_contents(prompt, message_history=None, parts=None):
+        '''
+        Builds the contents of a request. message_history is a list of
+        {'role': 'user' | 'model', 'text': ...} turns, oldest first. parts are
+        SDK Parts (images, documents, text) sent ahead of the prompt.
+        '''
+        if not message_history and not parts:
+            return prompt
+
+        from vertexai.preview.generative_models import Content, Part
+
+        contents = [Content(role=turn['role'], parts=[Part.from_text(turn['text'])]) for turn in message_history or []]
+        contents.append(Content(role='user', parts=[*(parts or []), Part.from_text(prompt)]))
+        return contents
+
+    @staticmethod
+    def generation_config(temperature, max_output_tokens, top_p, top_k, stop_sequences):
+        from vertexai.preview.generative_models import GenerationConfig
+
+        return GenerationConfig(
+            temperature=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            candidate_count=1,
+            max_output_tokens=max_output_tokens,
+            stop_sequences=stop_sequences,
+        )
+
+    async def call_llm_async(self,
+        prompt,
+        temperature=0.5,
+        max_output_tokens=1024,
+        top_p=0.8,
+        top_k=40,
+        stop_sequences=None,
+        safety_settings=None,
+        message_history=None,
+        parts=None,
+        ):
+        '''Same as call_llm, using generate_content_async so many calls can be in flight at once.'''
+        async with self.concurrency:
+            return await self.retry.call(
+                self.paced(self.model.generate_content_async),
+                contents=self.build_contents(prompt, message_history, parts),
+                generation_config=self.generation_config(temperature, max_output_tokens, top_p, top_k, stop_sequences),
+                safety_settings=safety_settings
+            )
+
+    async def count_tokens_async(self, prompt, message_history=None, parts=None):
+        async with self.concurrency:
+            # Token counts draw on the same project quota as generation
+            response = await self.retry.call(self.paced(self.model.count_tokens_async), self.build_contents(prompt, message_history, parts))
+        return response.total_tokens
+
+    async def stream_llm_async(self,
+        prompt,
+        temperature=0.5,
+        max_output_tokens=1024,
+        top_p=0.8,
+        top_k=40,
+        stop_sequences=None,
+        safety_settings=None,
+        message_history=None,
+        parts=None,
+        ):
+        '''
+        Streaming variant of call_llm_async. Yields each GenerationResponse
+        chunk as it arrives. Transient errors are retried until the first
+        chunk arrives. Closing the generator, or cancelling the task iterating
+        it, cancels the underlying streaming RPC.
+        '''
+        async def open_stream():
+            await self.pace()
+            return await self.model.generate_content_async(
+                contents=self.build_contents(prompt, message_history, parts),
+                generation_config=self.generation_config(temperature, max_output_tokens, top_p, top_k, stop_sequences),
+                safety_settings=safety_settings,
+                stream=True,
+            )
+
+        async with self.concurrency:
+            async for chunk in self.retry.stream(open_stream):
+                yield chunk
+
+
+class Google_Cloud_Imagen(Deferred_Model):
     '''
     https://cloud.google.com/vertex-ai/docs/generative-ai/image/overview
     '''
 
-    def __init__(self, GCP_PROJECT_ID, GCP_REGION):
+    def __init__(self, GCP_PROJECT_ID, GCP_REGION, VERTEX_IMAGE_GENERATION_MODEL):
+        super().__init__()
         if GCP_PROJECT_ID=="":
             print(f'[ WARNING ] GCP_PROJECT_ID ENV variable is empty. Be sure to set the GCP_PROJECT_ID ENV variable.')
 
@@ -139,6 +521,21 @@ class Google_Cloud_Imagen:
 
         self.GCP_PROJECT_ID = GCP_PROJECT_ID
         self.GCP_REGION = GCP_REGION
+        self.VERTEX_IMAGE_GENERATION_MODEL = VERTEX_IMAGE_GENERATION_MODEL
+        self.pretrained_model = VERTEX_IMAGE_GENERATION_MODEL
+
+    def _load(self):
+        self._init_vertexai()
+
+        start = time.perf_counter()
+        from vertexai.preview.vision_models import ImageGenerationModel
+        self.model = ImageGenerationModel.from_pretrained(self.VERTEX_IMAGE_GENERATION_MODEL)
+        self._record('from_pretrained_s', start)
 
-        self.vertexai = vertexai.init(project=GCP_PROJECT_ID, location=GCP_REGION)
-        self.model = ImageGenerationModel.from_pretrained("imagegeneration@002")
+    async def generate_images_async(self, **kwargs):
+        '''
+        generate_images has no async variant, so it runs on the bounded
+        executor. This keeps the event loop, and /genai_health, responsive.
+        '''
+        async with self.concurrency:
+            return await self.retry.call(self.paced(self.run_in_executor), self.model.generate_images, **kwargs)
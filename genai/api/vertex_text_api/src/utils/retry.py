@@ -0,0 +1,199 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# This file is shared by the vertex_*_api services. Keep the copies identical.
+
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from fastapi.responses import JSONResponse
+
+
+# Status codes worth retrying: quota exhausted, unavailable and deadline exceeded
+RETRIABLE_STATUS_CODES = (429, 503, 504)
+
+
+class Vertex_Error(Exception):
+    '''A failed Vertex call, carrying the HTTP status code to return to the caller.'''
+
+    def __init__(self, status_code, message, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def status_code_of(e):
+    '''
+    The HTTP status code of an exception. google.api_core errors carry one
+    as .code; connection failures and timeouts are treated as 503 and 504.
+    '''
+    if isinstance(e, Vertex_Error):
+        return e.status_code
+    code = getattr(e, 'code', None)
+    if isinstance(code, int) and 400 <= code < 600:
+        return code
+    if isinstance(e, (asyncio.TimeoutError, TimeoutError)):
+        return 504
+    if isinstance(e, ConnectionError):
+        return 503
+    return 500
+
+
+def is_retriable(e):
+    return status_code_of(e) in RETRIABLE_STATUS_CODES
+
+
+class Retry_Budget:
+    '''
+    Caps retries at a fraction of recent requests, plus a small floor, so a
+    quota outage does not multiply the load on Vertex. Requests and retries
+    are counted over a sliding window of window_seconds.
+    '''
+
+    def __init__(self, ratio=0.1, min_per_second=1.0, window_seconds=10):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.window_seconds = window_seconds
+        self._requests = deque()
+        self._retries = deque()
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        with self._lock:
+            self._requests.append(time.monotonic())
+
+    def try_withdraw(self):
+        '''Returns True, and counts the retry, if the budget allows one more.'''
+        with self._lock:
+            now = time.monotonic()
+            for events in (self._requests, self._retries):
+                while events and events[0] < now - self.window_seconds:
+                    events.popleft()
+            allowed = self.min_per_second * self.window_seconds + self.ratio * len(self._requests)
+            if len(self._retries) >= allowed:
+                return False
+            self._retries.append(now)
+            return True
+
+
+class Retry_Policy:
+    '''
+    Retries transient Vertex errors with full-jitter exponential backoff,
+    within a per-process Retry_Budget. Anything that is not retried is
+    raised as a Vertex_Error with the status code to return.
+    '''
+
+    def __init__(self, max_attempts=4, base_delay=0.25, max_delay=8.0, budget=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget or Retry_Budget()
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def should_retry(self, e, attempt):
+        # A Vertex_Error was raised by this service, such as a full quota queue, not by Vertex
+        if isinstance(e, Vertex_Error) or not is_retriable(e) or attempt + 1 >= self.max_attempts:
+            return False
+        if not self.budget.try_withdraw():
+            logging.warning(f'Retry budget exhausted. Not retrying {type(e).__name__}: {e}')
+            return False
+        return True
+
+    def give_up(self, e):
+        if isinstance(e, Vertex_Error):
+            return e
+        status_code = status_code_of(e)
+        retry_after = max(1, round(self.max_delay / 2)) if status_code in RETRIABLE_STATUS_CODES else None
+        return Vertex_Error(status_code, str(e), retry_after=retry_after)
+
+    async def call(self, fn, *args, **kwargs):
+        '''Awaits fn(*args, **kwargs), retrying transient failures.'''
+        self.budget.record_request()
+        attempt = 0
+        while True:
+            try:
+                return await fn(*args, **kwargs)
+            except Exception as e:
+                if not self.should_retry(e, attempt):
+                    raise self.give_up(e) from e
+                delay = self.backoff(attempt)
+                logging.info(f'Retrying {type(e).__name__} in {delay:.2f}s (attempt {attempt + 1}). {e}')
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    def call_sync(self, fn, *args, **kwargs):
+        self.budget.record_request()
+        attempt = 0
+        while True:
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if not self.should_retry(e, attempt):
+                    raise self.give_up(e) from e
+                time.sleep(self.backoff(attempt))
+                attempt += 1
+
+    async def stream(self, open_stream):
+        '''
+        Iterates the async iterator returned by open_stream(), retrying
+        transient failures only until the first item has been yielded.
+        After that, part of the response has been sent and errors are raised.
+        '''
+        self.budget.record_request()
+        attempt = 0
+        while True:
+            started = False
+            items = None
+            try:
+                items = await open_stream()
+                async for item in items:
+                    started = True
+                    yield item
+                return
+            except Exception as e:
+                if started or not self.should_retry(e, attempt):
+                    raise self.give_up(e) from e
+            finally:
+                # Ends the underlying RPC when the consumer stops early
+                if items is not None and hasattr(items, 'aclose'):
+                    await items.aclose()
+            await asyncio.sleep(self.backoff(attempt))
+            attempt += 1
+
+
+def retry_policy_from_env():
+    return Retry_Policy(
+        max_attempts=int(os.environ.get('VERTEX_RETRY_MAX_ATTEMPTS', '4')),
+        base_delay=float(os.environ.get('VERTEX_RETRY_BASE_DELAY', '0.25')),
+        max_delay=float(os.environ.get('VERTEX_RETRY_MAX_DELAY', '8.0')),
+        budget=Retry_Budget(
+            ratio=float(os.environ.get('VERTEX_RETRY_BUDGET_RATIO', '0.1')),
+            min_per_second=float(os.environ.get('VERTEX_RETRY_BUDGET_MIN_PER_SECOND', '1.0')),
+        ),
+    )
+
+
+def error_response(e):
+    '''The JSON error response for an exception raised by a model call.'''
+    if not isinstance(e, Vertex_Error):
+        logging.exception(f'Unexpected error. {e}')
+        return JSONResponse(status_code=500, content={'status': 'error', 'error': str(e)})
+    headers = {'Retry-After': str(e.retry_after)} if e.retry_after else None
+    return JSONResponse(status_code=e.status_code, content={'status': 'error', 'error': str(e)}, headers=headers)
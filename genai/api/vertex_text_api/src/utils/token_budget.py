@@ -0,0 +1,186 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# This file is shared by vertex_text_api and vertex_gemini_api. Keep the copies identical.
+
+import os
+import re
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+PREFLIGHT_OFF = 'off'
+PREFLIGHT_REJECT = 'reject'
+PREFLIGHT_TRUNCATE = 'truncate'
+
+# Attempts at shrinking an over-budget prompt before giving up
+MAX_TRUNCATE_ATTEMPTS = 4
+
+
+class Token_Budget_Exceeded(Exception):
+
+    def __init__(self, report):
+        super().__init__(f'Request exceeds the token budget: {report}')
+        self.report = report
+
+
+# Published (input, output) token limits, by model name without its version
+MODEL_TOKEN_LIMITS = {
+    'text-bison': (8192, 1024),
+    'text-bison-32k': (32768, 8192),
+    'gemini-pro': (30720, 2048),
+    'gemini-1.0-pro': (30720, 2048),
+    'gemini-pro-vision': (12288, 4096),
+    'gemini-1.0-pro-vision': (12288, 4096),
+    'gemini-1.5-pro': (1048576, 8192),
+}
+
+
+def base_model_name(model_name):
+    '''The model name without its version: "text-bison@002" and "gemini-1.0-pro-002" give "text-bison" and "gemini-1.0-pro".'''
+    return re.sub(r'(@\w+|-\d{3})$', '', model_name)
+
+
+class Token_Limits:
+    '''
+    The (input, output) token limits of each model. A model is looked up by
+    its full name, then without its version; unknown models get the limits of
+    default_model.
+    '''
+
+    def __init__(self, default_model, limits=None):
+        self.default_model = default_model
+        self.limits = dict(MODEL_TOKEN_LIMITS, **(limits or {}))
+
+    def for_model(self, model_name):
+        for name in (model_name, base_model_name(model_name), self.default_model, base_model_name(self.default_model)):
+            if name in self.limits:
+                return self.limits[name]
+        raise KeyError(f'No token limits for {model_name!r}. Set them in VERTEX_TOKEN_LIMITS.')
+
+
+def token_limits_from_env(default_model):
+    '''
+    VERTEX_TOKEN_LIMITS adds or overrides limits, as comma separated
+    "model=input:output" entries, such as "text-bison@002=8192:2048".
+    VERTEX_MAX_INPUT_TOKENS and VERTEX_MAX_OUTPUT_TOKENS override the limits
+    of the default model.
+    '''
+    limits = {}
+    for entry in os.environ.get('VERTEX_TOKEN_LIMITS', '').split(','):
+        if entry.strip():
+            name, _, values = entry.partition('=')
+            max_input_tokens, _, max_output_tokens = values.partition(':')
+            limits[name.strip()] = (int(max_input_tokens), int(max_output_tokens))
+    token_limits = Token_Limits(default_model, limits)
+    max_input_tokens, max_output_tokens = token_limits.for_model(default_model)
+    token_limits.limits[default_model] = (
+        int(os.environ.get('VERTEX_MAX_INPUT_TOKENS', max_input_tokens)),
+        int(os.environ.get('VERTEX_MAX_OUTPUT_TOKENS', max_output_tokens)),
+    )
+    return token_limits
+
+
+def prompt_key(model_name, prompt, message_history=None, parts=None):
+    return hashlib.sha256(json.dumps([model_name, prompt, message_history or [], parts or []]).encode()).hexdigest()
+
+
+class Token_Counter:
+    '''
+    Counts prompt tokens with the model's count_tokens call, caching the
+    results in an LRU keyed by a hash of the model name, prompt, message
+    history and part references. count_fn is an async function
+    (model, prompt, message_history[, parts]) -> int; parts are only passed
+    when set. Models are told apart by their pretrained_model name.
+    '''
+
+    def __init__(self, count_fn, max_entries=10000):
+        self.count_fn = count_fn
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def count(self, model, prompt, message_history=None, parts=None):
+        key = prompt_key(model.pretrained_model, prompt, message_history, parts)
+        with self._lock:
+            if key in self._cache:
+                self.hits += 1
+                self._cache.move_to_end(key)
+                return self._cache[key]
+            self.misses += 1
+
+        if parts:
+            total_tokens = await self.count_fn(model, prompt, message_history, parts)
+        else:
+            total_tokens = await self.count_fn(model, prompt, message_history)
+
+        with self._lock:
+            self._cache[key] = total_tokens
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return total_tokens
+
+
+async def preflight(counter, model, request_payload, mode, max_input_tokens, max_output_tokens):
+    '''
+    Checks request_payload against model's token limits before it is sent.
+
+    With mode 'reject', an over-budget request raises Token_Budget_Exceeded.
+    With mode 'truncate', max_output_tokens is clamped to the model limit and
+    the end of the prompt is cut until it fits, keeping any message history.
+    Returns the (possibly modified) payload and a report of the counts.
+    '''
+    request_payload = dict(request_payload)
+    prompt = request_payload['prompt']
+    message_history = request_payload.get('message_history')
+    parts = request_payload.get('parts')
+    prompt_tokens = await counter.count(model, prompt, message_history, parts)
+
+    report = {
+        'prompt_tokens': prompt_tokens,
+        'max_input_tokens': max_input_tokens,
+        'requested_output_tokens': request_payload.get('max_output_tokens'),
+        'max_output_tokens': max_output_tokens,
+        'truncated': False,
+    }
+
+    over_output = (request_payload.get('max_output_tokens') or 0) > max_output_tokens
+    if mode == PREFLIGHT_REJECT:
+        if prompt_tokens > max_input_tokens or over_output:
+            raise Token_Budget_Exceeded(report)
+        return request_payload, report
+
+    if over_output:
+        request_payload['max_output_tokens'] = max_output_tokens
+        report['truncated'] = True
+
+    for _ in range(MAX_TRUNCATE_ATTEMPTS):
+        if prompt_tokens <= max_input_tokens:
+            break
+        # Tokens are roughly proportional to characters; aim a little under the limit.
+        prompt = prompt[:int(len(prompt) * max_input_tokens / prompt_tokens * 0.95)]
+        prompt_tokens = await counter.count(model, prompt, message_history, parts)
+        report['truncated'] = True
+
+    report['prompt_tokens'] = prompt_tokens
+    if prompt_tokens > max_input_tokens:
+        raise Token_Budget_Exceeded(report)
+
+    request_payload['prompt'] = prompt
+    return request_payload, report
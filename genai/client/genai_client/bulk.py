@@ -0,0 +1,305 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Runs a JSONL file of GenAI API requests with bounded concurrency and a rate
+limit, writing each result as soon as it completes. The results file is the
+checkpoint: a rerun with the same output skips ids that already succeeded.
+
+    python -m genai_client.bulk --target http://genai-api.genai.svc --input lore.jsonl --output lore_out/ --concurrency 16 --rate 5
+
+Each input line is {"id": ..., "type": ..., "payload": {...}}, where type is
+text, chat, code, code_chat, gemini or image, and payload is the body of that
+gateway route. Text results are stored in the results file; images are
+written to files next to it, and the results file records their path.
+'''
+
+import os
+import sys
+import json
+import math
+import time
+import asyncio
+import hashlib
+import logging
+import argparse
+from typing import Any, Dict, Iterator, Optional, Set
+
+from .client import GenAI_Client, GenAI_Client_Error
+
+
+logger = logging.getLogger('genai-bulk')
+
+ROUTES = {
+    'text': '/genai/text',
+    'chat': '/genai/chat',
+    'code': '/genai/code',
+    'code_chat': '/genai/code/chat',
+    'gemini': '/genai',
+    'image': '/genai/image',
+}
+
+IMAGE_EXTENSIONS = {'image/png': '.png', 'image/jpeg': '.jpg', 'image/webp': '.webp', 'application/zip': '.zip'}
+
+
+class Rate_Limiter:
+    '''Spaces calls at least 1/rate seconds apart. A rate of 0 or less is unlimited.'''
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class Output:
+    '''
+    Where results go. A path ending in .jsonl is the results file, with images
+    in a sibling "<name>_images" directory. Any other path is a directory
+    holding results.jsonl and images/.
+    '''
+
+    def __init__(self, path: str):
+        if path.endswith('.jsonl'):
+            self.results_path = path
+            self.image_dir = os.path.splitext(path)[0] + '_images'
+        else:
+            self.results_path = os.path.join(path, 'results.jsonl')
+            self.image_dir = os.path.join(path, 'images')
+        os.makedirs(os.path.dirname(os.path.abspath(self.results_path)), exist_ok=True)
+        self._file = None
+
+    def completed_ids(self) -> Set[str]:
+        '''Ids that already succeeded. A torn last line, left by a crash mid-write, is ignored.'''
+        completed = set()
+        try:
+            with open(self.results_path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record.get('status') == 'ok':
+                        completed.add(record['id'])
+        except FileNotFoundError:
+            pass
+        return completed
+
+    def write_image(self, item_id: str, data: bytes, media_type: str) -> str:
+        # Written to a temporary file and renamed, so a listed image is never partial
+        os.makedirs(self.image_dir, exist_ok=True)
+        path = os.path.join(self.image_dir, safe_file_name(item_id) + IMAGE_EXTENSIONS.get(media_type, '.bin'))
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return path
+
+    def append(self, record: Dict[str, Any]):
+        if self._file is None:
+            self._file = open(self.results_path, 'a')
+            # A crash can leave a torn last line; start on a new line after it
+            if self._file.tell() > 0:
+                with open(self.results_path, 'rb') as f:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':
+                        self._file.write('\n')
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+
+
+class Progress:
+    '''Counts results and reports throughput.'''
+
+    def __init__(self, total: int, skipped: int):
+        self.total = total
+        self.skipped = skipped
+        self.ok = 0
+        self.errors = 0
+        self.latencies = []
+        self.start = time.perf_counter()
+
+    def record(self, ok: bool, latency: float):
+        if ok:
+            self.ok += 1
+        else:
+            self.errors += 1
+        self.latencies.append(latency)
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = time.perf_counter() - self.start
+        done = self.ok + self.errors
+        remaining = self.total - self.skipped - done
+        latencies = sorted(self.latencies)
+        rate = done / elapsed if elapsed > 0 else 0.0
+        return {
+            'total': self.total,
+            'skipped': self.skipped,
+            'done': done,
+            'ok': self.ok,
+            'errors': self.errors,
+            'elapsed_s': round(elapsed, 1),
+            'throughput_rps': round(rate, 3),
+            'eta_s': round(remaining / rate, 1) if rate > 0 else None,
+            'latency_s': {
+                'p50': round(percentile(latencies, 50), 3),
+                'p90': round(percentile(latencies, 90), 3),
+                'p99': round(percentile(latencies, 99), 3),
+            },
+        }
+
+
+def percentile(sorted_values, pct):
+    '''Nearest-rank percentile of an already sorted list.'''
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def safe_file_name(item_id: str) -> str:
+    '''
+    A file name for an item id. Replacing characters can map different ids to
+    the same name ("a/b" and "a_b"), so a hash of the raw id is appended. Leading
+    dots are dropped, so "." and ".." are not special or hidden names.
+    '''
+    sanitized = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in item_id).lstrip('.')[:100]
+    digest = hashlib.sha256(item_id.encode()).hexdigest()[:8]
+    return f'{sanitized}-{digest}' if sanitized else digest
+
+
+def read_items(path: str) -> Iterator[Dict[str, Any]]:
+    '''Yields the input items. Items without an id get their line number, which is stable as long as the file is.'''
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            item['id'] = str(item.get('id', f'line-{line_number}'))
+            if item.get('type') not in ROUTES:
+                raise ValueError(f'{path}:{line_number}: type must be one of {sorted(ROUTES)}, not {item.get("type")!r}')
+            yield item
+
+
+async def run_item(client: GenAI_Client, output: Output, item: Dict[str, Any]) -> Dict[str, Any]:
+    record = {'id': item['id'], 'type': item['type']}
+    start = time.perf_counter()
+    try:
+        resp = await client.request(ROUTES[item['type']], item.get('payload', {}))
+        media_type = resp.headers.get('content-type', '').split(';')[0]
+        # An image, or a zip of every image when the payload asks for response_format "zip"
+        if media_type.startswith('image/') or media_type == 'application/zip':
+            record['path'] = output.write_image(item['id'], resp.content, media_type)
+        else:
+            record['result'] = resp.json()
+        record['status'] = 'ok'
+    except GenAI_Client_Error as e:
+        record.update(status='error', status_code=e.status_code, error=e.body[:1000])
+    except Exception as e:
+        record.update(status='error', error=f'{type(e).__name__}: {e}')
+    record['latency_s'] = round(time.perf_counter() - start, 3)
+    return record
+
+
+async def run_bulk(
+    client: GenAI_Client,
+    input_path: str,
+    output_path: str,
+    concurrency: int = 16,
+    rate: float = 0.0,
+    report_every: float = 30.0,
+    limit: Optional[int] = None,
+) -> Dict[str, Any]:
+    '''Runs every item of input_path that has not yet succeeded in output_path, and returns the final summary.'''
+    output = Output(output_path)
+    completed = output.completed_ids()
+    items = list(read_items(input_path))
+    if limit:
+        items = items[:limit]
+    pending = [item for item in items if item['id'] not in completed]
+    progress = Progress(total=len(items), skipped=len(items) - len(pending))
+    if progress.skipped:
+        logger.info(f'Resuming: {progress.skipped} of {len(items)} items already succeeded')
+
+    limiter = Rate_Limiter(rate)
+    queue = asyncio.Queue()
+    for item in pending:
+        queue.put_nowait(item)
+
+    async def worker():
+        while True:
+            try:
+                item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await limiter.wait()
+            record = await run_item(client, output, item)
+            output.append(record)
+            progress.record(record['status'] == 'ok', record['latency_s'])
+
+    async def reporter():
+        while True:
+            await asyncio.sleep(report_every)
+            logger.info(json.dumps(progress.summary()))
+
+    reporting = asyncio.create_task(reporter())
+    try:
+        await asyncio.gather(*[worker() for _ in range(max(1, concurrency))])
+    finally:
+        reporting.cancel()
+        output.close()
+    return progress.summary()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a JSONL file of GenAI API requests, with checkpointing and resume.')
+    parser.add_argument('--target', required=True, help='Base URL of the GenAI API, such as http://genai-api.genai.svc')
+    parser.add_argument('--input', required=True, help='JSONL file of {"id", "type", "payload"} requests')
+    parser.add_argument('--output', required=True, help='Results JSONL file, or a directory for results.jsonl and images/')
+    parser.add_argument('--concurrency', type=int, default=16, help='Maximum number of requests in flight')
+    parser.add_argument('--rate', type=float, default=0.0, help='Maximum requests per second. 0 is unlimited')
+    parser.add_argument('--timeout', type=float, default=300.0, help='Per-request timeout in seconds')
+    parser.add_argument('--report-every', type=float, default=30.0, help='Seconds between progress reports')
+    parser.add_argument('--limit', type=int, default=None, help='Only run the first N items of the input')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout, format='%(asctime)s - %(name)s - %(message)s')
+
+    async def run():
+        async with GenAI_Client(args.target, max_concurrency=args.concurrency, timeout=args.timeout) as client:
+            return await run_bulk(client, args.input, args.output, args.concurrency, args.rate, args.report_every, args.limit)
+
+    summary = asyncio.run(run())
+    logger.info(json.dumps(summary, indent=2))
+    return 0 if summary['errors'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
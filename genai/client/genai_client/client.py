@@ -0,0 +1,636 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import json
+import base64
+import random
+import hashlib
+import zipfile
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+
+
+logger = logging.getLogger('genai-client')
+
+RETRIABLE_STATUS_CODES = (429, 503)
+
+
+class GenAI_Client_Error(Exception):
+    '''Raised when the gateway returns a non-2xx response after all retries.'''
+
+    def __init__(self, status_code: int, body: str):
+        super().__init__(f'GenAI API returned {status_code}: {body[:200]}')
+        self.status_code = status_code
+        self.body = body
+
+
+class GenAI_Client:
+    '''
+    Async client for the GenAI API gateway (genai_api).
+
+    A single client holds a pooled HTTP/1.1 connection set and should be shared
+    across tasks. Use it as an async context manager, or call aclose() when done.
+
+        async with GenAI_Client('http://genai-api.genai.svc') as client:
+            text = await client.text('Describe the final level')
+    '''
+
+    def __init__(
+        self,
+        base_url: str,
+        max_concurrency: int = 64,
+        timeout: float = 120.0,
+        connect_timeout: float = 5.0,
+        max_retries: int = 4,
+        backoff_base: float = 0.25,
+        backoff_max: float = 8.0,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._http = httpx.AsyncClient(
+            base_url=base_url.rstrip('/'),
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+            transport=transport,
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        await self._http.aclose()
+
+    # Routes
+
+    async def gemini(
+        self,
+        prompt: str,
+        max_output_tokens: int = 1024,
+        temperature: float = 0.4,
+        top_p: float = 0.8,
+        top_k: int = 40,
+        stop_sequences: Optional[List[str]] = None,
+        safety_settings: Optional[Dict[str, Any]] = None,
+        message_history: Optional[List[Dict[str, str]]] = None,
+        parts: Optional[List[Dict[str, str]]] = None,
+        preflight: str = 'off',
+        model: Optional[str] = None,
+    ) -> Any:
+        payload = {
+            'prompt': prompt,
+            'max_output_tokens': max_output_tokens,
+            'temperature': temperature,
+            'top_p': top_p,
+            'top_k': top_k,
+            'stop_sequences': stop_sequences,
+            'safety_settings': safety_settings,
+            'message_history': message_history or [],
+            'parts': parts or [],
+            'preflight': preflight,
+            'model': model,
+        }
+        return (await self.request('/genai', payload)).json()
+
+    async def gemini_count_tokens(
+        self,
+        prompt: str,
+        message_history: Optional[List[Dict[str, str]]] = None,
+        parts: Optional[List[Dict[str, str]]] = None,
+        model: Optional[str] = None,
+    ) -> int:
+        payload = {
+            'prompt': prompt,
+            'message_history': message_history or [],
+            'parts': parts or [],
+            'model': model,
+        }
+        return (await self.request('/genai/count_tokens', payload)).json()['total_tokens']
+
+    async def gemini_stream(
+        self,
+        prompt: str,
+        max_output_tokens: int = 1024,
+        temperature: float = 0.4,
+        top_p: float = 0.8,
+        top_k: int = 40,
+        stop_sequences: Optional[List[str]] = None,
+        safety_settings: Optional[Dict[str, Any]] = None,
+        message_history: Optional[List[Dict[str, str]]] = None,
+        parts: Optional[List[Dict[str, str]]] = None,
+        preflight: str = 'off',
+        model: Optional[str] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        '''
+        Yields {"text", "safety_ratings", "finish_reason"} for each chunk, then
+        a final {"usage": {...}} event with the token counts for the request.
+        '''
+        payload = {
+            'prompt': prompt,
+            'max_output_tokens': max_output_tokens,
+            'temperature': temperature,
+            'top_p': top_p,
+            'top_k': top_k,
+            'stop_sequences': stop_sequences,
+            'safety_settings': safety_settings,
+            'message_history': message_history or [],
+            'parts': parts or [],
+            'preflight': preflight,
+            'model': model,
+        }
+        async for event in self.stream('/genai/stream', payload):
+            if event == '[DONE]':
+                return
+            if isinstance(event, dict) and 'error' in event:
+                raise _stream_error(event)
+            yield event
+
+    async def upload_part(self, data: bytes, mime_type: str) -> Dict[str, str]:
+        '''Uploads an image or document once, returning {"hash": ...} to reference it in later Gemini requests.'''
+        payload = {'data': base64.b64encode(data).decode(), 'mime_type': mime_type}
+        return {'hash': (await self.request('/genai/parts', payload)).json()['hash']}
+
+    @staticmethod
+    def inline_part(data: bytes, mime_type: str) -> Dict[str, str]:
+        return {'data': base64.b64encode(data).decode(), 'mime_type': mime_type}
+
+    @staticmethod
+    def part_ref(data: bytes) -> Dict[str, str]:
+        '''References a part by the sha256 of its bytes, without uploading it.'''
+        return {'hash': hashlib.sha256(data).hexdigest()}
+
+    async def text(
+        self,
+        prompt: str,
+        max_output_tokens: int = 1024,
+        temperature: float = 0.2,
+        top_p: float = 0.8,
+        top_k: int = 40,
+        preflight: str = 'off',
+        model: Optional[str] = None,
+    ) -> Any:
+        payload = {
+            'prompt': prompt,
+            'max_output_tokens': max_output_tokens,
+            'temperature': temperature,
+            'top_p': top_p,
+            'top_k': top_k,
+            'preflight': preflight,
+            'model': model,
+        }
+        return (await self.request('/genai/text', payload)).json()
+
+    async def text_batch(
+        self,
+        items: List[Dict[str, Any]],
+        max_output_tokens: int = 1024,
+        temperature: float = 0.2,
+        top_p: float = 0.8,
+        top_k: int = 40,
+        preflight: str = 'off',
+        max_concurrency: Optional[int] = None,
+        model: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        '''
+        Runs many text prompts in a single request to the server-side batch route.
+        Each item is {"prompt": ...}, optionally with its own generation parameters.
+        Returns a {"text": ...} or {"error": ...} result per item, in order.
+        '''
+        payload = {
+            'items': items,
+            'max_output_tokens': max_output_tokens,
+            'temperature': temperature,
+            'top_p': top_p,
+            'top_k': top_k,
+            'preflight': preflight,
+            'max_concurrency': max_concurrency,
+            'model': model,
+        }
+        return (await self.request('/genai/text/batch', payload)).json()['results']
+
+    async def text_count_tokens(self, prompt: str, model: Optional[str] = None) -> int:
+        return (await self.request('/genai/text/count_tokens', {'prompt': prompt, 'model': model})).json()['total_tokens']
+
+    async def chat(
+        self,
+        prompt: str,
+        conversation_id: Optional[str] = None,
+        context: str = '',
+        message_history: Optional[List[Dict[str, str]]] = None,
+        max_output_tokens: int = 1024,
+        temperature: float = 0.2,
+        top_p: float = 0.8,
+        top_k: int = 40,
+        model: Optional[str] = None,
+    ) -> Any:
+        payload = {
+            'prompt': prompt,
+            'conversation_id': conversation_id,
+            'context': context,
+            'message_history': message_history or [],
+            'max_output_tokens': max_output_tokens,
+            'temperature': temperature,
+            'top_p': top_p,
+            'top_k': top_k,
+            'model': model,
+        }
+        return (await self.request('/genai/chat', payload)).json()
+
+    async def code(self, prompt: str, max_output_tokens: int = 1024, temperature: float = 0.2, top_p: float = 0.8, top_k: int = 40, model: Optional[str] = None) -> Any:
+        payload = {
+            'prompt': prompt,
+            'max_output_tokens': max_output_tokens,
+            'temperature': temperature,
+            'top_p': top_p,
+            'top_k': top_k,
+            'model': model,
+        }
+        return (await self.request('/genai/code', payload)).json()
+
+    async def code_chat(
+        self,
+        prompt: str,
+        conversation_id: Optional[str] = None,
+        context: str = '',
+        message_history: Optional[List[Dict[str, str]]] = None,
+        max_output_tokens: int = 1024,
+        temperature: float = 0.2,
+        model: Optional[str] = None,
+    ) -> Any:
+        payload = {
+            'prompt': prompt,
+            'conversation_id': conversation_id,
+            'context': context,
+            'message_history': message_history or [],
+            'max_output_tokens': max_output_tokens,
+            'temperature': temperature,
+            'model': model,
+        }
+        return (await self.request('/genai/code/chat', payload)).json()
+
+    async def code_complete(
+        self,
+        session_id: str,
+        prefix: str,
+        suffix: str = '',
+        seq: Optional[int] = None,
+        max_output_tokens: int = 64,
+        temperature: float = 0.2,
+        model: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        '''
+        Completes code at the cursor for an editor session. Returns
+        {"completion", "cached", "superseded", "seq"}; a superseded result
+        has no completion, because a newer request for the session replaced it.
+        '''
+        payload = {
+            'session_id': session_id,
+            'prefix': prefix,
+            'suffix': suffix,
+            'seq': seq,
+            'max_output_tokens': max_output_tokens,
+            'temperature': temperature,
+            'model': model,
+        }
+        return (await self.request('/genai/code/complete', payload)).json()
+
+    async def image(
+        self,
+        prompt: str,
+        number_of_images: int = 1,
+        seed: Optional[int] = None,
+        model: Optional[str] = None,
+        format: str = 'png',
+        quality: Optional[int] = None,
+        max_dim: Optional[int] = None,
+    ) -> bytes:
+        '''
+        The first generated image. format is png, webp or jpeg, and max_dim
+        shrinks it to fit in max_dim x max_dim, so a preview such as
+        format='webp', max_dim=256 is a small fraction of the full PNG.
+        '''
+        payload = {
+            'prompt': prompt,
+            'number_of_images': number_of_images,
+            'seed': seed,
+            'model': model,
+            'format': format,
+            'quality': quality,
+            'max_dim': max_dim,
+        }
+        return (await self.request('/genai/image', payload)).content
+
+    async def images(
+        self,
+        prompt: str,
+        number_of_images: int = 4,
+        seed: Optional[int] = None,
+        model: Optional[str] = None,
+        format: str = 'png',
+        quality: Optional[int] = None,
+        max_dim: Optional[int] = None,
+    ) -> List[bytes]:
+        '''Every image of one generation, from a single request.'''
+        payload = {
+            'prompt': prompt,
+            'number_of_images': number_of_images,
+            'seed': seed,
+            'model': model,
+            'response_format': 'zip',
+            'format': format,
+            'quality': quality,
+            'max_dim': max_dim,
+        }
+        archive = zipfile.ZipFile(io.BytesIO((await self.request('/genai/image', payload)).content))
+        return [archive.read(name) for name in archive.namelist()]
+
+    async def submit_image_job(
+        self,
+        prompt: str,
+        number_of_images: int = 1,
+        seed: Optional[int] = None,
+        callback_url: Optional[str] = None,
+        model: Optional[str] = None,
+        format: str = 'png',
+        quality: Optional[int] = None,
+        max_dim: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        payload = {
+            'prompt': prompt,
+            'number_of_images': number_of_images,
+            'seed': seed,
+            'callback_url': callback_url,
+            'model': model,
+            'format': format,
+            'quality': quality,
+            'max_dim': max_dim,
+        }
+        return (await self.request('/genai/image/jobs', payload)).json()
+
+    async def image_job(self, job_id: str) -> Dict[str, Any]:
+        return (await self.request(f'/genai/image/jobs/{job_id}', method='GET')).json()
+
+    async def image_job_result(self, job_id: str) -> bytes:
+        return (await self.request(f'/genai/image/jobs/{job_id}/image', method='GET')).content
+
+    async def image_via_job(
+        self,
+        prompt: str,
+        number_of_images: int = 1,
+        seed: Optional[int] = None,
+        poll_interval: float = 1.0,
+        timeout: float = 300.0,
+        model: Optional[str] = None,
+    ) -> bytes:
+        '''Submits an image job, polls it until it finishes and returns the image.'''
+        job = await self.submit_image_job(prompt, number_of_images=number_of_images, seed=seed, model=model)
+        deadline = asyncio.get_running_loop().time() + timeout
+        while job['status'] not in ('succeeded', 'failed'):
+            if asyncio.get_running_loop().time() > deadline:
+                raise TimeoutError(f'image job {job["job_id"]} did not finish within {timeout}s')
+            await asyncio.sleep(poll_interval)
+            job = await self.image_job(job['job_id'])
+        if job['status'] == 'failed':
+            raise GenAI_Client_Error(500, job.get('error') or 'image job failed')
+        return await self.image_job_result(job['job_id'])
+
+    async def npc_chat(self, message: str, from_id: int, to_id: int, debug: bool = False) -> Dict[str, Any]:
+        payload = {
+            'message': message,
+            'from_id': from_id,
+            'to_id': to_id,
+            'debug': debug,
+        }
+        return (await self.request('/genai/npc_chat', payload)).json()
+
+    async def reset_world_data(self) -> Dict[str, Any]:
+        return (await self.request('/genai/npc_chat/reset_world_data')).json()
+
+    # Batching and streaming
+
+    async def batch(self, route: str, payloads: List[Dict[str, Any]], return_exceptions: bool = True) -> List[Any]:
+        '''
+        Sends every payload to the same route concurrently, bounded by the
+        client's max_concurrency. Results are returned in the order of payloads;
+        with return_exceptions, failed items are returned as exceptions instead
+        of failing the whole batch.
+        '''
+        async def _one(payload):
+            resp = await self.request(route, payload)
+            if resp.headers.get('content-type', '').startswith('application/json'):
+                return resp.json()
+            return resp.content
+
+        return await asyncio.gather(*[_one(p) for p in payloads], return_exceptions=return_exceptions)
+
+    async def stream(self, route: str, payload: Optional[Dict[str, Any]] = None) -> AsyncIterator[Any]:
+        '''
+        Streams a server-sent event (text/event-stream) or newline-delimited JSON
+        (application/x-ndjson) response, yielding each event as it arrives. JSON
+        event data is decoded, anything else is yielded as a string.
+
+        Until the response starts, 429/503 responses and connection failures
+        are retried like request() retries them. Once an event has been
+        yielded, nothing is retried.
+        '''
+        attempt = 0
+        while True:
+            async with self._semaphore:
+                try:
+                    async with self._http.stream('POST', route, json=payload) as resp:
+                        if resp.status_code >= 400:
+                            body = (await resp.aread()).decode(errors='replace')
+                            if resp.status_code not in RETRIABLE_STATUS_CODES or attempt >= self.max_retries:
+                                raise GenAI_Client_Error(resp.status_code, body)
+                            delay = self._backoff(attempt, resp)
+                        else:
+                            if resp.headers.get('content-type', '').startswith('text/event-stream'):
+                                async for event in _iter_sse(resp.aiter_lines()):
+                                    yield event
+                            else:
+                                async for line in resp.aiter_lines():
+                                    if line.strip():
+                                        yield _decode(line)
+                            return
+                except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                    # Raised before the response starts, so nothing was yielded
+                    if attempt >= self.max_retries:
+                        raise
+                    logger.debug(f'Connection to {route} failed, retrying. {e}')
+                    delay = self._backoff(attempt, None)
+
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def text_stream(
+        self,
+        prompt: str,
+        max_output_tokens: int = 1024,
+        temperature: float = 0.2,
+        top_p: float = 0.8,
+        top_k: int = 40,
+        preflight: str = 'off',
+        model: Optional[str] = None,
+    ) -> AsyncIterator[str]:
+        payload = {
+            'prompt': prompt,
+            'max_output_tokens': max_output_tokens,
+            'temperature': temperature,
+            'top_p': top_p,
+            'top_k': top_k,
+            'preflight': preflight,
+            'model': model,
+        }
+        async for text in self._stream_text('/genai/text/stream', payload):
+            yield text
+
+    async def chat_stream(
+        self,
+        prompt: str,
+        conversation_id: Optional[str] = None,
+        context: str = '',
+        message_history: Optional[List[Dict[str, str]]] = None,
+        max_output_tokens: int = 1024,
+        temperature: float = 0.2,
+        top_p: float = 0.8,
+        top_k: int = 40,
+        model: Optional[str] = None,
+    ) -> AsyncIterator[str]:
+        payload = {
+            'prompt': prompt,
+            'conversation_id': conversation_id,
+            'context': context,
+            'message_history': message_history or [],
+            'max_output_tokens': max_output_tokens,
+            'temperature': temperature,
+            'top_p': top_p,
+            'top_k': top_k,
+            'model': model,
+        }
+        async for text in self._stream_text('/genai/chat/stream', payload):
+            yield text
+
+    async def code_stream(self, prompt: str, max_output_tokens: int = 1024, temperature: float = 0.2, top_p: float = 0.8, top_k: int = 40, model: Optional[str] = None) -> AsyncIterator[str]:
+        payload = {
+            'prompt': prompt,
+            'max_output_tokens': max_output_tokens,
+            'temperature': temperature,
+            'top_p': top_p,
+            'top_k': top_k,
+            'model': model,
+        }
+        async for text in self._stream_text('/genai/code/stream', payload):
+            yield text
+
+    async def code_chat_stream(
+        self,
+        prompt: str,
+        conversation_id: Optional[str] = None,
+        context: str = '',
+        message_history: Optional[List[Dict[str, str]]] = None,
+        max_output_tokens: int = 1024,
+        temperature: float = 0.2,
+        model: Optional[str] = None,
+    ) -> AsyncIterator[str]:
+        payload = {
+            'prompt': prompt,
+            'conversation_id': conversation_id,
+            'context': context,
+            'message_history': message_history or [],
+            'max_output_tokens': max_output_tokens,
+            'temperature': temperature,
+            'model': model,
+        }
+        async for text in self._stream_text('/genai/code/chat/stream', payload):
+            yield text
+
+    async def _stream_text(self, route: str, payload: Dict[str, Any]) -> AsyncIterator[str]:
+        '''Yields the text of each {"text": ...} event until [DONE]. An error event is raised.'''
+        async for event in self.stream(route, payload):
+            if event == '[DONE]':
+                return
+            if isinstance(event, dict) and 'error' in event:
+                raise _stream_error(event)
+            if isinstance(event, dict) and 'text' in event:
+                yield event['text']
+
+    # Transport
+
+    async def request(self, route: str, payload: Optional[Dict[str, Any]] = None, method: str = 'POST') -> httpx.Response:
+        '''
+        Sends a request, retrying 429/503 responses and connection failures with
+        full-jitter exponential backoff. Retry-After is honoured when present.
+        '''
+        attempt = 0
+        while True:
+            async with self._semaphore:
+                try:
+                    resp = await self._http.request(method, route, json=payload)
+                except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                    if attempt >= self.max_retries:
+                        raise
+                    logger.debug(f'Connection to {route} failed, retrying. {e}')
+                    resp = None
+
+            if resp is not None:
+                if resp.status_code < 400:
+                    return resp
+                if resp.status_code not in RETRIABLE_STATUS_CODES or attempt >= self.max_retries:
+                    raise GenAI_Client_Error(resp.status_code, resp.text)
+
+            await asyncio.sleep(self._backoff(attempt, resp))
+            attempt += 1
+
+    def _backoff(self, attempt: int, resp: Optional[httpx.Response]) -> float:
+        retry_after = resp.headers.get('retry-after') if resp is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+
+def _stream_error(event: Dict[str, Any]) -> GenAI_Client_Error:
+    '''The error for an "error" event, with the status code the service gave it, or 502.'''
+    return GenAI_Client_Error(event.get('status_code') or 502, str(event['error']))
+
+
+async def _iter_sse(lines: AsyncIterator[str]) -> AsyncIterator[Any]:
+    data = []
+    async for line in lines:
+        if line == '':
+            if data:
+                yield _decode('\n'.join(data))
+                data = []
+        elif line.startswith('data:'):
+            data.append(line[5:].lstrip(' '))
+    if data:
+        yield _decode('\n'.join(data))
+
+
+def _decode(data: str) -> Any:
+    try:
+        return json.loads(data)
+    except ValueError:
+        return data
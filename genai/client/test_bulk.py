@@ -0,0 +1,84 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pytest -s -W ignore
+
+import json
+import asyncio
+import httpx
+from genai_client import GenAI_Client
+from genai_client.bulk import run_bulk, safe_file_name
+
+
+def make_client(handler):
+    return GenAI_Client('http://genai-api', transport=httpx.MockTransport(handler), backoff_base=0.001, max_retries=0)
+
+
+def write_input(path, items):
+    path.write_text(''.join(json.dumps(item) + '\n' for item in items))
+
+
+def test_bulk_writes_results_and_resumes(tmp_path):
+    calls = []
+    failing = {'sword'}
+
+    def handler(request):
+        prompt = json.loads(request.content)['prompt']
+        calls.append(prompt)
+        if request.url.path == '/genai/image':
+            return httpx.Response(200, content=b'png', headers={'content-type': 'image/png'})
+        if prompt in failing:
+            return httpx.Response(500, text='internal error')
+        return httpx.Response(200, json=f'lore for {prompt}')
+
+    input_path = tmp_path / 'items.jsonl'
+    write_input(input_path, [
+        {'id': 'shield', 'type': 'text', 'payload': {'prompt': 'shield'}},
+        {'id': 'sword', 'type': 'text', 'payload': {'prompt': 'sword'}},
+        {'id': 'castle/1', 'type': 'image', 'payload': {'prompt': 'castle'}},
+    ])
+    output_dir = tmp_path / 'out'
+
+    async def run():
+        async with make_client(handler) as client:
+            return await run_bulk(client, str(input_path), str(output_dir), concurrency=2, rate=1000)
+
+    summary = asyncio.run(run())
+    assert (summary['ok'], summary['errors']) == (2, 1)
+    records = {r['id']: r for r in map(json.loads, (output_dir / 'results.jsonl').read_text().splitlines())}
+    assert records['shield']['result'] == 'lore for shield'
+    assert records['sword']['status_code'] == 500
+    assert records['castle/1']['path'] == str(output_dir / 'images' / f'{safe_file_name("castle/1")}.png')
+    assert (output_dir / 'images' / f'{safe_file_name("castle/1")}.png').read_bytes() == b'png'
+
+    # Simulate a crash mid-write, then rerun: only the failed item is sent again
+    with open(output_dir / 'results.jsonl', 'a') as f:
+        f.write('{"id": "torn')
+    failing.clear()
+    calls.clear()
+    summary = asyncio.run(run())
+    assert calls == ['sword']
+    assert (summary['skipped'], summary['ok']) == (2, 1)
+    lines = (output_dir / 'results.jsonl').read_text().splitlines()
+    assert json.loads(lines[-1]) == {**json.loads(lines[-1]), 'id': 'sword', 'status': 'ok'}
+
+
+def test_file_names_do_not_collide():
+    ids = ['a/b', 'a_b', 'a:b', 'a?b', '.', '..', '', 'castle/1']
+    names = [safe_file_name(item_id) for item_id in ids]
+    assert len(set(names)) == len(ids)
+    assert all(name and not name.startswith('.') and '/' not in name for name in names)
+    assert safe_file_name('castle/1').startswith('castle_1-')
+    # Names are stable, so a rerun finds the same files
+    assert names == [safe_file_name(item_id) for item_id in ids]
@@ -0,0 +1,216 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pytest -s -W ignore
+
+import io
+import json
+import asyncio
+import zipfile
+import httpx
+import pytest
+from genai_client import GenAI_Client, GenAI_Client_Error
+
+
+def make_client(handler, **kwargs):
+    return GenAI_Client('http://genai-api', transport=httpx.MockTransport(handler), backoff_base=0.001, **kwargs)
+
+
+def test_text():
+
+    def handler(request):
+        assert request.url.path == '/genai/text'
+        assert json.loads(request.content)['prompt'] == 'test prompt'
+        return httpx.Response(200, json='mocked text')
+
+    async def run():
+        async with make_client(handler) as client:
+            return await client.text('test prompt')
+
+    assert asyncio.run(run()) == 'mocked text'
+
+
+def test_retries_on_429_then_succeeds():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        if len(calls) < 3:
+            return httpx.Response(429, text='quota exceeded')
+        return httpx.Response(200, json='mocked code')
+
+    async def run():
+        async with make_client(handler) as client:
+            return await client.code('test prompt')
+
+    assert asyncio.run(run()) == 'mocked code'
+    assert len(calls) == 3
+
+
+def test_non_retriable_error_is_raised():
+
+    def handler(request):
+        return httpx.Response(400, text='bad request')
+
+    async def run():
+        async with make_client(handler) as client:
+            await client.chat('test prompt')
+
+    with pytest.raises(GenAI_Client_Error) as e:
+        asyncio.run(run())
+    assert e.value.status_code == 400
+
+
+def test_batch_keeps_order_and_isolates_errors():
+
+    def handler(request):
+        prompt = json.loads(request.content)['prompt']
+        if prompt == 'bad':
+            return httpx.Response(400, text='bad request')
+        return httpx.Response(200, json=prompt.upper())
+
+    async def run():
+        async with make_client(handler, max_concurrency=2) as client:
+            return await client.batch('/genai/text', [{'prompt': 'a'}, {'prompt': 'bad'}, {'prompt': 'c'}])
+
+    results = asyncio.run(run())
+    assert results[0] == 'A'
+    assert isinstance(results[1], GenAI_Client_Error)
+    assert results[2] == 'C'
+
+
+def test_stream_sse_and_ndjson():
+
+    def handler(request):
+        if request.url.path == '/sse':
+            body = 'data: {"text": "Hel"}\n\ndata: {"text": "lo"}\n\ndata: [DONE]\n\n'
+            return httpx.Response(200, text=body, headers={'content-type': 'text/event-stream'})
+        body = '{"text": "a"}\n{"text": "b"}\n'
+        return httpx.Response(200, text=body, headers={'content-type': 'application/x-ndjson'})
+
+    async def run():
+        async with make_client(handler) as client:
+            sse = [event async for event in client.stream('/sse', {'prompt': 'x'})]
+            ndjson = [event async for event in client.stream('/ndjson', {'prompt': 'x'})]
+            return sse, ndjson
+
+    sse, ndjson = asyncio.run(run())
+    assert sse == [{'text': 'Hel'}, {'text': 'lo'}, '[DONE]']
+    assert ndjson == [{'text': 'a'}, {'text': 'b'}]
+
+
+def test_text_stream_yields_text_and_raises_error_events():
+
+    def handler(request):
+        body = 'data: {"text": "Hel"}\n\ndata: {"text": "lo"}\n\n'
+        prompt = json.loads(request.content)['prompt']
+        if prompt == 'fail':
+            body += 'event: error\ndata: {"error": "quota exceeded", "status_code": 429}\n\n'
+        elif prompt == 'fail without status':
+            body += 'event: error\ndata: {"error": "stream broke"}\n\n'
+        else:
+            body += 'data: [DONE]\n\n'
+        return httpx.Response(200, text=body, headers={'content-type': 'text/event-stream'})
+
+    async def run(prompt):
+        async with make_client(handler) as client:
+            return [text async for text in client.text_stream(prompt)]
+
+    assert asyncio.run(run('x')) == ['Hel', 'lo']
+    # The status code of the error event is kept, so a quota error can be told from a gateway failure
+    with pytest.raises(GenAI_Client_Error) as e:
+        asyncio.run(run('fail'))
+    assert e.value.status_code == 429
+    with pytest.raises(GenAI_Client_Error) as e:
+        asyncio.run(run('fail without status'))
+    assert e.value.status_code == 502
+
+
+def test_stream_retries_until_the_response_starts():
+    calls = []
+
+    def handler(request):
+        calls.append(json.loads(request.content))
+        if len(calls) == 1:
+            raise httpx.ConnectError('connection refused')
+        if len(calls) == 2:
+            return httpx.Response(429, text='quota exceeded', headers={'retry-after': '0'})
+        if len(calls) == 3:
+            return httpx.Response(503, text='model loading')
+        return httpx.Response(200, text='data: {"text": "Hello"}\n\ndata: [DONE]\n\n', headers={'content-type': 'text/event-stream'})
+
+    async def run(**kwargs):
+        async with make_client(handler, **kwargs) as client:
+            return [text async for text in client.text_stream('x', preflight='reject')]
+
+    assert asyncio.run(run()) == ['Hello']
+    assert len(calls) == 4
+    assert calls[-1]['preflight'] == 'reject'
+
+    # Out of retries, the last status is raised
+    calls.clear()
+    with pytest.raises(GenAI_Client_Error) as e:
+        asyncio.run(run(max_retries=1))
+    assert e.value.status_code == 429 and len(calls) == 2
+
+
+def test_gemini_stream_sends_preflight():
+    payloads = []
+
+    def handler(request):
+        payloads.append(json.loads(request.content))
+        return httpx.Response(200, text='data: {"text": "Hi"}\n\ndata: [DONE]\n\n', headers={'content-type': 'text/event-stream'})
+
+    async def run():
+        async with make_client(handler) as client:
+            return [event async for event in client.gemini_stream('x', preflight='truncate')]
+
+    assert asyncio.run(run()) == [{'text': 'Hi'}]
+    assert payloads[0]['preflight'] == 'truncate'
+
+
+def test_image_via_job():
+    polls = []
+
+    def handler(request):
+        if request.method == 'POST':
+            return httpx.Response(202, json={'job_id': 'abc', 'status': 'pending'})
+        if request.url.path == '/genai/image/jobs/abc':
+            polls.append(request)
+            return httpx.Response(200, json={'job_id': 'abc', 'status': 'succeeded' if len(polls) > 1 else 'running'})
+        return httpx.Response(200, content=b'png', headers={'content-type': 'image/png'})
+
+    async def run():
+        async with make_client(handler) as client:
+            return await client.image_via_job('test prompt', poll_interval=0.001)
+
+    assert asyncio.run(run()) == b'png'
+    assert len(polls) == 2
+
+
+def test_images():
+
+    def handler(request):
+        assert json.loads(request.content)['response_format'] == 'zip'
+        body = io.BytesIO()
+        with zipfile.ZipFile(body, 'w') as archive:
+            for i in range(3):
+                archive.writestr(f'image-{i}.png', f'png {i}')
+        return httpx.Response(200, content=body.getvalue(), headers={'content-type': 'application/zip'})
+
+    async def run():
+        async with make_client(handler) as client:
+            return await client.images('test prompt', number_of_images=3)
+
+    assert asyncio.run(run()) == [b'png 0', b'png 1', b'png 2']
@@ -0,0 +1,109 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http:#www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Measures throughput against latency for the batch scheduler, for a range of
+max batch sizes and max waits, under open-loop load: requests arrive at --rate
+per second, as a Poisson process, whether or not earlier ones have finished.
+
+    python benchmark_batching.py --rate 20 --requests 200
+    python benchmark_batching.py --model hf-internal-testing/tiny-stable-diffusion-pipe --device cpu --steps 10
+
+Without --model, the pipeline is Fake_Stable_Diffusion, whose calls take
+--step-ms per step, plus --batch-cost of that per additional image in a batch,
+as on an accelerator. Profile the real model's step time and batch cost on
+the target GPU to make the fake's numbers meaningful.
+'''
+
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+from utils.batcher import Batch_Scheduler
+from utils.fake_pipeline import Fake_Stable_Diffusion
+
+
+def percentile(sorted_values, pct):
+    '''Nearest-rank percentile of an already sorted list.'''
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))]
+
+
+async def run_load(scheduler, rate, requests, steps, seed):
+    arrivals = random.Random(seed)
+    latencies = []
+
+    async def one(i):
+        start = time.perf_counter()
+        await scheduler.submit(f'benchmark prompt {i}', seed=i, num_inference_steps=steps, guidance_scale=7.5)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    tasks = []
+    for i in range(requests):
+        tasks.append(asyncio.create_task(one(i)))
+        await asyncio.sleep(arrivals.expovariate(rate))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'throughput_ips': round(requests / elapsed, 2),
+        'latency_p50_s': round(percentile(latencies, 50), 3),
+        'latency_p95_s': round(percentile(latencies, 95), 3),
+        'latency_max_s': round(latencies[-1], 3),
+        'mean_batch_size': scheduler.status()['mean_batch_size'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput and latency of the Stable Diffusion batch scheduler.')
+    parser.add_argument('--model', default=None, help='A Hugging Face model to benchmark. Defaults to the fake pipeline')
+    parser.add_argument('--device', default=None, help='cuda or cpu, for --model')
+    parser.add_argument('--rate', type=float, default=10.0, help='Requests per second')
+    parser.add_argument('--requests', type=int, default=100, help='Requests per configuration')
+    parser.add_argument('--steps', type=int, default=25, help='Inference steps per request')
+    parser.add_argument('--batch-sizes', default='1,2,4,8', help='Max batch sizes to compare. 1 is no batching')
+    parser.add_argument('--waits-ms', default='0,25,100', help='Max waits to compare, in milliseconds')
+    parser.add_argument('--step-ms', type=float, default=10.0, help='Fake pipeline: time per step for one image')
+    parser.add_argument('--batch-cost', type=float, default=0.25, help='Fake pipeline: cost of each additional image, relative to the first')
+    parser.add_argument('--seed', type=int, default=0, help='Seeds the arrival times, so runs are comparable')
+    args = parser.parse_args()
+
+    if args.model:
+        from utils.model_util import Stable_Diffusion
+        pipeline = Stable_Diffusion(model_type=args.model, device=args.device)
+    else:
+        pipeline = Fake_Stable_Diffusion(step_seconds=args.step_ms / 1000, batch_cost=args.batch_cost)
+
+    results = []
+    for max_batch_size in [int(size) for size in args.batch_sizes.split(',')]:
+        for wait_ms in [float(wait) for wait in args.waits_ms.split(',')]:
+            if max_batch_size == 1 and wait_ms:
+                continue
+            scheduler = Batch_Scheduler(pipeline.get_images, max_batch_size=max_batch_size, max_wait=wait_ms / 1000)
+            result = {'max_batch_size': max_batch_size, 'max_wait_ms': wait_ms, **asyncio.run(run_load(scheduler, args.rate, args.requests, args.steps, args.seed))}
+            results.append(result)
+            print(json.dumps(result))
+
+    print()
+    print(f'{"batch":>6} {"wait ms":>8} {"img/s":>8} {"p50 s":>8} {"p95 s":>8} {"mean batch":>11}')
+    for r in results:
+        print(f'{r["max_batch_size"]:>6} {r["max_wait_ms"]:>8g} {r["throughput_ips"]:>8} {r["latency_p50_s"]:>8} {r["latency_p95_s"]:>8} {r["mean_batch_size"]:>11}')
+
+
+if __name__ == '__main__':
+    main()
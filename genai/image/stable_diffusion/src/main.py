@@ -12,12 +12,21 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from fastapi import FastAPI, Response
-from pydantic import BaseModel
+from fastapi import FastAPI, Response, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
 import requests
 import os
 import json
+import asyncio
+from typing import Literal
 from utils.model_util import Stable_Diffusion
+from utils.batcher import batch_scheduler_from_env
+from utils.sampling import sampling_settings, SCHEDULERS, PRESETS
+from utils.previews import latent_preview, data_url
+from utils.sse import sse_event, SSE_HEADERS
+from utils.image_cache import image_cache_from_env, cache_key, http_etag, etag_matches, http_cache_headers, file_chunks
+from utils.image_transcode import transcoder_from_env, is_original, variant_name, MEDIA_TYPES
 import logging
 from logging.config import dictConfig
 from utils.log_conf import log_config
@@ -45,13 +54,132 @@ app = FastAPI(
 MODEL_TYPE = os.environ['MODEL_TYPE']
 
 
-# Initialize model object
-model = Stable_Diffusion(model_type=MODEL_TYPE)
+# Initialize model object. SD_DEVICE defaults to cuda when there is a GPU.
+model = Stable_Diffusion(model_type=MODEL_TYPE, device=os.environ.get('SD_DEVICE') or None)
+
+# Concurrent requests with the same settings share one pipeline call
+batcher = batch_scheduler_from_env(model.get_images)
+
+# Seeded generations are reproducible, so their images are kept on disk and served from there
+image_cache = image_cache_from_env()
+
+# Encodes and resizes image variants on worker threads, off the event loop
+transcoder = transcoder_from_env()
+
+
+Preset = Literal['draft', 'fast', 'balanced', 'quality']
+Scheduler = Literal['default', 'dpm++', 'dpm++_karras', 'unipc', 'euler', 'euler_a', 'ddim']
 
 
 # Set fastapi payload input structure for POST
 class Payload(BaseModel):
     prompt: str
+    seed: int | None = None
+    # A named quality/latency trade-off (see /presets). The settings below override it.
+    preset: Preset | None = None
+    scheduler: Scheduler | None = None
+    num_inference_steps: int | None = Field(None, ge=1, le=150)
+    guidance_scale: float | None = Field(None, ge=0, le=30)
+    # The model's native size when not given. Stable Diffusion needs multiples of 8.
+    width: int | None = Field(None, ge=128, le=1024, multiple_of=8)
+    height: int | None = Field(None, ge=128, le=1024, multiple_of=8)
+    # The image encoding. quality applies to webp and jpeg; max_dim shrinks the image to fit in max_dim x max_dim.
+    format: Literal['png', 'webp', 'jpeg'] | None = 'png'
+    quality: int | None = Field(None, ge=1, le=100)
+    max_dim: int | None = Field(None, ge=16, le=4096)
+
+
+class Payload_Stream(Payload):
+    # Send a low-resolution preview every preview_every steps; 0 sends none
+    preview_every: int | None = Field(5, ge=0, le=150)
+
+
+async def generate_image(prompt, seed=None, settings=None, image_format='png', quality=None, max_dim=None, on_progress=None, as_file=False):
+    '''
+    Generates an image with the given sampling_settings and encodes it as
+    asked, or serves it from the cache when the same prompt, seed and settings
+    were generated before. Variants are cached alongside the original image,
+    and made from the cached original when only it is cached.
+
+    Returns the encoded image, or with as_file, a cache hit as the cached
+    file, open, for the caller to stream and close. on_progress is passed to
+    the batch scheduler, and not called on a cache hit.
+    '''
+    settings = settings or sampling_settings()
+    original = is_original(image_format, max_dim)
+    if image_cache is None or seed is None:
+        img = await batcher.submit(prompt, seed=seed, on_progress=on_progress, **settings)
+        if not original:
+            img = await transcoder.transcode(img, image_format, quality, max_dim)
+        return img
+
+    # Include every parameter that changes the image, so a change to the defaults is a miss
+    key = cache_key(model=MODEL_TYPE, prompt=prompt, seed=seed, **settings)
+    name = variant_name(key, image_format, quality, max_dim)
+    img = await asyncio.to_thread(image_cache.open if as_file else image_cache.get, name)
+    if img is not None:
+        return img
+
+    img = await asyncio.to_thread(image_cache.get, variant_name(key)) if not original else None
+    if img is None:
+        img = await batcher.submit(prompt, seed=seed, on_progress=on_progress, **settings)
+        await asyncio.to_thread(image_cache.put, variant_name(key), img)
+    if not original:
+        img = await transcoder.transcode(img, image_format, quality, max_dim)
+        await asyncio.to_thread(image_cache.put, name, img)
+    return img
+
+
+async def image_response(prompt, seed=None, settings=None, image_format='png', quality=None, max_dim=None):
+    img = await generate_image(prompt, seed, settings, image_format, quality, max_dim, as_file=True)
+    if isinstance(img, bytes):
+        return Response(content=img, media_type=MEDIA_TYPES[image_format])
+    # A cache hit is streamed from its file, without reading it into memory first
+    size = os.fstat(img.fileno()).st_size
+    return StreamingResponse(file_chunks(img), media_type=MEDIA_TYPES[image_format], headers={'Content-Length': str(size)})
+
+
+async def generate_image_events(prompt, seed=None, settings=None, image_format='png', quality=None, max_dim=None, preview_every=5):
+    '''
+    Generates an image as server-sent events: a "progress" event after every
+    denoising step, a "preview" event with a low-resolution JPEG every
+    preview_every steps, then an "image" event with the image, and
+    "data: [DONE]". A cached image is sent at once, without progress.
+
+    The pipeline thread only queues the events. It copies the latents, which
+    are a few KB, on preview steps only, and previews are encoded here, so the
+    denoising loop does not wait for them or for the client.
+    '''
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def on_progress(step, total_steps, latents):
+        preview = latents() if preview_every and step % preview_every == 0 and step < total_steps else None
+        loop.call_soon_threadsafe(events.put_nowait, (step, total_steps, preview))
+
+    task = asyncio.ensure_future(generate_image(prompt, seed, settings, image_format, quality, max_dim, on_progress))
+    task.add_done_callback(lambda _: events.put_nowait(None))
+    try:
+        while (event := await events.get()) is not None:
+            step, total_steps, preview = event
+            if events.qsize() and preview is None:
+                # Progress is only worth sending when it is the newest
+                continue
+            yield sse_event({'step': step, 'total_steps': total_steps}, event='progress')
+            if preview is not None:
+                preview = await asyncio.to_thread(latent_preview, preview)
+                yield sse_event({'step': step, 'total_steps': total_steps, 'image': data_url(preview, 'image/jpeg')}, event='preview')
+
+        img = task.result()
+        yield sse_event({'image': data_url(img, MEDIA_TYPES[image_format]), 'seed': seed}, event='image')
+    except Exception as e:
+        logger.warning(f'[ EXCEPTION ] {e}')
+        yield sse_event({'error': str(e)}, event='error')
+        return
+    finally:
+        # The client went away; a request still waiting for its batch is dropped from it
+        task.cancel()
+    yield 'data: [DONE]\n\n'
 
 
 # Routes
@@ -62,26 +190,73 @@ async def health_check():
     return {'status': 'ok'}
 
 
+@app.get("/batching", include_in_schema=False)
+async def batching_status():
+    return batcher.status()
+
+
+@app.get("/presets")
+async def presets():
+    return {'presets': PRESETS, 'schedulers': list(SCHEDULERS)}
+
+
 @app.get("/")
-async def generate_image_get(prompt: str):
+async def generate_image_get(
+        request: Request,
+        prompt: str,
+        seed: int = None,
+        preset: Preset = None,
+        scheduler: Scheduler = None,
+        num_inference_steps: int = Query(None, ge=1, le=150),
+        guidance_scale: float = Query(None, ge=0, le=30),
+        width: int = Query(None, ge=128, le=1024, multiple_of=8),
+        height: int = Query(None, ge=128, le=1024, multiple_of=8),
+        format: Literal['png', 'webp', 'jpeg'] = 'png',
+        quality: int = Query(None, ge=1, le=100),
+        max_dim: int = Query(None, ge=16, le=4096),
+    ):
+    settings = sampling_settings(preset, scheduler, num_inference_steps, guidance_scale, width, height)
+    if seed is None:
+        etag = None
+    else:
+        # A seeded request gives the same image, so browsers and CDNs may keep the
+        # response, and revalidate it without the model being called. With the
+        # image cache on, it is served from or stored in the cache, so its bytes never change.
+        etag = http_etag(model=MODEL_TYPE, prompt=prompt, seed=seed, **settings, format=format, quality=quality, max_dim=max_dim)
+        if etag_matches(request.headers.get('if-none-match'), etag):
+            return Response(status_code=304, headers=http_cache_headers(etag, cached=image_cache is not None))
     try:
-        img = model.get_image(prompt)
-        return Response(content=img, media_type="image/png")
+        response = await image_response(prompt, seed, settings, format, quality, max_dim)
+        response.headers.update(http_cache_headers(etag, cached=image_cache is not None) if etag else {'Cache-Control': 'no-store'})
+        return response
 
     except Exception as e:
         logger.warning(f'[ EXCEPTION ] {e}')
-        return {"error": "Invalid text prompt"}, 400
+        return JSONResponse(status_code=400, content={"error": "Invalid text prompt"})
 
 
 @app.post("/")
 async def generate_image_post(payload: Payload):
     try:
-        img = model.get_image(payload.prompt)
-        return Response(content=img, media_type="image/png")
+        settings = sampling_settings(
+            payload.preset, payload.scheduler, payload.num_inference_steps, payload.guidance_scale, payload.width, payload.height)
+        return await image_response(payload.prompt, payload.seed, settings, payload.format, payload.quality, payload.max_dim)
 
     except Exception as e:
         logger.warning(f'[ EXCEPTION ] {e}')
-        return {"error": "Invalid text prompt"}, 400
+        return JSONResponse(status_code=400, content={"error": "Invalid text prompt"})
+
+
+@app.post("/stream")
+async def generate_image_stream(payload: Payload_Stream):
+    settings = sampling_settings(
+        payload.preset, payload.scheduler, payload.num_inference_steps, payload.guidance_scale, payload.width, payload.height)
+    return StreamingResponse(
+        generate_image_events(
+            payload.prompt, payload.seed, settings, payload.format, payload.quality, payload.max_dim, payload.preview_every),
+        media_type='text/event-stream',
+        headers=SSE_HEADERS,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,66 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http:#www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pytest -s -W ignore
+
+import asyncio
+from utils.batcher import Batch_Scheduler
+from utils.fake_pipeline import Fake_Stable_Diffusion
+
+
+def test_concurrent_prompts_share_a_batch():
+    pipeline = Fake_Stable_Diffusion(step_seconds=0.001)
+    scheduler = Batch_Scheduler(pipeline.get_images, max_batch_size=4, max_wait=0.05)
+
+    async def run():
+        fast = [scheduler.submit(f'castle {i}', seed=i, num_inference_steps=20) for i in range(6)]
+        slow = [scheduler.submit(f'castle {i}', seed=i, num_inference_steps=50) for i in range(2)]
+        return await asyncio.gather(*fast, *slow)
+
+    images = asyncio.run(run())
+    # 20-step requests fill a batch of 4, then the rest wait out max_wait;
+    # 50-step requests are not compatible with them and run apart
+    assert sorted(pipeline.batch_sizes) == [2, 2, 4]
+    assert len(set(images)) == 8
+    # Each caller gets the image of its own prompt and seed
+    assert images[0] == pipeline.get_images(['castle 0'], [0], num_inference_steps=20)[0]
+    assert scheduler.status()['items_run'] == 8
+
+
+def test_batches_form_while_the_pipeline_is_busy():
+    pipeline = Fake_Stable_Diffusion(step_seconds=0.002)
+    scheduler = Batch_Scheduler(pipeline.get_images, max_batch_size=8, max_wait=0)
+
+    async def run():
+        first = asyncio.ensure_future(scheduler.submit('first', num_inference_steps=20))
+        await asyncio.sleep(0.01)
+        # These arrive while the first call runs, and go together in the next one
+        rest = [scheduler.submit(f'next {i}', num_inference_steps=20) for i in range(5)]
+        await asyncio.gather(first, *rest)
+
+    asyncio.run(run())
+    assert pipeline.batch_sizes == [1, 5]
+
+
+def test_a_failed_batch_fails_its_callers():
+
+    def run_batch(prompts, seeds, **settings):
+        raise RuntimeError('CUDA out of memory')
+
+    scheduler = Batch_Scheduler(run_batch, max_batch_size=2, max_wait=0.01)
+
+    async def run():
+        return await asyncio.gather(scheduler.submit('a'), scheduler.submit('b'), return_exceptions=True)
+
+    assert [str(e) for e in asyncio.run(run())] == ['CUDA out of memory'] * 2
@@ -0,0 +1,75 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http:#www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pytest -s -W ignore
+# Runs the real pipeline code on CPU with a tiny random-weight model. Skipped
+# without diffusers and torch, or when the model cannot be downloaded.
+
+import io
+import os
+import pytest
+import numpy as np
+from PIL import Image
+
+pytest.importorskip('torch')
+pytest.importorskip('diffusers')
+
+from utils.model_util import Stable_Diffusion
+
+TEST_MODEL = os.environ.get('SD_TEST_MODEL', 'hf-internal-testing/tiny-stable-diffusion-pipe')
+SETTINGS = {'num_inference_steps': 3, 'width': 64, 'height': 64}
+
+
+@pytest.fixture(scope='module')
+def model():
+    try:
+        return Stable_Diffusion(TEST_MODEL, device='cpu', safety_checker=False)
+    except OSError as e:
+        pytest.skip(f'{TEST_MODEL} is not available. {e}')
+
+
+def pixels(png):
+    return np.asarray(Image.open(io.BytesIO(png)), dtype=np.int16)
+
+
+def test_seeded_image_does_not_depend_on_the_batch(model):
+    steps = []
+
+    def on_step(step, total_steps, latents):
+        steps.append((step, total_steps, latents(1).shape))
+
+    alone = model.get_images(['castle'], [7], **SETTINGS)[0]
+    batch = model.get_images(['harbor', 'castle'], [None, 7], on_step=on_step, **SETTINGS)
+
+    assert len(batch) == 2
+    # Batched matrix products may round differently, so allow off-by-one pixels
+    assert np.abs(pixels(alone) - pixels(batch[1])).max() <= 1
+    assert np.abs(pixels(alone) - pixels(model.get_images(['castle'], [8], **SETTINGS)[0])).max() > 1
+    # Latents have 4 channels, at the VAE's fraction of the image size (an eighth for real models)
+    latent_size = SETTINGS['width'] // model.pipe.vae_scale_factor
+    # Every denoising step is reported once. PNDM, the default scheduler of SD 1.x, adds a timestep to the 3 asked for.
+    total_steps = len(model.pipe.scheduler.timesteps)
+    assert steps == [(step, total_steps, (4, latent_size, latent_size)) for step in range(1, total_steps + 1)]
+
+
+def test_schedulers_swap_without_reloading(model):
+    default = model.get_images(['castle'], [7], **SETTINGS)[0]
+    dpm = model.get_images(['castle'], [7], scheduler='dpm++', **SETTINGS)[0]
+
+    assert type(model.pipe.scheduler).__name__ == 'DPMSolverMultistepScheduler'
+    assert model.scheduler('dpm++') is model.pipe.scheduler
+    assert model.scheduler('dpm++').config.algorithm_type == 'dpmsolver++'
+    assert not np.array_equal(pixels(default), pixels(dpm))
+    # Swapping back gives the default scheduler's image again
+    assert model.get_images(['castle'], [7], **SETTINGS)[0] == default
@@ -0,0 +1,67 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http:#www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pytest -s -W ignore
+import io
+import asyncio
+import numpy as np
+from PIL import Image
+from utils.batcher import Batch_Scheduler
+from utils.fake_pipeline import Fake_Stable_Diffusion
+from utils.previews import latent_preview
+
+
+def test_progress_reaches_only_the_requests_that_want_it():
+    pipeline = Fake_Stable_Diffusion(step_seconds=0.001, size=128)
+    scheduler = Batch_Scheduler(pipeline.get_images, max_batch_size=2, max_wait=0.02)
+    steps, previews = [], []
+
+    def on_progress(step, total_steps, latents):
+        steps.append((step, total_steps))
+        if step % 4 == 0:
+            previews.append(latent_preview(latents()))
+
+    async def run():
+        return await asyncio.gather(
+            scheduler.submit('castle', seed=1, on_progress=on_progress, num_inference_steps=10),
+            scheduler.submit('harbor', seed=1, num_inference_steps=10),
+        )
+
+    images = asyncio.run(run())
+    assert pipeline.batch_sizes == [2]
+    assert steps == [(step, 10) for step in range(1, 11)]
+    # Previews are an eighth of the image size
+    assert [Image.open(io.BytesIO(preview)).size for preview in previews] == [(16, 16)] * 2
+    # Reporting progress does not change the image
+    assert images[0] == pipeline.get_images(['castle'], [1], num_inference_steps=10)[0]
+
+
+def test_a_failed_progress_callback_does_not_fail_the_batch():
+
+    def on_progress(step, total_steps, latents):
+        raise RuntimeError('client went away')
+
+    pipeline = Fake_Stable_Diffusion(step_seconds=0.001)
+    scheduler = Batch_Scheduler(pipeline.get_images, max_wait=0)
+    image = asyncio.run(scheduler.submit('castle', on_progress=on_progress, num_inference_steps=3))
+    assert image.startswith(b'\x89PNG')
+
+
+def test_latent_preview_maps_latents_to_rgb():
+    latents = np.zeros((4, 8, 8), dtype=np.float32)
+    latents[3] = -1
+    pixels = np.asarray(Image.open(io.BytesIO(latent_preview(latents))))
+    assert pixels.shape == (8, 8, 3)
+    # The fourth channel runs from yellow to blue
+    assert pixels[..., 2].mean() > pixels[..., 1].mean() > pixels[..., 0].mean()
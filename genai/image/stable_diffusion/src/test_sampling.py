@@ -0,0 +1,44 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http:#www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pytest -s -W ignore
+import asyncio
+from utils.batcher import Batch_Scheduler
+from utils.fake_pipeline import Fake_Stable_Diffusion
+from utils.sampling import sampling_settings, SCHEDULERS, PRESETS, DEFAULT_PRESET
+
+
+def test_explicit_settings_override_the_preset():
+    assert sampling_settings() == {**PRESETS[DEFAULT_PRESET], 'width': None, 'height': None}
+    settings = sampling_settings('fast', num_inference_steps=12, width=512)
+    assert settings == {'scheduler': 'dpm++', 'num_inference_steps': 12, 'guidance_scale': 7.5, 'width': 512, 'height': None}
+    # guidance_scale=0 is a setting, not a missing one
+    assert sampling_settings('balanced', guidance_scale=0)['guidance_scale'] == 0
+    assert all(preset['scheduler'] in SCHEDULERS for preset in PRESETS.values())
+
+
+def test_requests_batch_by_their_settings():
+    pipeline = Fake_Stable_Diffusion(step_seconds=0.001)
+    scheduler = Batch_Scheduler(pipeline.get_images, max_batch_size=4, max_wait=0.02)
+
+    async def run():
+        fast = [scheduler.submit(f'castle {i}', seed=1, **sampling_settings('fast')) for i in range(2)]
+        fast_ddim = [scheduler.submit(f'castle {i}', seed=1, **sampling_settings('fast', scheduler='ddim')) for i in range(2)]
+        small = [scheduler.submit('castle 0', seed=1, **sampling_settings('fast', width=128, height=256))]
+        return await asyncio.gather(*fast, *fast_ddim, *small)
+
+    images = asyncio.run(run())
+    assert sorted(pipeline.batch_sizes) == [1, 2, 2]
+    # A scheduler or size gives a different image for the same prompt and seed
+    assert len({images[0], images[2], images[4]}) == 3
@@ -0,0 +1,171 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http:#www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import time
+import asyncio
+import logging
+import functools
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+logger = logging.getLogger('app-logger')
+
+
+class Batch_Item:
+
+    def __init__(self, prompt, seed, future, on_progress=None):
+        self.prompt = prompt
+        self.seed = seed
+        self.future = future
+        self.on_progress = on_progress
+        self.arrived = time.monotonic()
+
+
+class Batch_Scheduler:
+    '''
+    Collects concurrent generations into batches, so the accelerator runs one
+    pipeline call for several prompts instead of one call per prompt.
+
+    Requests are compatible, and may share a batch, when their settings (steps,
+    guidance, size, ...) are equal; prompts and seeds vary per item. A batch
+    runs once it has max_batch_size items, or once its oldest item has waited
+    max_wait seconds. One batch runs at a time, on a dedicated thread, and the
+    requests that arrive meanwhile form the next one, so under load batches
+    fill up without waiting.
+
+    run_batch(prompts, seeds, **settings) runs the pipeline and returns one
+    result per prompt, in order. When a request in the batch wants progress,
+    it is also passed on_step(step, total_steps, latents), to call after each
+    denoising step, where latents(i) returns the latents of the i-th prompt.
+    '''
+
+    def __init__(self, run_batch, max_batch_size=4, max_wait=0.05):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batches_run = 0
+        self.items_run = 0
+        self._pending = OrderedDict()
+        self._wakeup = None
+        self._worker = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='batch')
+
+    async def submit(self, prompt, seed=None, on_progress=None, **settings):
+        '''
+        Queues one prompt, and returns its result once its batch has run.
+        on_progress(step, total_steps, latents) is called on the batch thread
+        after each denoising step, with latents() returning the prompt's
+        latents. It must return quickly, since the pipeline waits for it.
+        '''
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.create_task(self._run())
+        key = tuple(sorted(settings.items()))
+        item = Batch_Item(prompt, seed, asyncio.get_running_loop().create_future(), on_progress)
+        self._pending.setdefault(key, []).append(item)
+        self._wakeup.set()
+        return await item.future
+
+    def pending(self):
+        return sum(len(items) for items in self._pending.values())
+
+    def _next_batch(self):
+        '''
+        Returns (key, items, wait): the batch of the oldest waiting request, and
+        how long to wait for it to fill up. A wait of 0 means it is ready.
+        '''
+        key, items = next(iter(self._pending.items()))
+        items[:] = [item for item in items if not item.future.done()]
+        if not items:
+            del self._pending[key]
+            return None, [], 0
+        wait = items[0].arrived + self.max_wait - time.monotonic()
+        if len(items) >= self.max_batch_size or wait <= 0:
+            batch, self._pending[key] = items[:self.max_batch_size], items[self.max_batch_size:]
+            if not self._pending[key]:
+                del self._pending[key]
+            else:
+                # The rest of this key waits behind the other settings' requests
+                self._pending.move_to_end(key)
+            return key, batch, 0
+        return key, [], wait
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            key, batch, wait = self._next_batch()
+            if wait > 0:
+                # Wait for the batch to fill up, or for its oldest request's max_wait
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if not batch:
+                continue
+
+            settings = dict(key)
+            if any(item.on_progress for item in batch):
+                settings['on_step'] = functools.partial(self._on_step, batch)
+            try:
+                results = await loop.run_in_executor(
+                    self._executor,
+                    lambda: self.run_batch([item.prompt for item in batch], [item.seed for item in batch], **settings),
+                )
+            except Exception as e:
+                logger.warning(f'[ EXCEPTION ] Batch of {len(batch)} failed. {e}')
+                for item in batch:
+                    if not item.future.done():
+                        item.future.set_exception(e)
+                continue
+            self.batches_run += 1
+            self.items_run += len(batch)
+            for item, result in zip(batch, results):
+                if not item.future.done():
+                    item.future.set_result(result)
+
+    @staticmethod
+    def _on_step(batch, step, total_steps, latents):
+        for i, item in enumerate(batch):
+            if item.on_progress is None or item.future.done():
+                continue
+            try:
+                item.on_progress(step, total_steps, functools.partial(latents, i))
+            except Exception as e:
+                # A failed progress report costs the report, not the generation
+                logger.warning(f'[ EXCEPTION ] Progress callback failed. {e}')
+
+    def status(self):
+        return {
+            'pending': self.pending(),
+            'batches_run': self.batches_run,
+            'items_run': self.items_run,
+            'mean_batch_size': round(self.items_run / self.batches_run, 2) if self.batches_run else None,
+        }
+
+
+def batch_scheduler_from_env(run_batch):
+    '''SD_MAX_BATCH_SIZE prompts at most run together, waiting at most SD_MAX_BATCH_WAIT_MS for a batch to fill.'''
+    return Batch_Scheduler(
+        run_batch,
+        max_batch_size=int(os.environ.get('SD_MAX_BATCH_SIZE', '4')),
+        max_wait=int(os.environ.get('SD_MAX_BATCH_WAIT_MS', '50')) / 1000,
+    )
@@ -0,0 +1,57 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http:#www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import time
+import zlib
+import numpy as np
+from PIL import Image
+
+
+class Fake_Stable_Diffusion:
+    '''
+    A stand-in for Stable_Diffusion that runs on CPU without torch or model
+    weights, for tests and for benchmarking the batch scheduler. A pipeline
+    call sleeps like an accelerator would: step_seconds per step for the first
+    image, plus batch_cost of that for each additional image in the batch.
+    Images are solid colors derived from the prompt, seed and settings, and
+    are size x size unless a width or height is given.
+    '''
+
+    def __init__(self, step_seconds=0.01, batch_cost=0.25, size=64):
+        self.step_seconds = step_seconds
+        self.batch_cost = batch_cost
+        self.size = size
+        self.batch_sizes = []
+
+    def call_seconds(self, batch_size, num_inference_steps):
+        return self.step_seconds * num_inference_steps * (1 + self.batch_cost * (batch_size - 1))
+
+    def get_images(self, prompts, seeds, num_inference_steps=50, guidance_scale=7.5, scheduler='default', width=None, height=None, on_step=None):
+        self.batch_sizes.append(len(prompts))
+        if on_step is None:
+            time.sleep(self.call_seconds(len(prompts), num_inference_steps))
+        else:
+            # Latents are noise, at an eighth of the image size like Stable Diffusion's
+            shape = (4, (height or self.size) // 8, (width or self.size) // 8)
+            for step in range(1, num_inference_steps + 1):
+                time.sleep(self.call_seconds(len(prompts), 1))
+                on_step(step, num_inference_steps, lambda i: np.random.default_rng(step * len(prompts) + i).standard_normal(shape, dtype=np.float32))
+        images = []
+        for prompt, seed in zip(prompts, seeds):
+            color = zlib.crc32(f'{prompt}\n{seed}\n{num_inference_steps}\n{guidance_scale}\n{scheduler}'.encode()).to_bytes(4, 'big')[:3]
+            buffer = io.BytesIO()
+            Image.new('RGB', (width or self.size, height or self.size), tuple(color)).save(buffer, format='PNG')
+            images.append(buffer.getvalue())
+        return images
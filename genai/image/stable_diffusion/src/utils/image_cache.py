@@ -0,0 +1,205 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# This file is shared by vertex_image_api and image/stable_diffusion. Keep the copies identical.
+
+import os
+import json
+import uuid
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+
+def cache_key(**params):
+    '''
+    The cache key of a generation: a sha256 of its parameters, such as model,
+    prompt, seed, size and steps. Only parameters that change the image belong
+    in it. Images are cached under file names made from the key, such as
+    "<key>-0.png".
+    '''
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+
+# How long browsers and CDNs may reuse a seeded image. The same request always gives the same bytes.
+HTTP_MAX_AGE = int(os.environ.get('IMAGE_HTTP_MAX_AGE', str(365 * 24 * 3600)))
+
+
+def http_etag(**params):
+    '''
+    A strong ETag for a deterministic response, made from every parameter that
+    changes its bytes, so it is known before the image is generated.
+    '''
+    return f'"{cache_key(**params)}"'
+
+
+def etag_matches(if_none_match, etag):
+    '''Whether an If-None-Match header matches etag. The comparison is weak, as RFC 9110 specifies for If-None-Match.'''
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    return any(tag.strip().removeprefix('W/') == etag.removeprefix('W/') for tag in if_none_match.split(','))
+
+
+def http_cache_headers(etag, cached=True):
+    '''
+    Headers for a seeded response. Only the image cache makes the bytes
+    identical on every request: without it the model runs again, and may round
+    a few pixels differently. Such responses get a weak ETag, and are
+    revalidated on every use instead of being kept as immutable.
+    '''
+    if cached:
+        return {'ETag': etag, 'Cache-Control': f'public, max-age={HTTP_MAX_AGE}, immutable'}
+    return {'ETag': f'W/{etag}', 'Cache-Control': 'public, no-cache'}
+
+
+# Cached images are streamed to the client in chunks of this size
+FILE_CHUNK_BYTES = 64 * 1024
+
+
+def file_chunks(f, chunk_size=FILE_CHUNK_BYTES):
+    '''Yields an open file's contents, for a StreamingResponse, and closes it when they have been sent.'''
+    with f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+class Image_Cache:
+    '''
+    Generated images on local disk, named after their cache_key, holding at
+    most max_bytes and evicting the least recently used. Only generations with
+    a seed are reproducible, so only they should be cached.
+
+    Files are written to a temporary name and renamed into place, so readers
+    never see a partial image. open returns the file opened under the lock
+    rather than a path, since a concurrent put may evict the file before a
+    response could open it, and an open file outlives its eviction. The
+    LRU order is kept in memory and in the files' modification times,
+    so it survives restarts. Several processes may share the directory; each
+    evicts only what it knows about, and a file evicted by another is a miss.
+    '''
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        '''Indexes the images already on disk, oldest first, and removes temporary files left by a crash.'''
+        found = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if name.endswith('.tmp'):
+                    os.remove(path)
+                else:
+                    stat = os.stat(path)
+                    found.append((stat.st_mtime, name, stat.st_size))
+            except FileNotFoundError:
+                pass
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self.total_bytes += size
+        self._evict()
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def open(self, name):
+        '''
+        Returns the cached image as a file open for reading, or None. The caller
+        closes it, usually by streaming it with file_chunks.
+        '''
+        path = self.path(name)
+        with self._lock:
+            if name in self._entries:
+                try:
+                    # Once open, the file can be read even if it is evicted
+                    f = open(path, 'rb')
+                except FileNotFoundError:
+                    self.total_bytes -= self._entries.pop(name)
+                else:
+                    try:
+                        os.utime(f.fileno())
+                    except OSError:
+                        pass
+                    self._entries.move_to_end(name)
+                    self.hits += 1
+                    return f
+            self.misses += 1
+            return None
+
+    def get(self, name):
+        '''Returns the cached image's bytes, or None. For callers that need the whole image, such as the transcoder.'''
+        f = self.open(name)
+        if f is None:
+            return None
+        with f:
+            return f.read()
+
+    def put(self, name, data):
+        '''Stores an image, evicting the least recently used ones to stay under max_bytes. Returns its path.'''
+        path = self.path(name)
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            # A full or read-only disk costs the cache, not the request
+            logging.warning(f'Could not cache image {name}. {e}')
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return None
+        with self._lock:
+            if name in self._entries:
+                self.total_bytes -= self._entries.pop(name)
+            self._entries[name] = len(data)
+            self.total_bytes += len(data)
+            self._evict()
+        return path
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self._entries:
+            name, size = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(self.path(name))
+            except FileNotFoundError:
+                pass
+
+    def status(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self.total_bytes, 'max_bytes': self.max_bytes, 'hits': self.hits, 'misses': self.misses}
+
+
+def image_cache_from_env():
+    '''
+    IMAGE_CACHE_DIR is where images are kept. IMAGE_CACHE_MAX_BYTES caps their
+    total size (default 1 GiB); 0 turns the cache off.
+    '''
+    max_bytes = int(os.environ.get('IMAGE_CACHE_MAX_BYTES', str(1024 ** 3)))
+    if max_bytes <= 0:
+        return None
+    return Image_Cache(os.environ.get('IMAGE_CACHE_DIR', '/tmp/image-cache'), max_bytes)
@@ -12,42 +12,101 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import random
 from io import BytesIO
+import diffusers
 from diffusers import StableDiffusionPipeline
 from diffusers.pipelines.stable_diffusion import StableDiffusionSafetyChecker
 from transformers import CLIPImageProcessor
 import torch
+from utils.sampling import SCHEDULERS
+
+
+def png_bytes(image):
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
 
 
 class Stable_Diffusion:
 
-    def __init__(self, model_type):
+    def __init__(self, model_type, device=None, safety_checker=True):
         # Model Type should reference a image generation model from HuggingFace.
         # https://huggingface.co/models
         # Example MODEL_TYPE = 'runwayml/stable-diffusion-v1-5'
         self.model_type = model_type
+        # CPU runs, such as a tiny test pipeline, use float32, which CPUs support
+        self.device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
 
-        # Load Model
+        # Load Model. Only tests turn the safety checker off, to skip its 1 GB of weights.
+        checker = {
+            'safety_checker': StableDiffusionSafetyChecker.from_pretrained("CompVis/stable-diffusion-safety-checker"),
+            'feature_extractor': CLIPImageProcessor.from_pretrained("openai/clip-vit-base-patch32"),
+        } if safety_checker else {'safety_checker': None, 'requires_safety_checker': False}
         self.pipe = StableDiffusionPipeline.from_pretrained(
             self.model_type,
-            safety_checker=StableDiffusionSafetyChecker.from_pretrained("CompVis/stable-diffusion-safety-checker"),
-            feature_extractor=CLIPImageProcessor.from_pretrained("openai/clip-vit-base-patch32"),
-            torch_dtype=torch.float16)
-        self.pipe = self.pipe.to("cuda")
+            **checker,
+            torch_dtype=torch.float16 if self.device == 'cuda' else torch.float32)
+        self.pipe = self.pipe.to(self.device)
+        self.schedulers = {'default': self.pipe.scheduler}
 
 
-    def get_image(self, prompt, num_inference_steps=50, guidance_scale=7.5):
-        try:
-            results = self.pipe(prompt, num_inference_steps=num_inference_steps, guidance_scale=guidance_scale)
-            print(results)
-            image = results.images[0]
+    def scheduler(self, name):
+        '''
+        Returns the named scheduler, created from the model's scheduler config
+        on first use. Schedulers hold no weights, so switching between them
+        costs nothing, and the pipeline is never reloaded.
+        '''
+        if name not in self.schedulers:
+            class_name, config = SCHEDULERS[name]
+            self.schedulers[name] = getattr(diffusers, class_name).from_config(self.schedulers['default'].config, **config)
+        return self.schedulers[name]
+
+
+    def get_images(self, prompts, seeds, num_inference_steps=50, guidance_scale=7.5, scheduler='default', width=None, height=None, on_step=None):
+        '''
+        Runs several prompts as one pipeline call, returning a PNG per prompt.
+        Each prompt has its own generator, so a seeded image does not depend on
+        the other prompts in the batch.
 
-            # Process and format image
-            buffer = BytesIO()
-            image.save(buffer, format="PNG")
-            image_bytes = buffer.getvalue()
+        Schedulers keep per-call state, so the scheduler is swapped into the
+        pipeline here, and calls must not overlap. The batch scheduler runs one
+        call at a time.
 
-            return image_bytes
+        on_step(step, total_steps, latents) is called after each denoising
+        step. latents(i) copies the i-th prompt's latents to the CPU, as a
+        float32 numpy array, so only the steps that need them pay for the copy.
+        '''
+        self.pipe.scheduler = self.scheduler(scheduler)
+        generator = None
+        if any(seed is not None for seed in seeds):
+            generator = [
+                torch.Generator(device=self.device).manual_seed(seed if seed is not None else random.randrange(2 ** 63))
+                for seed in seeds
+            ]
+        callback = None
+        if on_step is not None:
+
+            def callback(pipe, step, timestep, callback_kwargs):
+                latents = callback_kwargs['latents']
+                on_step(step + 1, pipe.num_timesteps, lambda i: latents[i].float().cpu().numpy())
+                return callback_kwargs
+
+        results = self.pipe(
+            list(prompts),
+            num_inference_steps=num_inference_steps,
+            guidance_scale=guidance_scale,
+            width=width,
+            height=height,
+            generator=generator,
+            callback_on_step_end=callback)
+        return [png_bytes(image) for image in results.images]
+
+
+    def get_image(self, prompt, num_inference_steps=50, guidance_scale=7.5, seed=None):
+        try:
+            # A seed makes the image reproducible, so it can be cached
+            return self.get_images([prompt], [seed], num_inference_steps=num_inference_steps, guidance_scale=guidance_scale)[0]
         except Exception as e:
             print(f'[ EXCEPTION ] {e}')
             return ''
@@ -0,0 +1,54 @@
+# Copyright 2024 Google LLC All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http:#www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Schedulers a request may choose, as (diffusers class, config overrides).
+# They are built from the pipeline's own scheduler config, so they share the
+# model's noise schedule. "default" is the scheduler the model ships with.
+SCHEDULERS = {
+    'default': None,
+    'dpm++': ('DPMSolverMultistepScheduler', {'algorithm_type': 'dpmsolver++'}),
+    'dpm++_karras': ('DPMSolverMultistepScheduler', {'algorithm_type': 'dpmsolver++', 'use_karras_sigmas': True}),
+    'unipc': ('UniPCMultistepScheduler', {}),
+    'euler': ('EulerDiscreteScheduler', {}),
+    'euler_a': ('EulerAncestralDiscreteScheduler', {}),
+    'ddim': ('DDIMScheduler', {}),
+}
+
+# Named trade-offs of quality against latency. Multistep solvers such as
+# DPM-Solver++ reach in 20 to 25 steps what the default scheduler needs 50 for.
+PRESETS = {
+    'draft': {'scheduler': 'dpm++', 'num_inference_steps': 10, 'guidance_scale': 7.0},
+    'fast': {'scheduler': 'dpm++', 'num_inference_steps': 20, 'guidance_scale': 7.5},
+    'balanced': {'scheduler': 'dpm++_karras', 'num_inference_steps': 25, 'guidance_scale': 7.5},
+    'quality': {'scheduler': 'default', 'num_inference_steps': 50, 'guidance_scale': 7.5},
+}
+
+# Without a preset, requests get what every request got before presets existed
+DEFAULT_PRESET = 'quality'
+
+
+def sampling_settings(preset=None, scheduler=None, num_inference_steps=None, guidance_scale=None, width=None, height=None):
+    '''
+    The pipeline settings of a request: its preset, with any explicitly given
+    setting taking precedence. A width or height of None is the model's native
+    size. Equal settings give equal images for the same prompt and seed, so the
+    result is also what batches are grouped by and what cache keys include.
+    '''
+    settings = dict(PRESETS[preset or DEFAULT_PRESET])
+    for name, value in (('scheduler', scheduler), ('num_inference_steps', num_inference_steps), ('guidance_scale', guidance_scale)):
+        if value is not None:
+            settings[name] = value
+    settings['width'] = width
+    settings['height'] = height
+    return settings